@@ -0,0 +1,56 @@
+"""Deterministic synthetic audio for benchmarks: music-like stems without shipping audio files."""
+import os
+
+import numpy as np
+import soundfile as sf
+
+SAMPLE_RATE = 44100
+STEMS = ["vocals", "drums", "bass", "other"]
+
+
+def synth_stem(name: str, seconds: float, sample_rate: int = SAMPLE_RATE, seed: int = 0):
+    """(frames, 2) float32 stand-in for one stem at 120 BPM, roughly shaped like the real thing."""
+    rng = np.random.default_rng(seed + STEMS.index(name))
+    frames = int(seconds * sample_rate)
+    t = np.arange(frames) / sample_rate
+    beat = 0.5  # seconds per beat at 120 BPM
+
+    if name == "drums":
+        # Decaying noise bursts on every beat, a click on the off-beats
+        phase = t % beat
+        mono = rng.standard_normal(frames) * np.exp(-phase * 30) * 0.5
+        mono += np.sin(2 * np.pi * 60 * t) * np.exp(-phase * 20) * 0.6
+    elif name == "bass":
+        # Root notes changing every bar
+        roots = np.array([55.0, 55.0, 73.4, 82.4])
+        freq = roots[(t // (beat * 4)).astype(int) % len(roots)]
+        mono = np.sin(2 * np.pi * np.cumsum(freq) / sample_rate) * 0.4
+    elif name == "vocals":
+        # A gliding "voice" with vibrato and a few formant-ish harmonics, phrased on/off
+        freq = 220 * (1 + 0.25 * np.sin(2 * np.pi * 0.25 * t)) * (1 + 0.01 * np.sin(2 * np.pi * 5 * t))
+        phase = 2 * np.pi * np.cumsum(freq) / sample_rate
+        mono = sum(np.sin(k * phase) / k for k in range(1, 6)) * 0.25
+        mono *= (np.sin(2 * np.pi * t / (beat * 8)) > -0.3)
+    else:
+        # Sustained chords plus a little noise
+        mono = sum(np.sin(2 * np.pi * f * t) for f in (261.6, 329.6, 392.0)) * 0.12
+        mono += rng.standard_normal(frames) * 0.01
+
+    pan = 0.1 * (STEMS.index(name) - 1.5)
+    stereo = np.stack([mono * (1 - pan), mono * (1 + pan)], axis=1)
+    return stereo.astype(np.float32)
+
+
+def write_stems(stems_dir: str, seconds: float, seed: int = 0):
+    """Writes vocals/drums/bass/other.wav (16-bit, like demucs output) and returns stems_dir."""
+    os.makedirs(stems_dir, exist_ok=True)
+    for name in STEMS:
+        sf.write(os.path.join(stems_dir, f"{name}.wav"), synth_stem(name, seconds, seed=seed), SAMPLE_RATE, subtype="PCM_16")
+    return stems_dir
+
+
+def write_track(path: str, seconds: float, seed: int = 0):
+    """Writes the full synthetic mix as a 16-bit WAV and returns path."""
+    mix = sum(synth_stem(name, seconds, seed=seed) for name in STEMS) / 2
+    sf.write(path, np.clip(mix, -1, 1), SAMPLE_RATE, subtype="PCM_16")
+    return path
@@ -0,0 +1,364 @@
+"""
+Benchmarks for the separation, generation and mixing hot paths.
+
+    python benchmarks/run.py                       # every case, tiny stand-in models
+    python benchmarks/run.py --real                # htdemucs / musicgen-small (downloads weights)
+    python benchmarks/run.py --cases mix_native,effects_parity
+    python benchmarks/run.py --update-baseline     # store this run as the baseline
+
+Each case runs in its own process on synthetic audio, so peak RSS and CPU time belong to
+that case alone. Reported per case: wall time, CPU seconds and utilization, peak RSS and
+realtime factor (processing seconds per second of audio; below 1 is faster than realtime).
+Results go to --output as JSON and are compared with the stored baseline for the same mode;
+a case more than --tolerance slower than its baseline, or a failed parity check, makes the
+run exit with status 1.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+class Skip(Exception):
+    pass
+
+
+def need_ffmpeg():
+    if not shutil.which("ffmpeg"):
+        raise Skip("ffmpeg not found")
+
+
+# --- Cases: each does its setup and returns the callable that is timed. The callable
+# returns {"audio_seconds": ..., **extra metrics}.
+
+def case_mix_native(workdir, real):
+    import mixer
+    from fixtures import write_stems
+    stems = write_stems(os.path.join(workdir, "stems"), 60)
+    mixer.MIX_BACKEND = "native"
+
+    def run():
+        result = mixer.mix_stems_with_volumes(stems, {"vocals": 1.2}, os.path.join(workdir, "mix.wav"), "happy", "pop")
+        assert result["status"] == "success", result
+        return {"audio_seconds": 60}
+    return run
+
+
+def case_mix_ffmpeg(workdir, real):
+    need_ffmpeg()
+    import mixer
+    from fixtures import write_stems
+    stems = write_stems(os.path.join(workdir, "stems"), 60)
+    mixer.MIX_BACKEND = "ffmpeg"
+
+    def run():
+        result = mixer.mix_stems_with_volumes(stems, {"vocals": 1.2}, os.path.join(workdir, "mix.wav"), "happy", "pop")
+        assert result["status"] == "success", result
+        return {"audio_seconds": 60}
+    return run
+
+
+def case_mix_preview(workdir, real):
+    import mixer
+    from fixtures import write_stems
+    stems = write_stems(os.path.join(workdir, "stems"), 60)
+    mixer.build_stem_proxies(stems)
+
+    def run():
+        result = mixer.mix_stems_with_volumes(
+            stems, {"vocals": 1.2}, os.path.join(workdir, "mix.wav"), "happy", "pop", preview={"start": 20, "duration": 20},
+        )
+        assert result["status"] == "success", result
+        return {"audio_seconds": 20, "clip_bytes": os.path.getsize(os.path.join(workdir, result["file"]))}
+    return run
+
+
+def case_effects_chain(workdir, real):
+    from effects import GENRE_PRESETS, MOOD_PRESETS, apply_chain
+    from fixtures import SAMPLE_RATE, STEMS, synth_stem
+    audio = sum(synth_stem(name, 30) for name in STEMS) / 2
+    presets = list(MOOD_PRESETS.values()) + list(GENRE_PRESETS.values())
+
+    def run():
+        for filters in presets:
+            apply_chain(audio, SAMPLE_RATE, filters)
+        return {"audio_seconds": 30 * len(presets), "presets": len(presets)}
+    return run
+
+
+def case_effects_parity(workdir, real, min_snr_db=None):
+    """Every preset through the native chain and through ffmpeg's own filters, compared sample by sample."""
+    need_ffmpeg()
+    import numpy as np
+    import soundfile as sf
+    from effects import GENRE_PRESETS, MOOD_PRESETS, apply_chain
+    from fixtures import SAMPLE_RATE, STEMS, synth_stem
+    min_snr_db = min_snr_db if min_snr_db is not None else float(os.environ.get("PARITY_MIN_SNR_DB", "20"))
+    audio = (sum(synth_stem(name, 10) for name in STEMS) / 2).astype(np.float32)
+    source = os.path.join(workdir, "parity.wav")
+    sf.write(source, audio, SAMPLE_RATE, subtype="FLOAT")
+    presets = {f"mood:{k}": v for k, v in MOOD_PRESETS.items()}
+    presets.update({f"genre:{k}": v for k, v in GENRE_PRESETS.items()})
+
+    def run():
+        report = {}
+        for name, filters in presets.items():
+            command = ["ffmpeg", "-v", "error", "-i", source, "-af", ",".join(filters),
+                       "-f", "f32le", "-ac", "2", "-ar", str(SAMPLE_RATE), "-"]
+            result = subprocess.run(command, capture_output=True)
+            if result.returncode != 0:
+                report[name] = {"ok": False, "error": result.stderr.decode(errors="replace").strip()[-300:]}
+                continue
+            reference = np.frombuffer(result.stdout, dtype=np.float32).reshape(-1, 2)
+            native = apply_chain(audio, SAMPLE_RATE, filters)
+            frames = min(len(reference), len(native))
+            diff = reference[:frames] - native[:frames]
+            power = float(np.sum(reference[:frames] ** 2))
+            noise = float(np.sum(diff ** 2))
+            snr = 10 * np.log10(power / noise) if noise > 0 else float("inf")
+            report[name] = {
+                "ok": bool(snr >= min_snr_db),
+                "snr_db": round(snr, 2) if np.isfinite(snr) else None,
+                "max_abs_diff": round(float(np.max(np.abs(diff))), 6),
+                "length_diff": int(len(reference) - len(native)),
+            }
+        failed = sorted(name for name, r in report.items() if not r["ok"])
+        return {"audio_seconds": 10 * len(presets), "min_snr_db": min_snr_db, "failed": failed, "ok": not failed, "presets": report}
+    return run
+
+
+def _separation_case(mode):
+    def case(workdir, real):
+        need_ffmpeg()
+        from fixtures import write_track
+        seconds = float(os.environ.get("BENCH_TRACK_SECONDS", "90"))
+        track = write_track(os.path.join(workdir, "track.wav"), seconds)
+        if not real:
+            from standins import install_tiny_separator
+            install_tiny_separator()
+        else:
+            from separator import load_separator
+            load_separator()
+        from remix import separate_audio
+        limit, turbo = {"turbo": (360, True), "fast": (60, False), "full": (None, False)}[mode]
+        output = os.path.join(workdir, "processed")
+
+        def run():
+            result = separate_audio(track, output, limit, False, turbo)
+            assert result["status"] == "success", result
+            audio_seconds = {"turbo": min(15, seconds), "fast": min(60, seconds), "full": seconds}[mode]
+            return {"audio_seconds": audio_seconds}
+        return run
+    return case
+
+
+def case_separation_batch(workdir, real):
+    """Catalog throughput: BENCH_BATCH_TRACKS different tracks through separate_batch (fast mode)."""
+    need_ffmpeg()
+    from fixtures import write_track
+    seconds = float(os.environ.get("BENCH_TRACK_SECONDS", "90"))
+    count = int(os.environ.get("BENCH_BATCH_TRACKS", "8"))
+    uploads = [
+        {"path": write_track(os.path.join(workdir, f"track{i}.wav"), seconds, seed=i), "name": f"track{i}.wav"}
+        for i in range(count)
+    ]
+    if not real:
+        from standins import install_tiny_separator
+        install_tiny_separator()
+    else:
+        from separator import load_separator
+        load_separator()
+    from remix import separate_batch
+    output = os.path.join(workdir, "processed")
+
+    def run():
+        result = separate_batch(uploads, output, 60)
+        assert result["succeeded"] == count, result
+        return {"audio_seconds": min(60, seconds) * count, "tracks_per_hour": result["tracks_per_hour"]}
+    return run
+
+
+def _generation_case(batch):
+    def case(workdir, real):
+        import generate
+        if not real:
+            from standins import install_tiny_musicgen
+            install_tiny_musicgen()
+        else:
+            generate.load_model()
+        duration = float(os.environ.get("BENCH_GENERATION_SECONDS", "5"))
+        # Unseeded, so the prompts can share a batch (seeded requests are generated one by one)
+        params = generate.generation_params(duration, seed=None)
+        prompts = [generate.build_prompt(mood, "Pop", "English") for mood in ("Happy", "Sad", "Chill", "Epic")[:batch]]
+
+        def run():
+            errors = []
+            def one(i, prompt):
+                try:
+                    generate.generate_track(prompt, os.path.join(workdir, f"gen{i}.wav"), params)
+                except Exception as e:
+                    errors.append(e)
+            threads = [threading.Thread(target=one, args=(i, p)) for i, p in enumerate(prompts)]
+            start = time.perf_counter()
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            elapsed = time.perf_counter() - start
+            if errors:
+                raise errors[0]
+            return {
+                "audio_seconds": duration * batch,
+                "tokens_per_sec": round(params["max_new_tokens"] * batch / elapsed, 1),
+                "batches": generate.batcher.stats["batches"],
+            }
+        return run
+    return case
+
+
+CASES = {
+    "mix_native": case_mix_native,
+    "mix_ffmpeg": case_mix_ffmpeg,
+    "mix_preview": case_mix_preview,
+    "effects_chain": case_effects_chain,
+    "effects_parity": case_effects_parity,
+    "separation_turbo": _separation_case("turbo"),
+    "separation_fast": _separation_case("fast"),
+    "separation_full": _separation_case("full"),
+    "separation_batch": case_separation_batch,
+    "generation": _generation_case(1),
+    "generation_batch4": _generation_case(4),
+}
+
+
+def run_child(name: str, real: bool, workdir: str) -> dict:
+    """Runs one case in this process and returns its measurements."""
+    try:
+        run = CASES[name](workdir, real)
+    except (Skip, ImportError) as e:
+        return {"skipped": str(e)}
+
+    usage = resource.getrusage(resource.RUSAGE_SELF) if resource else None
+    start = time.perf_counter()
+    metrics = run()
+    wall = time.perf_counter() - start
+    result = {"wall_seconds": round(wall, 4)}
+    if resource:
+        after = resource.getrusage(resource.RUSAGE_SELF)
+        cpu = (after.ru_utime - usage.ru_utime) + (after.ru_stime - usage.ru_stime)
+        # ru_maxrss is KiB on Linux, bytes on macOS
+        rss_bytes = after.ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+        result.update({
+            "cpu_seconds": round(cpu, 4),
+            "cpu_utilization": round(cpu / wall, 2) if wall else None,
+            "peak_rss_mb": round(rss_bytes / 1024 ** 2, 1),
+        })
+    if metrics.get("audio_seconds"):
+        result["realtime_factor"] = round(wall / metrics["audio_seconds"], 4)
+    result.update(metrics)
+    return result
+
+
+def compare(cases: dict, baseline: dict, tolerance: float) -> list:
+    """Names of cases that regressed against the baseline or failed their own check."""
+    regressions = []
+    for name, result in cases.items():
+        if result.get("ok") is False or "error" in result:
+            regressions.append(name)
+            continue
+        before = baseline.get(name, {}).get("wall_seconds")
+        if before and "wall_seconds" in result:
+            result["baseline_wall_seconds"] = before
+            result["change"] = round(result["wall_seconds"] / before - 1, 3)
+            if result["change"] > tolerance:
+                regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--real", action="store_true", help="use the real htdemucs/musicgen-small models")
+    parser.add_argument("--cases", help=f"comma-separated subset of: {', '.join(CASES)}")
+    parser.add_argument("--output", default=os.path.join(HERE, "results.json"))
+    parser.add_argument("--baseline", help="baseline JSON (default: benchmarks/baseline-<mode>.json)")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed slowdown before a case counts as a regression")
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--workdir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_child(args.child, args.real, args.workdir)))
+        return
+
+    mode = "real" if args.real else "standin"
+    names = args.cases.split(",") if args.cases else list(CASES)
+    unknown = [name for name in names if name not in CASES]
+    if unknown:
+        parser.error(f"unknown cases: {', '.join(unknown)}")
+
+    cases = {}
+    for name in names:
+        with tempfile.TemporaryDirectory(prefix=f"bench-{name}-") as workdir:
+            command = [sys.executable, os.path.abspath(__file__), "--child", name, "--workdir", workdir]
+            if args.real:
+                command.append("--real")
+            proc = subprocess.run(command, capture_output=True, text=True, cwd=os.path.dirname(HERE))
+            lines = proc.stdout.strip().splitlines()
+            if proc.returncode == 0 and lines:
+                cases[name] = json.loads(lines[-1])
+            else:
+                cases[name] = {"error": proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else f"exit {proc.returncode}"}
+        result = cases[name]
+        if "skipped" in result:
+            status = f"skipped ({result['skipped']})"
+        else:
+            status = result.get("error") or f"{result['wall_seconds']:.3f}s"
+        print(f"{name:20s} {status}")
+
+    baseline_path = args.baseline or os.path.join(HERE, f"baseline-{mode}.json")
+    baseline = {}
+    if os.path.exists(baseline_path):
+        with open(baseline_path) as f:
+            baseline = json.load(f).get("cases", {})
+    regressions = compare(cases, baseline, args.tolerance)
+
+    report = {
+        "mode": mode,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "machine": {"platform": platform.platform(), "python": platform.python_version(), "cpus": os.cpu_count()},
+        "baseline": baseline_path if baseline else None,
+        "regressions": regressions,
+        "cases": cases,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    if args.update_baseline:
+        measured = {name: result for name, result in cases.items() if "wall_seconds" in result}
+        with open(baseline_path, "w") as f:
+            json.dump({**report, "cases": measured, "regressions": []}, f, indent=2)
+        print(f"Baseline written to {baseline_path}")
+
+    print(f"Results written to {args.output}")
+    if regressions:
+        print(f"Regressions / failed checks: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Tiny stand-ins for htdemucs and MusicGen so the pipelines can be timed in CI without
+downloading weights. They have the real interfaces (demucs apply_model, transformers
+generate) but random weights, so they measure pipeline overhead, not model cost.
+"""
+import torch
+from torch import nn
+
+
+class TinySeparator(nn.Module):
+    """Looks like a demucs model to apply_model: (batch, channels, time) -> (batch, sources, channels, time)."""
+
+    def __init__(self, sources=("drums", "bass", "other", "vocals"), samplerate=44100, audio_channels=2, hidden=16):
+        super().__init__()
+        self.sources = list(sources)
+        self.samplerate = samplerate
+        self.audio_channels = audio_channels
+        self.segment = 6
+        self.net = nn.Sequential(
+            nn.Conv1d(audio_channels, hidden, 9, padding=4),
+            nn.GELU(),
+            nn.Conv1d(hidden, len(self.sources) * audio_channels, 9, padding=4),
+        )
+
+    def forward(self, mix):
+        batch, channels, length = mix.shape
+        return self.net(mix).view(batch, len(self.sources), channels, length)
+
+
+def install_tiny_separator():
+    """Makes separator use TinySeparator instead of loading htdemucs."""
+    import demucs.apply
+    import separator
+    demucs.apply.tqdm = separator._ChunkProgress
+    separator.model = TinySeparator().eval()
+
+
+class TinyProcessor:
+    """Replaces the T5 tokenizer: deterministic token ids from the prompt text."""
+
+    def __init__(self, vocab_size: int):
+        self.vocab_size = vocab_size
+
+    def __call__(self, text, padding=True, return_tensors="pt"):
+        from transformers import BatchEncoding
+        ids = [[(ord(c) % (self.vocab_size - 2)) + 1 for c in prompt[:64]] for prompt in text]
+        width = max(len(row) for row in ids)
+        input_ids = torch.zeros((len(ids), width), dtype=torch.long)
+        mask = torch.zeros((len(ids), width), dtype=torch.long)
+        for i, row in enumerate(ids):
+            input_ids[i, :len(row)] = torch.tensor(row)
+            mask[i, :len(row)] = 1
+        return BatchEncoding({"input_ids": input_ids, "attention_mask": mask})
+
+
+def tiny_musicgen():
+    """A randomly initialised MusicGen with musicgen-small's frame rate/codebook layout but tiny layers."""
+    from transformers import (
+        EncodecConfig, MusicgenConfig, MusicgenDecoderConfig, MusicgenForConditionalGeneration, T5Config,
+    )
+    codebook_size = 64
+    text = T5Config(vocab_size=128, d_model=32, d_kv=16, d_ff=64, num_layers=1, num_heads=2)
+    # 32 kHz with 640x upsampling = 50 frames/s; 2.2 kbps at 50 frames/s = 4 codebooks, as in musicgen-small
+    audio = EncodecConfig(
+        target_bandwidths=[2.2], sampling_rate=32000, audio_channels=1, num_filters=4, hidden_size=16,
+        codebook_size=codebook_size, upsampling_ratios=[8, 5, 4, 4], num_lstm_layers=1, normalize=False,
+    )
+    decoder = MusicgenDecoderConfig(
+        vocab_size=codebook_size, hidden_size=32, ffn_dim=64, num_hidden_layers=1, num_attention_heads=2,
+        num_codebooks=4, pad_token_id=codebook_size, bos_token_id=codebook_size,
+    )
+    config = MusicgenConfig(text_encoder=text.to_dict(), audio_encoder=audio.to_dict(), decoder=decoder.to_dict())
+    model = MusicgenForConditionalGeneration(config).eval()
+    model.generation_config.decoder_start_token_id = codebook_size
+    model.generation_config.pad_token_id = codebook_size
+    model.generation_config.do_sample = True
+    return TinyProcessor(text.vocab_size), model
+
+
+def install_tiny_musicgen():
+    """Makes generate use the tiny MusicGen instead of downloading facebook/musicgen-small."""
+    import generate
+    generate.processor, generate.model = tiny_musicgen()
@@ -0,0 +1,111 @@
+import os
+import shutil
+import threading
+import time
+import uuid
+
+import metrics
+
+
+class DirectoryCache:
+    """
+    Content-addressed store where every entry is a file or directory named by its key.
+    Entries are built under a temporary name and published with an atomic rename, so
+    readers never see half-written results. Recency is tracked with the entry mtime,
+    which lets eviction drop the least recently used entries once max_bytes is exceeded
+    and any entry left unused for longer than max_age seconds.
+    """
+
+    def __init__(self, root: str, max_bytes: int = None, max_age: float = None):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.name = os.path.basename(os.path.normpath(root))
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.root, key)
+
+    def get(self, key: str):
+        """Returns the entry path on a hit (and marks it as recently used), otherwise None."""
+        path = self.path(key)
+        if not os.path.exists(path):
+            metrics.CACHE_REQUESTS.inc(cache=self.name, result="miss")
+            return None
+        metrics.CACHE_REQUESTS.inc(cache=self.name, result="hit")
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return path
+
+    def reserve(self, key: str) -> str:
+        """Returns a private temporary path to build the entry for key in."""
+        return os.path.join(self.root, f".tmp-{key}-{uuid.uuid4().hex[:8]}")
+
+    def publish(self, key: str, tmp_path: str) -> str:
+        """Atomically moves a finished temporary entry into place and returns its final path."""
+        final = self.path(key)
+        try:
+            os.rename(tmp_path, final)
+        except OSError:
+            # Another job published the same key first - keep theirs
+            _remove(tmp_path)
+            if not os.path.exists(final):
+                raise
+        self.evict()
+        return final
+
+    def discard(self, tmp_path: str):
+        _remove(tmp_path)
+
+    def evict(self):
+        """Removes expired entries, then least recently used ones until the store fits in max_bytes."""
+        if not self.max_bytes and not self.max_age:
+            return
+        now = time.time()
+        with self._lock:
+            entries = []
+            total = 0
+            for name in os.listdir(self.root):
+                if name.startswith(".tmp-"):
+                    continue
+                path = os.path.join(self.root, name)
+                try:
+                    size = _size(path)
+                    mtime = os.stat(path).st_mtime
+                except OSError:
+                    continue
+                entries.append((mtime, size, path))
+                total += size
+
+            entries.sort()
+            for mtime, size, path in entries:
+                expired = self.max_age and now - mtime > self.max_age
+                if not expired and (not self.max_bytes or total <= self.max_bytes):
+                    break
+                print(f"--- Cache: evicting {path} ({size / 1e6:.1f} MB, idle {now - mtime:.0f}s) ---")
+                _remove(path)
+                metrics.CACHE_EVICTIONS.inc(cache=self.name)
+                total -= size
+
+
+def _size(path: str) -> int:
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, name))
+            except OSError:
+                pass
+    return total
+
+
+def _remove(path: str):
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    elif os.path.exists(path):
+        os.remove(path)
@@ -0,0 +1,73 @@
+import hashlib
+import os
+
+import metrics
+import procs
+from cache import DirectoryCache
+
+# Compressed delivery formats: ffmpeg codec arguments, file extension and media type
+FORMATS = {
+    "opus": {"args": ["-c:a", "libopus", "-b:a", os.environ.get("OPUS_BITRATE", "128k")], "ext": ".ogg", "media_type": "audio/ogg"},
+    "mp3": {"args": ["-c:a", "libmp3lame", "-b:a", os.environ.get("MP3_BITRATE", "192k")], "ext": ".mp3", "media_type": "audio/mpeg"},
+    "flac": {"args": ["-c:a", "flac"], "ext": ".flac", "media_type": "audio/flac"},
+}
+MEDIA_TYPES = {".wav": "audio/wav", **{spec["ext"]: spec["media_type"] for spec in FORMATS.values()}}
+
+# Encodes are derived data, so they get their own bounded store
+ENCODE_CACHE_MAX_BYTES = int(float(os.environ.get("ENCODE_CACHE_MAX_GB", "2")) * 1024 ** 3)
+
+_stores = {}
+
+
+def get_encode_store(output_dir: str) -> DirectoryCache:
+    root = os.path.abspath(os.path.join(output_dir, "encoded"))
+    if root not in _stores:
+        _stores[root] = DirectoryCache(root, ENCODE_CACHE_MAX_BYTES)
+    return _stores[root]
+
+
+def media_type(path: str) -> str:
+    return MEDIA_TYPES.get(os.path.splitext(path)[1].lower(), "application/octet-stream")
+
+
+def file_etag(path: str) -> str:
+    """Validator for a served file; changes whenever the file is rewritten."""
+    stat = os.stat(path)
+    return '"' + hashlib.md5(f"{stat.st_mtime_ns}-{stat.st_size}".encode()).hexdigest() + '"'
+
+
+def not_modified(headers, etag: str) -> bool:
+    """True when the request's If-None-Match already names this version of the file."""
+    if_none_match = headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or any(tag.removeprefix("W/") == etag for tag in tags)
+
+
+def encode_audio(source: str, output_dir: str, fmt: str) -> str:
+    """
+    Returns an encoded copy of source in the given format, transcoding it on first use.
+    Encodes are keyed by source path + version (mtime/size) + codec settings, so a rewritten
+    source gets a fresh encode and the stale one ages out of the store.
+    """
+    spec = FORMATS[fmt]
+    stat = os.stat(source)
+    blob = f"{os.path.abspath(source)}:{stat.st_mtime_ns}:{stat.st_size}:{fmt}:{' '.join(spec['args'])}"
+    key = hashlib.sha256(blob.encode()).hexdigest()[:32] + spec["ext"]
+    store = get_encode_store(output_dir)
+    cached = store.get(key)
+    if cached:
+        return cached
+
+    tmp_path = store.reserve(key) + spec["ext"]
+    command = ["ffmpeg", "-y", "-v", "error", "-i", source, "-map", "0:a:0", *spec["args"], tmp_path]
+    try:
+        with metrics.span("transcode"):
+            result = procs.run(command, "transcode", check=False)
+        if result.returncode != 0:
+            raise RuntimeError(f"Encoding to {fmt} failed: {result.stderr.strip()[-500:]}")
+        return store.publish(key, tmp_path)
+    except Exception:
+        store.discard(tmp_path)
+        raise
@@ -0,0 +1,401 @@
+import math
+from typing import List
+
+import numpy as np
+from scipy.signal import sosfilt
+
+# Mood and genre presets, written once in ffmpeg filter syntax.
+# mixer.get_mood_filter/get_genre_filter render them for ffmpeg graphs and
+# build_chain parses the same strings into the native NumPy/SciPy processors below,
+# so the two backends can't drift apart.
+MOOD_PRESETS = {
+    'happy': ['equalizer=f=1000:width_type=h:width=200:g=2', 'equalizer=f=5000:width_type=h:width=500:g=3', 'aecho=0.8:0.88:60:0.4'],
+    'sad': ['equalizer=f=3000:width_type=h:width=1000:g=-6', 'lowpass=f=2000', 'aecho=0.8:0.9:1000:0.3'],
+    'energetic': ['compand=0.3 0.3:0.8 0.8:-70/-60 -20/-14:6:0:-90:0.2', 'equalizer=f=80:width_type=h:width=40:g=6', 'equalizer=f=12000:width_type=h:width=1000:g=3'],
+    'relaxed': ['lowpass=f=5000', 'aecho=0.8:0.9:1000:0.2', 'bass=g=-2'],
+    'chill': ['lowpass=f=8000', 'aecho=0.8:0.88:60:0.2', 'equalizer=f=400:width_type=h:width=100:g=-3'],
+    'romantic': ['aecho=0.8:0.9:1000:0.4', 'equalizer=f=2000:width_type=h:width=500:g=2', 'aphaser=in_gain=0.4'],
+    'dark': ['lowpass=f=3000', 'equalizer=f=100:width_type=h:width=50:g=4', 'equalizer=f=2500:width_type=h:width=500:g=-5'],
+    'mysterious': ['aecho=0.8:0.9:1000:0.6', 'equalizer=f=4000:width_type=h:width=1000:g=-4', 'vibrato=f=4:d=0.3'],
+    'cinematic': ['aecho=0.8:0.9:1000:0.3', 'compand', 'equalizer=f=100:width_type=h:width=50:g=3', 'equalizer=f=10000:width_type=h:width=1000:g=2'],
+    'epic': ['compand', 'equalizer=f=80:width_type=h:width=40:g=5', 'equalizer=f=5000:width_type=h:width=500:g=3', 'aecho=0.8:0.88:40:0.5'],
+}
+
+GENRE_PRESETS = {
+    'pop': ['equalizer=f=1000:width_type=h:width=500:g=2', 'equalizer=f=8000:width_type=h:width=1000:g=3'],
+    'rock': ['equalizer=f=400:width_type=h:width=200:g=3', 'equalizer=f=3000:width_type=h:width=500:g=4'],
+    'hip hop': ['equalizer=f=60:width_type=h:width=30:g=8', 'compand=0.3 0.3:0.8 0.8:-70/-60 -20/-14:6:0:-90:0.2'],
+    'jazz': ['equalizer=f=1000:width_type=h:width=500:g=-2', 'aecho=0.8:0.9:1000:0.2'],
+    'classical': ['compand', 'equalizer=f=5000:width_type=h:width=1000:g=2'],
+    'electronic': ['equalizer=f=60:width_type=h:width=30:g=5', 'equalizer=f=12000:width_type=h:width=1000:g=5', 'aphaser=in_gain=0.5'],
+    'lo-fi': ['lowpass=f=4000', 'highpass=f=200', 'aecho=0.8:0.9:1000:0.1'],
+    'ambient': ['lowpass=f=3000', 'aecho=0.8:0.9:2000:0.6'],
+    'folk': ['equalizer=f=3000:width_type=h:width=500:g=2', 'equalizer=f=100:width_type=h:width=50:g=-2'],
+    'reggae': ['equalizer=f=80:width_type=h:width=40:g=6', 'aecho=0.8:0.9:300:0.4'],
+}
+
+# Positional option order for each supported ffmpeg filter, plus long-name aliases
+FILTER_OPTIONS = {
+    'equalizer': ['f', 't', 'w', 'g'],
+    'lowpass': ['f', 't', 'w', 'p'],
+    'highpass': ['f', 't', 'w', 'p'],
+    'bass': ['f', 't', 'w', 'g'],
+    'aecho': ['in_gain', 'out_gain', 'delays', 'decays'],
+    'compand': ['attacks', 'decays', 'points', 'soft-knee', 'gain', 'volume', 'delay'],
+    'aphaser': ['in_gain', 'out_gain', 'delay', 'decay', 'speed', 'type'],
+    'vibrato': ['f', 'd'],
+}
+OPTION_ALIASES = {'frequency': 'f', 'width_type': 't', 'width': 'w', 'gain': 'g', 'poles': 'p', 'depth': 'd'}
+
+# Frames per block when running a chain over a whole buffer
+BLOCK_FRAMES = 65536
+
+
+class UnsupportedEffect(Exception):
+    pass
+
+
+def preset_filters(mood: str = None, genre: str = None) -> List[str]:
+    """The ffmpeg filter specs for a mood and/or genre, mood first (same order as the ffmpeg graphs)."""
+    filters = []
+    if mood:
+        filters += MOOD_PRESETS.get(mood.lower(), [])
+    if genre:
+        filters += GENRE_PRESETS.get(genre.lower(), [])
+    return filters
+
+
+def parse_filter(spec: str):
+    """'equalizer=f=1000:width_type=h' -> ('equalizer', {'f': '1000', 't': 'h'})"""
+    name, _, args = spec.partition('=')
+    if name not in FILTER_OPTIONS:
+        raise UnsupportedEffect(f"No native implementation of ffmpeg filter '{name}'")
+    order = FILTER_OPTIONS[name]
+    options = {}
+    for i, arg in enumerate(args.split(':') if args else []):
+        key, sep, value = arg.partition('=')
+        if sep:
+            options[OPTION_ALIASES.get(key, key)] = value
+        else:
+            options[order[i]] = arg
+    return name, options
+
+
+# --- Biquads (RBJ cookbook, with ffmpeg af_biquads' width handling) ---
+
+def _alpha(w0: float, freq: float, width_type: str, width: float) -> float:
+    if width_type == 'h':
+        return math.sin(w0) / (2 * freq / width)
+    if width_type == 'k':
+        return math.sin(w0) / (2 * freq / (width * 1000))
+    if width_type == 'o':
+        return math.sin(w0) * math.sinh(math.log(2.) / 2 * width * w0 / math.sin(w0))
+    return math.sin(w0) / (2 * width)  # q
+
+
+def biquad_sos(name: str, options: dict, sample_rate: int) -> np.ndarray:
+    defaults = {'lowpass': 3000, 'highpass': 3000, 'bass': 100, 'equalizer': 0}
+    freq = float(options.get('f', defaults[name]))
+    width_type = options.get('t', 'q')
+    width = float(options.get('w', 0.5 if name == 'bass' else 0.707 if name in ('lowpass', 'highpass') else 1))
+    gain = float(options.get('g', 0))
+    if int(options.get('p', 2)) != 2:
+        raise UnsupportedEffect(f"Only 2-pole {name} is implemented natively")
+
+    w0 = 2 * math.pi * freq / sample_rate
+    alpha = _alpha(w0, freq, width_type, width)
+    cos_w0 = math.cos(w0)
+    A = 10 ** (gain / 40)
+
+    if name == 'equalizer':
+        b = [1 + alpha * A, -2 * cos_w0, 1 - alpha * A]
+        a = [1 + alpha / A, -2 * cos_w0, 1 - alpha / A]
+    elif name == 'lowpass':
+        b = [(1 - cos_w0) / 2, 1 - cos_w0, (1 - cos_w0) / 2]
+        a = [1 + alpha, -2 * cos_w0, 1 - alpha]
+    elif name == 'highpass':
+        b = [(1 + cos_w0) / 2, -(1 + cos_w0), (1 + cos_w0) / 2]
+        a = [1 + alpha, -2 * cos_w0, 1 - alpha]
+    else:  # bass = low shelf
+        sq = 2 * math.sqrt(A) * alpha
+        b = [A * ((A + 1) - (A - 1) * cos_w0 + sq), 2 * A * ((A - 1) - (A + 1) * cos_w0), A * ((A + 1) - (A - 1) * cos_w0 - sq)]
+        a = [(A + 1) + (A - 1) * cos_w0 + sq, -2 * ((A - 1) + (A + 1) * cos_w0), (A + 1) + (A - 1) * cos_w0 - sq]
+    return np.array([b + a]) / a[0]
+
+
+class BiquadCascade:
+    """Consecutive biquads merged into one second-order-sections filter."""
+
+    def __init__(self, sos: np.ndarray, channels: int):
+        self.sos = sos
+        self.zi = np.zeros((sos.shape[0], 2, channels))
+
+    def process(self, block: np.ndarray) -> np.ndarray:
+        out, self.zi = sosfilt(self.sos, block, axis=0, zi=self.zi)
+        return out
+
+    def flush(self, channels: int) -> np.ndarray:
+        return np.zeros((0, channels))
+
+
+class DelayLine:
+    """Keeps the last `length` input frames so delayed taps can reach back across block boundaries."""
+
+    def __init__(self, length: int, channels: int):
+        self.history = np.zeros((length, channels))
+
+    def extend(self, block: np.ndarray) -> np.ndarray:
+        buf = np.concatenate([self.history, block])
+        if len(self.history):
+            self.history = buf[-len(self.history):]
+        return buf
+
+
+class Echo:
+    """ffmpeg aecho: feed-forward multi-tap echo, out = out_gain * (in_gain * x + sum(decay_i * x[n - d_i]))."""
+
+    def __init__(self, options: dict, sample_rate: int, channels: int):
+        self.in_gain = float(options.get('in_gain', 0.6))
+        self.out_gain = float(options.get('out_gain', 0.3))
+        delays = [float(d) for d in options.get('delays', '1000').split('|')]
+        decays = [float(d) for d in options.get('decays', '0.5').split('|')]
+        self.taps = [(int(d * sample_rate / 1000), decay) for d, decay in zip(delays, decays)]
+        self.max_delay = max(d for d, _ in self.taps)
+        self.line = DelayLine(self.max_delay, channels)
+
+    def process(self, block: np.ndarray) -> np.ndarray:
+        n = len(block)
+        buf = self.line.extend(block)
+        out = block * self.in_gain
+        for delay, decay in self.taps:
+            start = self.max_delay - delay
+            out += buf[start:start + n] * decay
+        return out * self.out_gain
+
+    def flush(self, channels: int) -> np.ndarray:
+        return np.zeros((0, channels))
+
+
+class Compander:
+    """
+    ffmpeg compand: per-channel attack/decay envelope follower driving a piecewise-linear
+    dB transfer function, with `delay` seconds of lookahead. The envelope is tracked on
+    short hops (peak per hop) and the gain is interpolated back to sample rate, which
+    keeps the recursion out of the per-sample path. The soft knee is not modelled.
+    """
+
+    HOP = 256
+
+    def __init__(self, options: dict, sample_rate: int, channels: int):
+        def per_channel(text, default):
+            values = [float(v) for v in text.replace('|', ' ').split()] if text else [default]
+            return np.array([values[min(c, len(values) - 1)] for c in range(channels)])
+
+        attacks = per_channel(options.get('attacks'), 0.0)
+        decays = per_channel(options.get('decays'), 0.8)
+        hop_seconds = self.HOP / sample_rate
+        self.attack = np.where(attacks > hop_seconds, 1 - np.exp(-hop_seconds / np.maximum(attacks, 1e-9)), 1.0)
+        self.decay = np.where(decays > hop_seconds, 1 - np.exp(-hop_seconds / np.maximum(decays, 1e-9)), 1.0)
+
+        points = options.get('points', '-70/-70|-60/-20|1/0').replace('|', ' ').split()
+        xs, ys = zip(*[(float(p.split('/')[0]), float(p.split('/')[1])) for p in points])
+        xs, ys = list(xs), list(ys)
+        if xs[-1] != 0:
+            xs.append(0.0)
+            ys.append(0.0)
+        self.points_in = np.array(xs)
+        self.points_gain = np.array(ys) - np.array(xs)
+        self.makeup = float(options.get('gain', 0))
+
+        self.envelope = np.full(channels, 10 ** (float(options.get('volume', 0)) / 20))
+        self.lookahead = int(round(float(options.get('delay', 0)) * sample_rate))
+        self.pending = np.zeros((0, channels))  # input not yet analysed as a full hop
+        self.delayed = np.zeros((0, channels))  # analysed input waiting for its lookahead gain
+        self.gains = np.zeros((0, channels))
+        self.last_gain = None
+
+    def _gain_db(self, envelope: np.ndarray) -> np.ndarray:
+        level = 20 * np.log10(np.maximum(envelope, 1e-10))
+        return np.interp(level, self.points_in, self.points_gain) + self.makeup
+
+    def _analyse(self, block: np.ndarray):
+        hops = len(block) // self.HOP
+        peaks = np.abs(block[:hops * self.HOP]).reshape(hops, self.HOP, -1).max(axis=1)
+        envelopes = np.empty_like(peaks)
+        env = self.envelope
+        for i, peak in enumerate(peaks):
+            coef = np.where(peak > env, self.attack, self.decay)
+            env = env + (peak - env) * coef
+            envelopes[i] = env
+        self.envelope = env
+        return envelopes
+
+    def _gains_for(self, envelopes: np.ndarray) -> np.ndarray:
+        hop_gains = 10 ** (self._gain_db(envelopes) / 20)
+        start = self.last_gain if self.last_gain is not None else hop_gains[0]
+        anchors = np.vstack([start[None], hop_gains])
+        self.last_gain = hop_gains[-1]
+        # Linear ramp from the previous hop's gain to each new hop's gain
+        t = (np.arange(1, self.HOP + 1) / self.HOP)[None, :, None]
+        ramps = anchors[:-1, None] + (anchors[1:, None] - anchors[:-1, None]) * t
+        return ramps.reshape(-1, anchors.shape[1])
+
+    def _emit(self, final: bool = False) -> np.ndarray:
+        # Input sample n is scaled by the gain computed `lookahead` samples later
+        available = len(self.gains) - self.lookahead
+        if final:
+            pad = len(self.delayed) - available
+            if pad > 0:
+                self.gains = np.vstack([self.gains, np.repeat(self.gains[-1:] if len(self.gains) else np.ones((1, self.delayed.shape[1])), pad, axis=0)])
+            available = len(self.delayed)
+        available = max(0, min(available, len(self.delayed)))
+        out = self.delayed[:available] * self.gains[self.lookahead:self.lookahead + available]
+        self.delayed = self.delayed[available:]
+        self.gains = self.gains[available:]
+        return out
+
+    def process(self, block: np.ndarray) -> np.ndarray:
+        data = np.concatenate([self.pending, block])
+        usable = (len(data) // self.HOP) * self.HOP
+        if usable:
+            self.gains = np.vstack([self.gains, self._gains_for(self._analyse(data[:usable]))])
+            self.delayed = np.concatenate([self.delayed, data[:usable]])
+        self.pending = data[usable:]
+        return self._emit()
+
+    def flush(self, channels: int) -> np.ndarray:
+        if len(self.pending):
+            tail = np.concatenate([self.pending, np.zeros((self.HOP - len(self.pending), channels))])
+            gains = self._gains_for(self._analyse(tail))
+            self.gains = np.vstack([self.gains, gains])
+            self.delayed = np.concatenate([self.delayed, self.pending])
+            self.pending = np.zeros((0, channels))
+        return self._emit(final=True)
+
+
+def wave_table(kind: str, size: int, low: float, high: float, phase: float) -> np.ndarray:
+    """ffmpeg's ff_generate_wave_table for sine ('s') and triangle ('t') modulation."""
+    offset = int(phase / math.pi / 2 * size + 0.5)
+    point = (np.arange(size) + offset) % size
+    if kind == 's':
+        d = (np.sin(point / size * 2 * math.pi) + 1) / 2
+    else:
+        d = point * 2 / size
+        quadrant = 4 * point // size
+        d = np.where(quadrant == 0, d + 0.5, np.where(quadrant == 3, d - 1.5, 1.5 - d))
+    return d * (high - low) + low
+
+
+class Phaser:
+    """
+    ffmpeg aphaser: v[n] = in_gain * x[n] + decay * v[n - lag[n]], out = out_gain * v, with the lag
+    swept by a triangle/sine wave between 1 and `delay` ms. The feedback only reaches back
+    `lag` samples, so each stretch shorter than its smallest lag is computed as one vector op.
+    """
+
+    def __init__(self, options: dict, sample_rate: int, channels: int):
+        self.in_gain = float(options.get('in_gain', 0.4))
+        self.out_gain = float(options.get('out_gain', 0.74))
+        self.decay = float(options.get('decay', 0.4))
+        self.length = max(1, int(float(options.get('delay', 3.0)) * sample_rate / 1000))
+        speed = float(options.get('speed', 0.5))
+        kind = options.get('type', 't')[0]
+        table = wave_table('s' if kind == 's' else 't', int(sample_rate / speed), 1, self.length, math.pi / 2)
+        self.lags = (self.length + 1 - np.rint(table)).astype(np.int64)
+        self.mod_pos = 0
+        self.history = np.zeros((self.length, channels))
+
+    def process(self, block: np.ndarray) -> np.ndarray:
+        n = len(block)
+        length = self.length
+        buf = np.concatenate([self.history, np.zeros_like(block)])
+        lags = self.lags[(self.mod_pos + np.arange(n)) % len(self.lags)]
+        self.mod_pos = (self.mod_pos + n) % len(self.lags)
+        i = 0
+        while i < n:
+            step = min(int(lags[i]), n - i)
+            step = min(step, int(lags[i:i + step].min()))
+            idx = length + np.arange(i, i + step)
+            buf[idx] = block[i:i + step] * self.in_gain + buf[idx - lags[i:i + step]] * self.decay
+            i += step
+        self.history = buf[-length:]
+        return buf[length:] * self.out_gain
+
+    def flush(self, channels: int) -> np.ndarray:
+        return np.zeros((0, channels))
+
+
+class Vibrato:
+    """ffmpeg vibrato: sine-modulated fractional delay (up to 5 ms) with linear interpolation."""
+
+    def __init__(self, options: dict, sample_rate: int, channels: int):
+        self.size = int(round(sample_rate * 0.005))
+        depth = float(options.get('d', 0.5))
+        table = wave_table('s', int(round(sample_rate / float(options.get('f', 5.0)))), 0.0, self.size - 1, 3 * math.pi / 2)
+        self.delays = self.size - depth * table
+        self.pos = 0
+        self.line = DelayLine(self.size + 1, channels)
+
+    def process(self, block: np.ndarray) -> np.ndarray:
+        n = len(block)
+        buf = self.line.extend(block)
+        delays = self.delays[(self.pos + np.arange(n)) % len(self.delays)]
+        self.pos = (self.pos + n) % len(self.delays)
+        where = np.arange(n) + self.size + 1 - delays
+        lower = np.floor(where).astype(np.int64)
+        frac = (where - lower)[:, None]
+        return buf[lower] * (1 - frac) + buf[np.minimum(lower + 1, len(buf) - 1)] * frac
+
+    def flush(self, channels: int) -> np.ndarray:
+        return np.zeros((0, channels))
+
+
+def build_chain(filters: List[str], sample_rate: int, channels: int):
+    """Turns ffmpeg filter specs into native processors, merging adjacent biquads into one cascade."""
+    chain = []
+    pending_sos = []
+    for spec in filters:
+        name, options = parse_filter(spec)
+        if name in ('equalizer', 'lowpass', 'highpass', 'bass'):
+            pending_sos.append(biquad_sos(name, options, sample_rate))
+            continue
+        if pending_sos:
+            chain.append(BiquadCascade(np.vstack(pending_sos), channels))
+            pending_sos = []
+        if name == 'aecho':
+            chain.append(Echo(options, sample_rate, channels))
+        elif name == 'compand':
+            chain.append(Compander(options, sample_rate, channels))
+        elif name == 'aphaser':
+            chain.append(Phaser(options, sample_rate, channels))
+        elif name == 'vibrato':
+            chain.append(Vibrato(options, sample_rate, channels))
+    if pending_sos:
+        chain.append(BiquadCascade(np.vstack(pending_sos), channels))
+    return chain
+
+
+def apply_chain(audio: np.ndarray, sample_rate: int, filters: List[str], block_frames: int = BLOCK_FRAMES) -> np.ndarray:
+    """Runs (frames, channels) audio through the native version of an ffmpeg filter chain, block by block."""
+    if not filters:
+        return audio
+    channels = audio.shape[1]
+    chain = build_chain(filters, sample_rate, channels)
+    blocks = []
+    for start in range(0, len(audio), block_frames):
+        block = audio[start:start + block_frames].astype(np.float64)
+        for effect in chain:
+            if not len(block):
+                break
+            block = effect.process(block)
+        blocks.append(block)
+
+    # Drain processors that hold samples back (compand lookahead), pushing the tail through the rest of the chain
+    for i, effect in enumerate(chain):
+        tail = effect.flush(channels)
+        for later in chain[i + 1:]:
+            if not len(tail):
+                break
+            tail = later.process(tail)
+        blocks.append(tail)
+    return np.concatenate(blocks).astype(np.float32)
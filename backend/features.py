@@ -0,0 +1,376 @@
+"""
+Audio features computed once per separated track and kept in an on-disk index: tempo and beat
+grid, musical key and integrated loudness (per stem), so smart-mix can match and align tracks
+without analysing audio again.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+import soundfile as sf
+from scipy.signal import lfilter, resample_poly
+
+import metrics
+from cache import DirectoryCache
+from mixer import stem_version
+from stems import read_stem, stem_names
+
+# Set to 0 to skip feature extraction after separation
+FEATURES_ENABLED = os.environ.get("FEATURES_ENABLED", "1") == "1"
+ANALYSIS_SAMPLE_RATE = 22050
+# Tracks count as tempo-compatible within this relative BPM difference (after half/double-time folding)
+BPM_TOLERANCE = float(os.environ.get("FEATURES_BPM_TOLERANCE", "0.08"))
+# Smart-mix: largest tempo change applied to the vocals, and where they sit against the backing
+MAX_TEMPO_STRETCH = float(os.environ.get("SMART_MIX_MAX_STRETCH", "0.12"))
+VOCAL_OFFSET_DB = float(os.environ.get("SMART_MIX_VOCAL_OFFSET_DB", "1.5"))
+ALIGNED_CACHE_MAX_BYTES = int(float(os.environ.get("ALIGNED_CACHE_MAX_GB", "1")) * 1024 ** 3)
+
+PITCH_CLASSES = ["C", "C#", "D", "D#", "E", "F", "F#", "G", "G#", "A", "A#", "B"]
+# Krumhansl-Schmuckler key profiles
+MAJOR_PROFILE = np.array([6.35, 2.23, 3.48, 2.33, 4.38, 4.09, 2.52, 5.19, 2.39, 3.66, 2.29, 2.88])
+MINOR_PROFILE = np.array([6.33, 2.68, 3.52, 5.38, 2.60, 3.53, 2.54, 4.75, 3.98, 2.69, 3.34, 3.17])
+PERCUSSIVE_STEMS = {"drums"}
+
+
+# --- Analysis
+
+def _biquad(b0, b1, b2, a0, a1, a2):
+    return np.array([b0, b1, b2]) / a0, np.array([a0, a1, a2]) / a0
+
+
+def k_weighting(sample_rate: int):
+    """ITU-R BS.1770 K-weighting (high shelf + high pass) as two biquads designed for sample_rate."""
+    # High shelf: +4 dB above ~1.5 kHz
+    gain, q, fc = 4.0, 1 / np.sqrt(2), 1500.0
+    A = 10 ** (gain / 40)
+    w0 = 2 * np.pi * fc / sample_rate
+    alpha = np.sin(w0) / (2 * q)
+    shelf = _biquad(
+        A * ((A + 1) + (A - 1) * np.cos(w0) + 2 * np.sqrt(A) * alpha),
+        -2 * A * ((A - 1) + (A + 1) * np.cos(w0)),
+        A * ((A + 1) + (A - 1) * np.cos(w0) - 2 * np.sqrt(A) * alpha),
+        (A + 1) - (A - 1) * np.cos(w0) + 2 * np.sqrt(A) * alpha,
+        2 * ((A - 1) - (A + 1) * np.cos(w0)),
+        (A + 1) - (A - 1) * np.cos(w0) - 2 * np.sqrt(A) * alpha,
+    )
+    # High pass at ~38 Hz
+    q, fc = 0.5, 38.0
+    w0 = 2 * np.pi * fc / sample_rate
+    alpha = np.sin(w0) / (2 * q)
+    highpass = _biquad((1 + np.cos(w0)) / 2, -(1 + np.cos(w0)), (1 + np.cos(w0)) / 2, 1 + alpha, -2 * np.cos(w0), 1 - alpha)
+    return shelf, highpass
+
+
+def integrated_loudness(data, sample_rate: int) -> float:
+    """BS.1770 integrated loudness (LUFS) of (frames, channels) audio, with absolute and relative gating."""
+    (b1, a1), (b2, a2) = k_weighting(sample_rate)
+    weighted = lfilter(b2, a2, lfilter(b1, a1, data, axis=0), axis=0)
+    block, step = int(0.4 * sample_rate), int(0.1 * sample_rate)
+    if len(weighted) < block:
+        return -70.0
+    # Mean square of every 400 ms block (75% overlap) from a running sum, summed over channels
+    power = np.concatenate([np.zeros((1, weighted.shape[1])), np.cumsum(weighted.astype(np.float64) ** 2, axis=0)])
+    starts = np.arange(0, len(weighted) - block + 1, step)
+    z = ((power[starts + block] - power[starts]) / block).sum(axis=1)
+    with np.errstate(divide="ignore"):
+        loudness = -0.691 + 10 * np.log10(z)
+    gated = z[loudness > -70]
+    if not len(gated):
+        return -70.0
+    relative = -0.691 + 10 * np.log10(gated.mean()) - 10
+    gated = z[loudness > relative]
+    return round(float(-0.691 + 10 * np.log10(gated.mean())), 2) if len(gated) else -70.0
+
+
+def detect_key(mono, sample_rate: int = ANALYSIS_SAMPLE_RATE) -> dict:
+    """Key by correlating the mean chroma with all 24 rotated major/minor profiles at once."""
+    import librosa
+    chroma = librosa.feature.chroma_cqt(y=mono, sr=sample_rate).mean(axis=1)
+    if not chroma.any():
+        return {"key": None, "mode": None, "confidence": 0.0}
+    rotations = np.array([np.roll(np.arange(12), tonic) for tonic in range(12)])
+    profiles = np.concatenate([MAJOR_PROFILE[rotations], MINOR_PROFILE[rotations]])  # (24, 12): profile of each tonic
+    scores = np.corrcoef(np.vstack([chroma, profiles]))[0, 1:]
+    best = int(np.argmax(scores))
+    return {"key": best % 12, "mode": "major" if best < 12 else "minor", "confidence": round(float(scores[best]), 3)}
+
+
+def detect_tempo(mono, sample_rate: int = ANALYSIS_SAMPLE_RATE) -> dict:
+    import librosa
+    tempo, beats = librosa.beat.beat_track(y=mono, sr=sample_rate, units="time")
+    return {"bpm": round(float(np.atleast_1d(tempo)[0]), 2), "beats": [round(float(t), 3) for t in beats]}
+
+
+def key_name(key, mode) -> str:
+    return f"{PITCH_CLASSES[key]} {mode}" if key is not None else None
+
+
+def camelot(key, mode):
+    """Camelot wheel position (1-12, "A" minor / "B" major); neighbours mix harmonically."""
+    if key is None:
+        return None
+    major = key if mode == "major" else (key + 3) % 12
+    return (7 * major + 7) % 12 + 1, "B" if mode == "major" else "A"
+
+
+def _analysis_mono(data, sample_rate: int):
+    mono = data.mean(axis=1)
+    if sample_rate != ANALYSIS_SAMPLE_RATE:
+        g = np.gcd(sample_rate, ANALYSIS_SAMPLE_RATE)
+        mono = resample_poly(mono, ANALYSIS_SAMPLE_RATE // g, sample_rate // g)
+    return mono.astype(np.float32)
+
+
+def analyze_stems(stems_dir: str) -> dict:
+    """
+    Features of a separated track: tempo and beat grid (from the drums, else the full mix),
+    key (from the harmonic stems) and integrated loudness of the mix and of every stem,
+    plus each harmonic stem's own key.
+    """
+    stems = {}
+    for name in stem_names(stems_dir):
+        stems[name] = read_stem(os.path.join(stems_dir, f"{name}.wav"))
+    if not stems:
+        raise ValueError(f"No stems in {stems_dir}")
+    sample_rate = next(iter(stems.values()))[1]
+    frames = max(len(data) for data, _ in stems.values())
+
+    def total(names):
+        mix = np.zeros((frames, max(data.shape[1] for data, _ in stems.values())), dtype=np.float32)
+        for name in names:
+            data = stems[name][0]
+            mix[:len(data), :data.shape[1]] += data
+        return mix
+
+    mix = total(stems)
+    harmonic = [name for name in stems if name not in PERCUSSIVE_STEMS] or list(stems)
+    rhythm = _analysis_mono(stems["drums"][0] if "drums" in stems else mix, sample_rate)
+
+    per_stem = {}
+    for name, (data, rate) in stems.items():
+        per_stem[name] = {"loudness": integrated_loudness(data, rate)}
+        if name not in PERCUSSIVE_STEMS:
+            per_stem[name].update(detect_key(_analysis_mono(data, rate)))
+    return {
+        "duration": round(frames / sample_rate, 2),
+        **detect_tempo(rhythm),
+        **detect_key(_analysis_mono(total(harmonic), sample_rate)),
+        "loudness": integrated_loudness(mix, sample_rate),
+        "stems": per_stem,
+    }
+
+
+# --- Index
+
+class FeatureIndex:
+    """SQLite table of analysed tracks, keyed by stem cache key (the stems directory name)."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS features ("
+            "track TEXT PRIMARY KEY, stems_dir TEXT NOT NULL, name TEXT, bpm REAL, key INTEGER, mode TEXT, "
+            "loudness REAL, duration REAL, data TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS features_bpm ON features (bpm)")
+        conn.commit()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def get(self, track: str):
+        row = self._conn().execute("SELECT * FROM features WHERE track = ?", (track,)).fetchone()
+        return _record(row) if row else None
+
+    def put(self, track: str, stems_dir: str, features: dict, name: str = None):
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO features (track, stems_dir, name, bpm, key, mode, loudness, duration, data, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (track, stems_dir, name, features["bpm"], features["key"], features["mode"],
+             features["loudness"], features["duration"], json.dumps(features), time.time()),
+        )
+        conn.commit()
+
+    def compatible(self, track: str, limit: int = 10, tolerance: float = BPM_TOLERANCE) -> list:
+        """
+        Indexed tracks that mix well with track: tempo within tolerance (also at half/double
+        time, found through the bpm index) and a key on the same or a neighbouring Camelot
+        position. Best matches first.
+        """
+        ref = self.get(track)
+        if ref is None or not ref["bpm"]:
+            return []
+        bands = [(ref["bpm"] * f * (1 - tolerance), ref["bpm"] * f * (1 + tolerance)) for f in (0.5, 1, 2)]
+        rows = self._conn().execute(
+            "SELECT * FROM features WHERE track != ? AND (" + " OR ".join(["bpm BETWEEN ? AND ?"] * len(bands)) + ")",
+            (track, *[bound for band in bands for bound in band]),
+        ).fetchall()
+        matches = []
+        for row in rows:
+            other = _record(row)
+            distance = key_distance(ref, other)
+            if distance is None or distance > 1:
+                continue
+            ratio = tempo_ratio(other["bpm"], ref["bpm"])
+            matches.append({
+                "track": other["track"],
+                "stems_dir": other["stems_dir"],
+                "name": other["name"],
+                "bpm": other["bpm"],
+                "key": key_name(other["key"], other["mode"]),
+                "loudness": other["loudness"],
+                "tempo_ratio": round(ratio, 4),
+                "key_distance": distance,
+                "score": round(abs(ratio - 1) / tolerance + distance, 3),
+            })
+        return sorted(matches, key=lambda match: match["score"])[:limit]
+
+
+def _record(row) -> dict:
+    return {**json.loads(row["data"]), "track": row["track"], "stems_dir": row["stems_dir"], "name": row["name"]}
+
+
+def key_distance(a: dict, b: dict):
+    """Steps between two keys on the Camelot wheel (0 = same or relative key), None if unknown."""
+    ca, cb = camelot(a["key"], a["mode"]), camelot(b["key"], b["mode"])
+    if ca is None or cb is None:
+        return None
+    steps = min((ca[0] - cb[0]) % 12, (cb[0] - ca[0]) % 12)
+    if ca[1] != cb[1]:
+        # Relative major/minor share a number; any other mode change is a bigger jump
+        return 0 if steps == 0 else steps + 1
+    return steps
+
+
+def tempo_ratio(source_bpm: float, target_bpm: float) -> float:
+    """Playback rate that brings source_bpm to target_bpm, folded by half/double time towards 1."""
+    ratio = target_bpm / source_bpm
+    while ratio > 1.5:
+        ratio /= 2
+    while ratio < 0.75:
+        ratio *= 2
+    return ratio
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index(output_dir: str) -> FeatureIndex:
+    path = os.environ.get("FEATURE_DB_PATH", os.path.join(output_dir, "features.db"))
+    with _indexes_lock:
+        if path not in _indexes:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            _indexes[path] = FeatureIndex(path)
+        return _indexes[path]
+
+
+def index_stems(stems_dir: str, output_dir: str, name: str = None) -> dict:
+    """Features of a separated track, analysing it only the first time it is seen."""
+    index = get_index(output_dir)
+    track = os.path.basename(os.path.normpath(stems_dir))
+    features = index.get(track)
+    if features is None:
+        with metrics.span("features"):
+            features = analyze_stems(stems_dir)
+        index.put(track, stems_dir, features, name)
+        features = index.get(track)
+    return features
+
+
+def index_many(stems_dirs, output_dir: str) -> int:
+    """Indexes several separated tracks (a background job); failures are logged and skipped."""
+    indexed = 0
+    for stems_dir in stems_dirs:
+        try:
+            index_stems(stems_dir, output_dir)
+            indexed += 1
+        except Exception as e:
+            print(f"Feature extraction failed for {stems_dir}: {e}")
+    return indexed
+
+
+def track_features(stems_dir: str, output_dir: str):
+    return get_index(output_dir).get(os.path.basename(os.path.normpath(stems_dir)))
+
+
+# --- Smart-mix alignment
+
+_aligned_stores = {}
+
+
+def get_aligned_store(output_dir: str) -> DirectoryCache:
+    root = os.path.abspath(os.path.join(output_dir, "aligned"))
+    if root not in _aligned_stores:
+        _aligned_stores[root] = DirectoryCache(root, ALIGNED_CACHE_MAX_BYTES)
+    return _aligned_stores[root]
+
+
+def _power_sum(levels) -> float:
+    levels = [level for level in levels if level is not None and level > -70]
+    return 10 * np.log10(sum(10 ** (level / 10) for level in levels)) if levels else None
+
+
+def plan_smart_mix(vocals: dict, backing: dict, backing_stems) -> dict:
+    """
+    Gain and tempo alignment for vocals from one track over stems of another, from their indexed
+    features: the vocals are set VOCAL_OFFSET_DB above the backing's combined loudness and
+    stretched (within MAX_TEMPO_STRETCH) to the backing's tempo with their first beats lined up.
+    """
+    plan = {"vocal_gain": 1.2, "tempo_ratio": 1.0, "offset_seconds": 0.0}
+    bed = _power_sum([backing["stems"].get(name, {}).get("loudness") for name in backing_stems])
+    voice = vocals["stems"].get("vocals", {}).get("loudness")
+    if bed is not None and voice is not None and voice > -70:
+        plan["vocal_gain"] = round(float(np.clip(10 ** ((bed + VOCAL_OFFSET_DB - voice) / 20), 0.25, 4.0)), 3)
+    if vocals.get("bpm") and backing.get("bpm"):
+        ratio = tempo_ratio(vocals["bpm"], backing["bpm"])
+        if abs(ratio - 1) <= MAX_TEMPO_STRETCH:
+            plan["tempo_ratio"] = round(ratio, 4)
+            if vocals.get("beats") and backing.get("beats"):
+                plan["offset_seconds"] = round(backing["beats"][0] - vocals["beats"][0] / ratio, 3)
+    return plan
+
+
+def align_stem(path: str, tempo_ratio: float, offset_seconds: float, output_dir: str) -> str:
+    """
+    The stem at path played tempo_ratio times faster and moved by offset_seconds (padded with
+    silence or trimmed at the start), from the aligned-stem cache.
+    """
+    if abs(tempo_ratio - 1) < 1e-3 and abs(offset_seconds) < 1e-3:
+        return path
+    import librosa
+    store = get_aligned_store(output_dir)
+    blob = json.dumps({"stem": stem_version(path), "ratio": tempo_ratio, "offset": offset_seconds})
+    key = hashlib.sha256(blob.encode()).hexdigest()[:32] + ".wav"
+    cached = store.get(key)
+    if cached:
+        return cached
+
+    data, sample_rate = read_stem(path)
+    if abs(tempo_ratio - 1) >= 1e-3:
+        data = librosa.effects.time_stretch(np.ascontiguousarray(data.T), rate=tempo_ratio).T
+    shift = int(round(offset_seconds * sample_rate))
+    if shift > 0:
+        data = np.concatenate([np.zeros((shift, data.shape[1]), dtype=data.dtype), data])
+    elif shift < 0:
+        data = data[-shift:]
+    tmp_path = store.reserve(key) + ".wav"
+    try:
+        sf.write(tmp_path, np.clip(data, -1, 1), sample_rate, subtype="PCM_16")
+        return store.publish(key, tmp_path)
+    except Exception:
+        store.discard(tmp_path)
+        raise
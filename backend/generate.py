@@ -1,28 +1,310 @@
 from transformers import AutoProcessor, MusicgenForConditionalGeneration
+from transformers.generation.streamers import BaseStreamer
+from concurrent.futures import Future
+from contextlib import contextmanager
+from cache import DirectoryCache
+import metrics
 import scipy.io.wavfile
+import numpy as np
+import threading
+import hashlib
+import struct
+import queue
 import torch
+import json
+import time
 import os
 
+MODEL_NAME = "facebook/musicgen-small"
+FRAME_RATE = 50  # EnCodec frames (decoder steps) per second of audio for musicgen-small
+MAX_DURATION = int(os.environ.get("MUSICGEN_MAX_DURATION", "30"))
+# Streaming generation decodes and emits audio every this many seconds of tokens
+STREAM_CHUNK_SECONDS = float(os.environ.get("MUSICGEN_STREAM_CHUNK_SECONDS", "1.0"))
+
+# Micro-batching: concurrent requests arriving within the window share one generate() call
+MAX_BATCH_SIZE = int(os.environ.get("MUSICGEN_MAX_BATCH", "4"))
+BATCH_WINDOW_MS = float(os.environ.get("MUSICGEN_BATCH_WINDOW_MS", "50"))
+
+# Generated tracks are cached by prompt + generation parameters + seed
+GENERATION_CACHE_MAX_BYTES = int(float(os.environ.get("GENERATION_CACHE_MAX_GB", "2")) * 1024 ** 3)
+GENERATION_CACHE_MAX_AGE = float(os.environ.get("GENERATION_CACHE_MAX_AGE_HOURS", "72")) * 3600
+
+# CPU inference profile: "cpu" turns on int8 dynamic quantization and uses every core,
+# "default" keeps the fp32 model and torch's own threading. Individual knobs override the profile.
+MUSICGEN_PROFILE = os.environ.get("MUSICGEN_PROFILE", "default")
+CPU_PROFILE = MUSICGEN_PROFILE == "cpu"
+QUANTIZE = os.environ.get("MUSICGEN_QUANTIZE", "1" if CPU_PROFILE else "0") == "1"
+COMPILE = os.environ.get("MUSICGEN_COMPILE", "0") == "1"
+NUM_THREADS = int(os.environ.get("TORCH_NUM_THREADS", str(os.cpu_count() or 1) if CPU_PROFILE else "0"))
+INTEROP_THREADS = int(os.environ.get("TORCH_INTEROP_THREADS", "1" if CPU_PROFILE else "0"))
+
 # Initialize model (lazy loading or on startup)
 processor = None
 model = None
+model_profile = {}
+
+def configure_threads():
+    if NUM_THREADS:
+        torch.set_num_threads(NUM_THREADS)
+    if INTEROP_THREADS:
+        try:
+            torch.set_num_interop_threads(INTEROP_THREADS)
+        except RuntimeError:
+            # Only allowed before the first parallel op; keep whatever is already set
+            pass
+
+def build_model(quantize: bool = QUANTIZE, compile: bool = COMPILE):
+    """Loads processor and model, applying the CPU optimizations that were asked for."""
+    configure_threads()
+    new_processor = AutoProcessor.from_pretrained(MODEL_NAME)
+    new_model = MusicgenForConditionalGeneration.from_pretrained(MODEL_NAME)
+    # Move to GPU if available
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    new_model.to(device)
+    new_model.eval()
+    if device == "cpu" and quantize:
+        # int8 weights for the Linear layers of the text encoder and the token decoder;
+        # EnCodec is convolutional and stays fp32
+        new_model.text_encoder = torch.ao.quantization.quantize_dynamic(new_model.text_encoder, {torch.nn.Linear}, dtype=torch.qint8)
+        new_model.decoder = torch.ao.quantization.quantize_dynamic(new_model.decoder, {torch.nn.Linear}, dtype=torch.qint8)
+    if compile:
+        # Compile the per-step decoder forward; attributes stay reachable on the module
+        new_model.decoder.forward = torch.compile(new_model.decoder.forward, dynamic=True)
+    return new_processor, new_model
 
 def load_model():
-    global processor, model
+    global processor, model, model_profile
     if model is None:
-        processor = AutoProcessor.from_pretrained("facebook/musicgen-small")
-        model = MusicgenForConditionalGeneration.from_pretrained("facebook/musicgen-small")
-        # Move to GPU if available
-        device = "cuda" if torch.cuda.is_available() else "cpu"
-        model.to(device)
+        processor, model = build_model()
+        model_profile = {
+            "profile": MUSICGEN_PROFILE,
+            "device": str(model.device),
+            "quantized": QUANTIZE and model.device.type == "cpu",
+            "compiled": COMPILE,
+            "threads": torch.get_num_threads(),
+            "interop_threads": torch.get_num_interop_threads(),
+        }
+
+class TokenProgress(BaseStreamer):
+    """Counts decoder steps during model.generate and reports them to every callback as progress(done, total)."""
+
+    def __init__(self, total: int, callbacks):
+        self.total = total
+        self.callbacks = [cb for cb in callbacks if cb]
+        self.steps = -1  # the first put() carries the decoder start tokens, not a generated step
 
-def generate_track(prompt: str, language: str, duration: int = 15, output_path: str = "generated.wav"):
+    def put(self, value):
+        self.steps += 1
+        if self.steps > 0:
+            for cb in self.callbacks:
+                cb(min(self.steps, self.total), self.total)
+
+    def end(self):
+        for cb in self.callbacks:
+            cb(self.total, self.total)
+
+class AudioStreamer(BaseStreamer):
     """
-    Generates music based on a text prompt and language style.
+    Turns MusicGen codes into audio while model.generate is still running.
+    Every `play_steps` decoder steps the tokens so far are un-delayed (MusicGen offsets
+    codebook k by k steps) and decoded with EnCodec; the newly finished samples are passed
+    to on_audio(values). The last `stride` samples are held back each time because they
+    change once later frames arrive. Batch size 1 only.
     """
-    global processor, model
-    load_model()
-    
+
+    def __init__(self, on_audio, play_steps: int, total: int = None, progress=None):
+        self.on_audio = on_audio
+        self.play_steps = max(play_steps, model.decoder.num_codebooks + 1)
+        self.total = total
+        self.progress = progress
+        hop_length = int(np.prod(model.config.audio_encoder.upsampling_ratios))
+        self.stride = hop_length * (self.play_steps - model.decoder.num_codebooks) // 6
+        self.tokens = None
+        self.emitted = 0
+        self.steps = -1
+
+    def decode(self):
+        tokens = self.tokens
+        _, delay_mask = model.decoder.build_delay_pattern_mask(
+            tokens[:, :1],
+            pad_token_id=model.generation_config.decoder_start_token_id,
+            max_length=tokens.shape[-1],
+        )
+        tokens = model.decoder.apply_delay_pattern_mask(tokens, delay_mask)
+        # Drop the delay padding so every codebook lines up on the same frames
+        tokens = tokens[tokens != model.generation_config.pad_token_id].reshape(1, model.decoder.num_codebooks, -1)
+        codes = tokens[None, ...].to(model.audio_encoder.device)
+        audio = model.audio_encoder.decode(codes, audio_scales=[None]).audio_values[0, 0]
+        return audio.cpu().float().numpy()
+
+    def put(self, value):
+        if value.shape[0] // model.decoder.num_codebooks > 1:
+            raise ValueError("AudioStreamer only supports batch size 1")
+        if self.tokens is None:
+            self.tokens = value
+        else:
+            self.tokens = torch.cat([self.tokens, value[:, None]], dim=-1)
+        self.steps += 1
+        if self.progress and self.total and self.steps > 0:
+            self.progress(min(self.steps, self.total), self.total)
+        if self.tokens.shape[-1] % self.play_steps == 0:
+            audio = self.decode()
+            ready = len(audio) - self.stride
+            if ready > self.emitted:
+                self.on_audio(audio[self.emitted:ready])
+                self.emitted = ready
+
+    def end(self):
+        if self.tokens is not None:
+            audio = self.decode()
+            if len(audio) > self.emitted:
+                self.on_audio(audio[self.emitted:])
+        if self.progress and self.total:
+            self.progress(self.total, self.total)
+
+@contextmanager
+def seeded(seed: int, device):
+    """
+    Runs the block on its own torch.Generator seeded with `seed`. generate() has no generator
+    argument and samples from the default generator, so the call's generator state is swapped
+    in for the block and the global state is restored afterwards.
+    """
+    if seed is None:
+        yield
+        return
+    generator = torch.Generator(device=device)
+    generator.manual_seed(seed)
+    devices = [device] if device.type == "cuda" else []
+    with torch.random.fork_rng(devices=devices):
+        if device.type == "cuda":
+            torch.cuda.set_rng_state(generator.get_state(), device)
+        else:
+            torch.set_rng_state(generator.get_state())
+        yield
+
+class _Request:
+    def __init__(self, prompt: str, params: tuple, progress, streamer=None):
+        self.prompt = prompt
+        self.params = params
+        self.progress = progress
+        self.streamer = streamer
+        self.future = Future()
+
+class GenerationBatcher:
+    """
+    Collects generation requests that arrive within `window_ms` of each other (up to
+    `max_batch` with identical generation parameters), pads their prompts into one
+    batch and runs a single model.generate call, then hands each caller its own audio.
+    Every generate call in the process runs on the batcher's thread. Sampling draws the
+    noise for all rows of a batch together, so only unseeded requests are batched: a seeded
+    request (whose audio the generation cache keys by seed) or one that carries its own
+    streamer (streaming generation) is run as a batch of one.
+    """
+
+    def __init__(self, max_batch: int = MAX_BATCH_SIZE, window_ms: float = BATCH_WINDOW_MS):
+        self.max_batch = max(1, max_batch)
+        self.window = window_ms / 1000
+        self.queue = queue.Queue()
+        self.held = []  # requests with different parameters than the batch being collected
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stats = {
+            "max_batch_size": self.max_batch,
+            "batch_window_ms": window_ms,
+            "batches": 0,
+            "requests": 0,
+            "last_batch_size": 0,
+            "batch_sizes": {},
+        }
+
+    def submit(self, prompt: str, max_new_tokens: int, guidance_scale: float, seed: int = None, progress=None,
+               streamer=None):
+        """
+        Queues a prompt and blocks until its audio (1-D numpy array) is ready.
+        A seeded request always yields the same audio for its prompt, whatever else is queued.
+        A streamer (batch size 1 only) replaces the progress callback.
+        """
+        self._ensure_thread()
+        request = _Request(prompt, (max_new_tokens, guidance_scale, seed), progress, streamer)
+        self.queue.put(request)
+        return request.future.result()
+
+    def _ensure_thread(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._loop, name="musicgen-batcher", daemon=True)
+                self.thread.start()
+
+    def _next(self, timeout=None):
+        if self.held:
+            return self.held.pop(0)
+        return self.queue.get(timeout=timeout)
+
+    def _collect(self):
+        from_held = bool(self.held)
+        first = self._next()
+        batch = [first]
+        if not self._batchable(first):
+            return batch
+        for request in list(self.held):
+            if len(batch) < self.max_batch and request.params == first.params and self._batchable(request):
+                self.held.remove(request)
+                batch.append(request)
+        # A held request already waited out a window; it only picks up what is queued by now
+        deadline = time.monotonic() + (0 if from_held else self.window)
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                request = self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if request.params == first.params and self._batchable(request):
+                batch.append(request)
+            else:
+                self.held.append(request)
+        return batch
+
+    @staticmethod
+    def _batchable(request) -> bool:
+        seed = request.params[2]
+        return seed is None and request.streamer is None
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            try:
+                audio = self._run(batch)
+                for request, values in zip(batch, audio):
+                    request.future.set_result(values)
+            except Exception as e:
+                for request in batch:
+                    request.future.set_exception(e)
+
+    def _run(self, batch):
+        load_model()
+        max_new_tokens, guidance_scale, seed = batch[0].params
+        size = len(batch)
+        self.stats["batches"] += 1
+        self.stats["requests"] += size
+        self.stats["last_batch_size"] = size
+        self.stats["batch_sizes"][size] = self.stats["batch_sizes"].get(size, 0) + 1
+        metrics.GENERATION_BATCH_SIZE.observe(size)
+        print(f"Generating batch of {size} prompt(s)")
+
+        inputs = processor(
+            text=[request.prompt for request in batch],
+            padding=True,
+            return_tensors="pt",
+        ).to(model.device)
+        streamer = batch[0].streamer or TokenProgress(max_new_tokens, [request.progress for request in batch])
+        with seeded(seed, model.device), torch.inference_mode():
+            audio_values = model.generate(**inputs, max_new_tokens=max_new_tokens, guidance_scale=guidance_scale, streamer=streamer)
+        return [audio_values[i, 0].cpu().numpy() for i in range(size)]
+
+batcher = GenerationBatcher()
+
+def build_prompt(mood: str, genre: str, language: str) -> str:
+    """Expands mood, genre and language into the full MusicGen text prompt."""
     # Map languages to descriptive musical styles
     language_styles = {
         "Tamil": "Tamil film song, Kollywood style, carnatic elements, heavy percussion",
@@ -32,7 +314,7 @@ def generate_track(prompt: str, language: str, duration: int = 15, output_path:
         "Kannada": "Sandalwood hit, traditional folk fusion, rhythmic theme",
         "English": "Billboard top 100 pop, modern production, high quality vocals style",
     }
-    
+
     # Map genres to descriptive keywords
     genre_keywords = {
         "Pop": "catchy melody, commercial production, upbeat",
@@ -46,27 +328,109 @@ def generate_track(prompt: str, language: str, duration: int = 15, output_path:
         "Folk": "acoustic guitar, organic sound, traditional storytelling",
         "Reggae": "offbeat rhythm, deep bass, island vibe"
     }
-    
+
     style_desc = language_styles.get(language, f"{language} regional music style")
-    genre_desc = genre_keywords.get(prompt.split()[-1], "") # Assuming prompt ends with genre
-    
-    full_prompt = f"{prompt}, {genre_desc}, {style_desc}, high fidelity, 44.1khz, studio master"
-    print(f"Generating with prompt: {full_prompt}")
-    
-    inputs = processor(
-        text=[full_prompt],
-        padding=True,
-        return_tensors="pt",
-    ).to(model.device)
-    
-    # Generate - 250 tokens is approx 5-6 seconds, faster than 400 for CPU
+    genre_desc = genre_keywords.get(genre, "")
+
+    return f"{mood} {genre}, {genre_desc}, {style_desc}, high fidelity, 44.1khz, studio master"
+
+_stores = {}
+
+def get_generation_store(output_dir: str) -> DirectoryCache:
+    root = os.path.abspath(os.path.join(output_dir, "generated"))
+    if root not in _stores:
+        _stores[root] = DirectoryCache(root, GENERATION_CACHE_MAX_BYTES, GENERATION_CACHE_MAX_AGE)
+    return _stores[root]
+
+def generation_params(duration: float = 5, seed: int = 0) -> dict:
+    # One decoder step per EnCodec frame, so 5 seconds is 250 tokens
     # guidance_scale=3.0 provides good style matching without extra compute
-    audio_values = model.generate(**inputs, max_new_tokens=250, guidance_scale=3.0)
-    
+    if not np.isfinite(duration):
+        raise ValueError(f"Duration must be a finite number of seconds, got {duration}")
+    duration = min(max(duration, 1), MAX_DURATION)
+    return {"max_new_tokens": int(duration * FRAME_RATE), "guidance_scale": 3.0, "seed": seed}
+
+def generation_key(full_prompt: str, params: dict) -> str:
+    """Cache key for a generation: expanded prompt + model + every parameter that changes the audio."""
+    blob = json.dumps({"prompt": full_prompt, "model": MODEL_NAME, "quantized": QUANTIZE, **params}, sort_keys=True)
+    return hashlib.sha256(blob.encode()).hexdigest()[:32]
+
+def generate_track(full_prompt: str, output_path: str, params: dict, progress=None):
+    """
+    Generates music for an expanded prompt (see build_prompt) and writes it to output_path.
+    progress(done, total) receives generated token counts.
+    """
+    load_model()
+    print(f"Generating with prompt: {full_prompt}")
+
+    with metrics.span("generation"):
+        data = batcher.submit(full_prompt, progress=progress, **params)
+
     # Save to file
     sampling_rate = model.config.audio_encoder.sampling_rate
-    import torch
-    data = audio_values[0, 0].cpu().numpy()
     scipy.io.wavfile.write(output_path, rate=sampling_rate, data=data)
-    
+
     return {"status": "success", "file": output_path}
+
+def generate_cached(full_prompt: str, output_dir: str, params: dict, progress=None):
+    """
+    Returns the cached track for this prompt/params, generating and publishing it on a miss.
+    The result's "file" is relative to output_dir, ready for /api/download.
+    """
+    store = get_generation_store(output_dir)
+    key = generation_key(full_prompt, params)
+    name = f"{key}.wav"
+    cached = store.get(name)
+    hit = cached is not None
+    if not hit:
+        tmp_path = store.reserve(name) + ".wav"
+        try:
+            generate_track(full_prompt, tmp_path, params, progress)
+            cached = store.publish(name, tmp_path)
+        except Exception:
+            store.discard(tmp_path)
+            raise
+    return {"status": "success", "file": os.path.relpath(cached, output_dir).replace(os.sep, "/"), "cached": hit}
+
+def stream_cached(full_prompt: str, output_dir: str, params: dict, on_audio, progress=None):
+    """
+    Generates like generate_cached, but hands audio to on_audio(values, sampling_rate) in
+    chunks of STREAM_CHUNK_SECONDS as soon as they are decoded. The finished track is
+    published to the generation cache, so a later request for it is served from disk.
+    """
+    load_model()
+    store = get_generation_store(output_dir)
+    key = generation_key(full_prompt, params)
+    name = f"{key}.wav"
+    sampling_rate = model.config.audio_encoder.sampling_rate
+    print(f"Streaming generation with prompt: {full_prompt}")
+
+    chunks = []
+    def emit(values):
+        chunks.append(values)
+        on_audio(values, sampling_rate)
+
+    streamer = AudioStreamer(emit, int(STREAM_CHUNK_SECONDS * FRAME_RATE), params["max_new_tokens"], progress)
+    with metrics.span("generation"):
+        batcher.submit(full_prompt, streamer=streamer, **params)
+
+    tmp_path = store.reserve(name) + ".wav"
+    try:
+        scipy.io.wavfile.write(tmp_path, rate=sampling_rate, data=np.concatenate(chunks))
+        store.publish(name, tmp_path)
+    except Exception:
+        store.discard(tmp_path)
+        raise
+    return {"status": "success", "file": f"generated/{name}"}
+
+def to_pcm16(values) -> bytes:
+    return (np.clip(values, -1, 1) * 32767).astype("<i2").tobytes()
+
+def wav_stream_header(sampling_rate: int, channels: int = 1) -> bytes:
+    """16-bit PCM WAV header with open-ended sizes, for audio whose length isn't known yet."""
+    block_align = channels * 2
+    return (
+        b"RIFF" + struct.pack("<I", 0xFFFFFFFF) + b"WAVE"
+        + b"fmt " + struct.pack("<IHHIIHH", 16, 1, channels, sampling_rate, sampling_rate * block_align, block_align, 16)
+        + b"data" + struct.pack("<I", 0xFFFFFFFF)
+    )
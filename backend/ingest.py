@@ -0,0 +1,174 @@
+import asyncio
+import hashlib
+import os
+import time
+import uuid
+import zipfile
+
+import metrics
+import procs
+from cache import DirectoryCache
+
+# Uploads larger than this are rejected with 413
+MAX_UPLOAD_BYTES = int(float(os.environ.get("MAX_UPLOAD_MB", "200")) * 1024 ** 2)
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+# Raw uploads are deleted this long after they were written
+UPLOAD_TTL_SECONDS = float(os.environ.get("UPLOAD_TTL_HOURS", "24")) * 3600
+UPLOAD_GC_INTERVAL_SECONDS = float(os.environ.get("UPLOAD_GC_INTERVAL_MINUTES", "30")) * 60
+
+# Every stage reads uploads in one canonical form: float32 PCM WAV at the separation model's rate
+CANONICAL_SAMPLE_RATE = 44100
+CANONICAL_CHANNELS = 2
+CANONICAL_CACHE_MAX_BYTES = int(float(os.environ.get("CANONICAL_CACHE_MAX_GB", "5")) * 1024 ** 3)
+
+
+# Batch remix: most tracks per job, and the audio files taken from uploaded .zip archives
+MAX_BATCH_ITEMS = int(os.environ.get("MAX_BATCH_ITEMS", "500"))
+MAX_BATCH_UPLOAD_BYTES = int(float(os.environ.get("MAX_BATCH_UPLOAD_MB", "4096")) * 1024 ** 2)
+AUDIO_EXTENSIONS = {".wav", ".mp3", ".flac", ".ogg", ".opus", ".m4a", ".aac", ".aiff", ".aif", ".wma"}
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+async def save_upload(file, upload_dir: str, max_bytes: int = MAX_UPLOAD_BYTES) -> dict:
+    """
+    Streams an UploadFile to disk chunk by chunk without blocking the event loop, hashing it
+    on the way. The file is stored as <sha256><ext>, so identical uploads share one copy.
+    Returns {"path", "sha256", "bytes"}; raises UploadTooLarge past max_bytes.
+    """
+    os.makedirs(upload_dir, exist_ok=True)
+    ext = os.path.splitext(file.filename or "")[1].lower()[:10]
+    part_path = os.path.join(upload_dir, f".part-{uuid.uuid4().hex}")
+    digest = hashlib.sha256()
+    size = 0
+    out = await asyncio.to_thread(open, part_path, "wb")
+    try:
+        while True:
+            chunk = await file.read(UPLOAD_CHUNK_BYTES)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > max_bytes:
+                raise UploadTooLarge(f"Upload exceeds the {max_bytes // 1024 ** 2} MB limit")
+            digest.update(chunk)
+            await asyncio.to_thread(out.write, chunk)
+    except BaseException:
+        out.close()
+        os.remove(part_path)
+        raise
+    await asyncio.to_thread(out.close)
+
+    sha = digest.hexdigest()
+    path = os.path.join(upload_dir, f"{sha}{ext}")
+    os.replace(part_path, path)
+    return {"path": path, "sha256": sha, "bytes": size}
+
+
+def extract_archive(archive_path: str, upload_dir: str, max_bytes: int = MAX_UPLOAD_BYTES) -> list:
+    """
+    Copies the audio files out of a .zip into upload_dir the way save_upload stores them
+    (<sha256><ext>). Returns [{"path", "sha256", "bytes", "name"}]; other members are ignored.
+    """
+    uploads = []
+    with zipfile.ZipFile(archive_path) as archive:
+        for member in archive.infolist():
+            ext = os.path.splitext(member.filename)[1].lower()
+            if member.is_dir() or ext not in AUDIO_EXTENSIONS or os.path.basename(member.filename).startswith("."):
+                continue
+            if len(uploads) >= MAX_BATCH_ITEMS:
+                raise UploadTooLarge(f"Archive has more than {MAX_BATCH_ITEMS} tracks")
+            part_path = os.path.join(upload_dir, f".part-{uuid.uuid4().hex}")
+            digest = hashlib.sha256()
+            size = 0
+            try:
+                # Sizes in the zip directory can lie, so the limit is enforced on the bytes actually read
+                with archive.open(member) as src, open(part_path, "wb") as out:
+                    for chunk in iter(lambda: src.read(UPLOAD_CHUNK_BYTES), b""):
+                        size += len(chunk)
+                        if size > max_bytes:
+                            raise UploadTooLarge(f"{member.filename} exceeds the {max_bytes // 1024 ** 2} MB limit")
+                        digest.update(chunk)
+                        out.write(chunk)
+            except BaseException:
+                os.remove(part_path)
+                raise
+            sha = digest.hexdigest()
+            path = os.path.join(upload_dir, f"{sha}{ext}")
+            os.replace(part_path, path)
+            uploads.append({"path": path, "sha256": sha, "bytes": size, "name": os.path.basename(member.filename)})
+    return uploads
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(UPLOAD_CHUNK_BYTES), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+_stores = {}
+
+
+def get_canonical_store(output_dir: str) -> DirectoryCache:
+    root = os.path.abspath(os.path.join(output_dir, "canonical"))
+    if root not in _stores:
+        _stores[root] = DirectoryCache(root, CANONICAL_CACHE_MAX_BYTES, UPLOAD_TTL_SECONDS)
+    return _stores[root]
+
+
+def canonical_audio(input_file: str, output_dir: str, content_hash: str = None) -> str:
+    """
+    Decodes input_file once into the canonical PCM cache and returns that path. Later calls
+    for the same content (by hash of the uploaded bytes) reuse the decoded file.
+    """
+    store = get_canonical_store(output_dir)
+    key = f"{content_hash or file_sha256(input_file)}-{CANONICAL_SAMPLE_RATE}x{CANONICAL_CHANNELS}.wav"
+    cached = store.get(key)
+    if cached:
+        return cached
+
+    tmp_path = store.reserve(key) + ".wav"
+    command = [
+        "ffmpeg", "-y", "-v", "error", "-i", input_file, "-map", "0:a:0",
+        "-ar", str(CANONICAL_SAMPLE_RATE), "-ac", str(CANONICAL_CHANNELS),
+        "-c:a", "pcm_f32le", tmp_path,
+    ]
+    try:
+        with metrics.span("decode"):
+            result = procs.run(command, "decode", check=False)
+        if result.returncode != 0:
+            raise RuntimeError(f"Could not decode {os.path.basename(input_file)}: {result.stderr.strip()[-500:]}")
+        return store.publish(key, tmp_path)
+    except Exception:
+        store.discard(tmp_path)
+        raise
+
+
+def collect_uploads(upload_dir: str, max_age: float = UPLOAD_TTL_SECONDS) -> int:
+    """Deletes uploads (and abandoned partial uploads) older than max_age; returns how many."""
+    removed = 0
+    now = time.time()
+    for name in os.listdir(upload_dir):
+        path = os.path.join(upload_dir, name)
+        try:
+            if os.path.isfile(path) and now - os.stat(path).st_mtime > max_age:
+                os.remove(path)
+                removed += 1
+        except OSError:
+            pass
+    return removed
+
+
+async def upload_gc_loop(upload_dir: str, output_dir: str, interval: float = UPLOAD_GC_INTERVAL_SECONDS):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            removed = await asyncio.to_thread(collect_uploads, upload_dir)
+            await asyncio.to_thread(get_canonical_store(output_dir).evict)
+            if removed:
+                print(f"--- Upload GC: removed {removed} expired upload(s) ---")
+        except Exception as e:
+            print(f"Upload GC error: {e}")
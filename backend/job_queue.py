@@ -0,0 +1,342 @@
+"""
+Shared job queue for running compute on separate worker processes/nodes (EXECUTION_MODE=queue).
+
+API nodes enqueue jobs - a function named "module:qualname" plus JSON arguments - and poll
+for the result; worker.py processes claim jobs, run them against the shared processed/ and
+uploads/ directories and store the result. The queue is a SQLite database, so it works
+offline and on one machine as is; for several nodes put it (with the task store and the
+data directories) on shared storage.
+"""
+import asyncio
+import importlib
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+import metrics
+import procs
+from progress import callback_from_spec
+from scheduler import DEFAULT_LIMITS, MAX_QUEUE, PRIORITY_NORMAL, JobScheduler, QueueFull
+
+# "local" runs jobs in the API process (JobScheduler), "queue" hands them to worker.py processes
+EXECUTION_MODE = os.environ.get("EXECUTION_MODE", "local").lower()
+JOB_POLL_SECONDS = float(os.environ.get("JOB_POLL_SECONDS", "0.5"))
+# A worker that misses heartbeats this long is considered gone and its running jobs are requeued
+WORKER_STALE_SECONDS = float(os.environ.get("WORKER_STALE_SECONDS", "60"))
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", "2"))
+# Finished jobs whose result was never collected are purged after this long
+JOB_RESULT_TTL_SECONDS = float(os.environ.get("JOB_RESULT_TTL_SECONDS", "3600"))
+# Only functions from these modules may be named in a job
+JOB_MODULES = ("remix", "generate", "mixer", "stems", "delivery", "features", "jobs")
+
+
+class JobFailed(Exception):
+    pass
+
+
+def job_name(fn) -> str:
+    name = f"{fn.__module__}:{fn.__qualname__}"
+    if fn.__module__ not in JOB_MODULES or "<locals>" in fn.__qualname__:
+        raise ValueError(f"{name} cannot run on a queue worker")
+    return name
+
+
+def resolve_job(name: str):
+    module, qualname = name.split(":", 1)
+    if module not in JOB_MODULES:
+        raise ValueError(f"{name} is not a job function")
+    fn = importlib.import_module(module)
+    for part in qualname.split("."):
+        fn = getattr(fn, part)
+    return fn
+
+
+def encode_args(args) -> str:
+    """JSON for job arguments; reporters travel as their spec() and are rebuilt on the worker."""
+    return json.dumps([{"__callback__": arg.spec()} if hasattr(arg, "spec") else arg for arg in args])
+
+
+def decode_args(payload: str, tasks) -> list:
+    return [
+        callback_from_spec(tasks, arg["__callback__"]) if isinstance(arg, dict) and "__callback__" in arg else arg
+        for arg in json.loads(payload)
+    ]
+
+
+class JobQueue:
+    """Jobs and worker heartbeats in one SQLite database shared by API and worker processes."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "job_id TEXT PRIMARY KEY, type TEXT NOT NULL, fn TEXT NOT NULL, args TEXT NOT NULL, "
+            "priority INTEGER NOT NULL, task_id TEXT, status TEXT NOT NULL, result TEXT, error TEXT, "
+            "spans TEXT, worker TEXT, attempts INTEGER NOT NULL DEFAULT 0, enqueued_at REAL NOT NULL, "
+            "started_at REAL, finished_at REAL, heartbeat_at REAL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS jobs_pending ON jobs (status, type, priority)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS workers ("
+            "worker_id TEXT PRIMARY KEY, host TEXT, lanes TEXT NOT NULL, running INTEGER NOT NULL, "
+            "started_at REAL NOT NULL, heartbeat_at REAL NOT NULL)"
+        )
+        conn.commit()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def enqueue(self, job_type: str, fn: str, args: str, priority: int = PRIORITY_NORMAL, task_id: str = None) -> str:
+        job_id = uuid.uuid4().hex
+        conn = self._conn()
+        conn.execute(
+            "INSERT INTO jobs (job_id, type, fn, args, priority, task_id, status, enqueued_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, 'queued', ?)",
+            (job_id, job_type, fn, args, priority, task_id, time.time()),
+        )
+        conn.commit()
+        return job_id
+
+    def claim(self, worker_id: str, lanes: list):
+        """Marks the highest-priority, oldest queued job of the given lanes as running on worker_id and returns it."""
+        if not lanes:
+            return None
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                f"SELECT * FROM jobs WHERE status = 'queued' AND type IN ({','.join('?' * len(lanes))}) "
+                "ORDER BY priority, rowid LIMIT 1",
+                list(lanes),
+            ).fetchone()
+            if row is None:
+                conn.rollback()
+                return None
+            now = time.time()
+            conn.execute(
+                "UPDATE jobs SET status = 'running', worker = ?, attempts = attempts + 1, started_at = ?, heartbeat_at = ? "
+                "WHERE job_id = ?",
+                (worker_id, now, now, row["job_id"]),
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return {**dict(row), "status": "running", "started_at": now}
+
+    def finish(self, job_id: str, worker_id: str, result=None, error: str = None, spans: dict = None):
+        # A job requeued after a missed heartbeat belongs to its new worker
+        conn = self._conn()
+        conn.execute(
+            "UPDATE jobs SET status = ?, result = ?, error = ?, spans = ?, finished_at = ? "
+            "WHERE job_id = ? AND worker = ? AND status = 'running'",
+            ("error" if error is not None else "done", json.dumps(result), error, json.dumps(spans or {}), time.time(),
+             job_id, worker_id),
+        )
+        conn.commit()
+
+    def cancel(self, job_id: str) -> bool:
+        """Withdraws a job that no worker has claimed yet."""
+        conn = self._conn()
+        cursor = conn.execute(
+            "UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE job_id = ? AND status = 'queued'", (time.time(), job_id)
+        )
+        conn.commit()
+        return cursor.rowcount > 0
+
+    def cancel_task(self, task_id: str) -> int:
+        """Withdraws every unclaimed job of a task."""
+        conn = self._conn()
+        cursor = conn.execute(
+            "UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE task_id = ? AND status = 'queued'", (time.time(), task_id)
+        )
+        conn.commit()
+        return cursor.rowcount
+
+    def get(self, job_id: str):
+        row = self._conn().execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def delete(self, job_id: str):
+        conn = self._conn()
+        conn.execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+        conn.commit()
+
+    def counts(self) -> dict:
+        """{type: {status: jobs}} for queued and running jobs."""
+        counts = {}
+        for row in self._conn().execute(
+            "SELECT type, status, COUNT(*) FROM jobs WHERE status IN ('queued', 'running') GROUP BY type, status"
+        ):
+            counts.setdefault(row[0], {})[row[1]] = row[2]
+        return counts
+
+    def position(self, task_id: str) -> int:
+        """1-based position of the task's waiting job within its lane, 0 if running/not queued."""
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT type, priority, rowid FROM jobs WHERE task_id = ? AND status = 'queued' ORDER BY priority, rowid LIMIT 1",
+            (task_id,),
+        ).fetchone()
+        if row is None:
+            return 0
+        ahead = conn.execute(
+            "SELECT COUNT(*) FROM jobs WHERE type = ? AND status = 'queued' AND (priority < ? OR (priority = ? AND rowid < ?))",
+            (row[0], row[1], row[1], row[2]),
+        ).fetchone()[0]
+        return ahead + 1
+
+    def heartbeat(self, worker_id: str, lanes: dict, job_ids: list, started_at: float):
+        now = time.time()
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO workers (worker_id, host, lanes, running, started_at, heartbeat_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (worker_id, socket.gethostname(), json.dumps(lanes), len(job_ids), started_at, now),
+        )
+        if job_ids:
+            conn.execute(
+                f"UPDATE jobs SET heartbeat_at = ? WHERE job_id IN ({','.join('?' * len(job_ids))})", [now, *job_ids]
+            )
+        conn.commit()
+
+    def unregister(self, worker_id: str):
+        conn = self._conn()
+        conn.execute("DELETE FROM workers WHERE worker_id = ?", (worker_id,))
+        conn.commit()
+
+    def workers(self, max_age: float = WORKER_STALE_SECONDS) -> list:
+        """Workers that sent a heartbeat within max_age seconds."""
+        rows = self._conn().execute(
+            "SELECT * FROM workers WHERE heartbeat_at >= ? ORDER BY started_at", (time.time() - max_age,)
+        ).fetchall()
+        return [{**dict(row), "lanes": json.loads(row["lanes"])} for row in rows]
+
+    def recover(self, max_age: float = WORKER_STALE_SECONDS, max_attempts: int = JOB_MAX_ATTEMPTS) -> int:
+        """
+        Requeues running jobs whose worker stopped sending heartbeats (or fails them after
+        max_attempts), and purges finished jobs and workers nobody is going to look at again.
+        """
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            requeued = conn.execute(
+                "UPDATE jobs SET status = 'queued', worker = NULL, started_at = NULL "
+                "WHERE status = 'running' AND heartbeat_at < ? AND attempts < ?",
+                (now - max_age, max_attempts),
+            ).rowcount
+            conn.execute(
+                "UPDATE jobs SET status = 'error', error = 'Worker stopped responding', finished_at = ? "
+                "WHERE status = 'running' AND heartbeat_at < ?",
+                (now, now - max_age),
+            )
+            conn.execute(
+                "DELETE FROM jobs WHERE status IN ('done', 'error', 'cancelled') AND finished_at < ?",
+                (now - JOB_RESULT_TTL_SECONDS,),
+            )
+            conn.execute("DELETE FROM workers WHERE heartbeat_at < ?", (now - JOB_RESULT_TTL_SECONDS,))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return requeued
+
+
+def get_job_queue(processed_dir: str) -> JobQueue:
+    return JobQueue(os.environ.get("JOB_QUEUE_PATH", os.path.join(processed_dir, "jobs.db")))
+
+
+class QueueScheduler:
+    """
+    JobScheduler's interface on top of a JobQueue: `submit` enqueues the job for a worker
+    process and returns an asyncio.Task that yields its result, so endpoints don't change.
+    Limits are the same: QueueFull once max_queue jobs are waiting across all lanes.
+    """
+
+    def __init__(self, queue: JobQueue, max_queue: int = MAX_QUEUE, poll: float = JOB_POLL_SECONDS):
+        self.queue = queue
+        self.max_queue = max_queue
+        self.poll = poll
+
+    def queued(self) -> int:
+        return sum(lane.get("queued", 0) for lane in self.queue.counts().values())
+
+    def ensure_capacity(self, slots: int = 1):
+        if self.queued() + slots > self.max_queue:
+            raise QueueFull(f"Job queue is full ({self.max_queue} waiting), try again shortly")
+
+    def submit(self, job_type: str, fn, *args, priority: int = PRIORITY_NORMAL, task_id: str = None):
+        if job_type not in DEFAULT_LIMITS:
+            raise KeyError(job_type)
+        name = job_name(fn)
+        self.ensure_capacity()
+        job_id = self.queue.enqueue(job_type, name, encode_args(args), priority, task_id)
+        return asyncio.ensure_future(self._wait(job_id))
+
+    async def _wait(self, job_id: str):
+        try:
+            while True:
+                job = self.queue.get(job_id)
+                if job is None:
+                    raise JobFailed("Job was lost from the queue")
+                if job["status"] in ("done", "error", "cancelled"):
+                    break
+                await asyncio.sleep(self.poll)
+        except asyncio.CancelledError:
+            self.queue.cancel(job_id)
+            raise
+        self.queue.delete(job_id)
+        if job["started_at"]:
+            metrics.QUEUE_WAIT.observe(job["started_at"] - job["enqueued_at"], type=job["type"])
+            metrics.JOB_DURATION.observe(job["finished_at"] - job["started_at"], type=job["type"])
+            metrics.record_span(job["task_id"], "queue_wait", job["started_at"] - job["enqueued_at"])
+        # Stage timings recorded on the worker
+        for stage, seconds in json.loads(job["spans"] or "{}").items():
+            metrics.record_span(job["task_id"], stage, seconds)
+        if job["status"] == "cancelled":
+            raise JobFailed("Job was cancelled")
+        if job["status"] == "error":
+            raise JobFailed(job["error"])
+        return json.loads(job["result"])
+
+    def cancel(self, task_id: str) -> int:
+        """Withdraws the task's waiting jobs; workers stop its running jobs once they see the cancelled task record."""
+        procs.cancel(task_id)
+        return self.queue.cancel_task(task_id)
+
+    def position(self, task_id: str):
+        return self.queue.position(task_id)
+
+    def stats(self) -> dict:
+        counts = self.queue.counts()
+        slots = {}
+        for worker in self.queue.workers():
+            for lane, n in worker["lanes"].items():
+                slots[lane] = slots.get(lane, 0) + n
+        return {
+            name: {"running": counts.get(name, {}).get("running", 0), "queued": counts.get(name, {}).get("queued", 0),
+                   "workers": slots.get(name, 0)}
+            for name in DEFAULT_LIMITS
+        }
+
+    def workers(self) -> list:
+        return self.queue.workers()
+
+
+def create_scheduler(processed_dir: str):
+    """JobScheduler in local mode, QueueScheduler feeding worker.py processes in queue mode."""
+    if EXECUTION_MODE == "queue":
+        return QueueScheduler(get_job_queue(processed_dir))
+    return JobScheduler()
@@ -0,0 +1,90 @@
+"""
+Multi-step jobs the API schedules. They live at module level (not as closures in main) so a
+queue worker can import them by name and run them with the same arguments.
+"""
+import os
+
+from ingest import canonical_audio
+
+
+def run_remix_batch(task_id: str, uploads: list, duration_limit: int, turbo_mode: bool, mix: dict,
+                    output_dir: str, update):
+    """Separates (and optionally mixes) a batch of uploads; update(**fields) publishes per-track items."""
+    from remix import separate_batch
+    from mixer import mix_stems_with_volumes
+    items = [{"name": upload["name"], "status": "queued"} for upload in uploads]
+
+    def on_item(index, result):
+        item = {"name": uploads[index]["name"], **result}
+        if result["status"] == "success" and mix is not None:
+            base = os.path.splitext(os.path.basename(uploads[index]["name"]))[0]
+            output_filename = f"batch/{task_id}/{index:04d}_{base}_{mix['mood'] or 'custom'}.wav"
+            output_path = os.path.join(output_dir, output_filename)
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+            mixed = mix_stems_with_volumes(result["stems_dir"], mix["volumes"], output_path, mix["mood"], mix["genre"])
+            if mixed["status"] == "success":
+                item["file"] = output_filename
+            else:
+                item.update(status="error", message=mixed["message"])
+        items[index] = item
+        done = sum(1 for it in items if it["status"] != "queued")
+        update(items=list(items), progress=round(100 * done / len(items), 1), stage="separating")
+
+    result = separate_batch(uploads, output_dir, duration_limit, turbo_mode, on_item)
+    result["items"] = items
+    # Mix failures count against the batch too
+    result["succeeded"] = sum(1 for item in items if item["status"] == "success")
+    result["tracks_per_hour"] = round(result["succeeded"] / max(result["seconds"], 0.1) * 3600, 1)
+    print(f"Batch {task_id}: {result['succeeded']}/{result['tracks']} tracks in {result['seconds']}s ({result['tracks_per_hour']} tracks/hour)")
+    return result
+
+
+def mix_uploads(upload1: dict, upload2: dict, blend_ratio: float, output_path: str, mood: str,
+                preview: dict, output_dir: str):
+    """Blends two uploads; both are decoded once into the canonical PCM cache and mixed from there."""
+    from mixer import mix_two_tracks
+    try:
+        path1 = canonical_audio(upload1["path"], output_dir, upload1["sha256"])
+        path2 = canonical_audio(upload2["path"], output_dir, upload2["sha256"])
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+    return mix_two_tracks(
+        path1,
+        path2,
+        blend_ratio,
+        output_path,
+        mood,
+        None, # genre will be added as a separate param if needed
+        None,
+        preview,
+    )
+
+
+def render_smart_mix(vocals_dir: str, backing_dir: str, output_path: str, mood: str, genre: str,
+                     auto_align: bool, output_dir: str, progress=None):
+    """Vocals of one separated track over the instrumental stems of another."""
+    from remix import INSTRUMENTAL_STEMS
+    from mixer import mix_sources
+    vocal1 = os.path.join(vocals_dir, "vocals.wav")
+    sources = [
+        (vocal1, 1.2),
+        (os.path.join(backing_dir, "drums.wav"), 1.0),
+        (os.path.join(backing_dir, "bass.wav"), 1.0),
+        (os.path.join(backing_dir, "other.wav"), 0.8),
+    ]
+    alignment = None
+    if auto_align:
+        from features import align_stem, index_stems, plan_smart_mix
+        try:
+            # Features come from the index; tracks separated just now are analysed here once
+            alignment = plan_smart_mix(
+                index_stems(vocals_dir, output_dir),
+                index_stems(backing_dir, output_dir),
+                INSTRUMENTAL_STEMS,
+            )
+            vocals = align_stem(vocal1, alignment["tempo_ratio"], alignment["offset_seconds"], output_dir)
+            sources[0] = (vocals, alignment["vocal_gain"])
+        except Exception as e:
+            print(f"Smart mix alignment skipped: {e}")
+            alignment = None
+    return {**mix_sources(sources, output_path, mood, genre, progress), "alignment": alignment}
@@ -1,6 +1,10 @@
-from fastapi import FastAPI, UploadFile, File
+from fastapi import FastAPI, UploadFile, File, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
+from typing import List
 import shutil
+import json
+import sys
 import os
 
 # Add FFmpeg to PATH (for local Windows dev)
@@ -10,11 +14,8 @@ if os.path.exists(ffmpeg_local_path):
 
 os.environ["TORCHAUDIO_BACKEND"] = "soundfile"
 
-import torchaudio
-try:
-    torchaudio.set_audio_backend("soundfile")
-except:
-    pass
+# torch, torchaudio, transformers and demucs are imported lazily: the warmup steps below load
+# them in the background, so the HTTP layer is up immediately and reports readiness separately.
 
 app = FastAPI()
 
@@ -37,91 +38,409 @@ os.makedirs(PROCESSED_DIR, exist_ok=True)
 def read_root():
     return {"message": "AI Mood Music Remix API is running"}
 
-from remix import separate_audio
-from generate import generate_track, load_model
+from task_store import create_task_store
+from scheduler import QueueFull, PRIORITY_PREVIEW, PRIORITY_NORMAL, PRIORITY_FULL
+from job_queue import EXECUTION_MODE, create_scheduler
+from progress import (
+    TERMINAL_STATUSES, PartialStemsReporter, TaskEvents, TaskUpdater, parallel_reporters, progress_reporter,
+    stream_task_events,
+)
+from warmup import WARMUP_STEPS, Warmup, probe_ffmpeg, warm_demucs, warm_musicgen
+from ingest import (
+    MAX_BATCH_ITEMS, MAX_BATCH_UPLOAD_BYTES, MAX_UPLOAD_BYTES, UploadTooLarge,
+    extract_archive, save_upload, upload_gc_loop,
+)
+import metrics
 import asyncio
 
+# EXECUTION_MODE=queue hands jobs to worker.py processes instead of running them here
+scheduler = create_scheduler(PROCESSED_DIR)
+task_events = TaskEvents()
+warmup = Warmup()
+
 @app.on_event("startup")
 async def startup_event():
-    # Pre-load the music generation model in the background
-    # This prevents blocking the server startup
+    # Load models in the background so server startup isn't blocked;
+    # /api/health/ready turns 200 once every step has finished
     loop = asyncio.get_event_loop()
-    loop.run_in_executor(None, load_model_safe)
+    task_events.attach(loop)
+    warmup.start(loop)
+    asyncio.create_task(upload_gc_loop(UPLOAD_DIR, PROCESSED_DIR))
 
-def load_model_safe():
-    try:
-        print("Starting pre-loading of MusicGen model...")
-        load_model()
-        print("MusicGen model loaded successfully.")
-    except Exception as e:
-        print(f"Error loading MusicGen model: {e}")
+@app.on_event("shutdown")
+async def shutdown_event():
+    metrics.stop_logging()
+
+# In queue mode the models are loaded by the workers; API nodes only enqueue and serve
+warmup_steps = {"ffmpeg": probe_ffmpeg}
+if EXECUTION_MODE != "queue":
+    warmup_steps.update(demucs=warm_demucs, musicgen=warm_musicgen)
+for step, fn in warmup_steps.items():
+    if step in WARMUP_STEPS:
+        warmup.add(step, fn)
+
+@app.get("/api/health/live")
+def liveness():
+    """The process is up and serving HTTP"""
+    return {"status": "alive"}
+
+@app.get("/api/health/ready")
+def readiness():
+    """200 once every warmup step succeeded, 503 (with per-step state) until then"""
+    report = warmup.report()
+    return JSONResponse(report, status_code=200 if report["ready"] else 503)
 
 @app.get("/api/health")
 def health_check():
-    from generate import model
+    # Only look at modules warmup has already imported - a health check must never load torch
+    generate = sys.modules.get("generate")
+    models = loaded_models()
     return {
         "status": "online", 
-        "model_loaded": model is not None,
+        "ready": warmup.ready(),
+        "warmup": warmup.report()["steps"],
+        "model_loaded": models["musicgen"],
+        "separator_loaded": models["htdemucs"],
+        "execution_mode": EXECUTION_MODE,
+        "jobs": scheduler.stats(),
+        "workers": scheduler.workers() if EXECUTION_MODE == "queue" else None,
+        "generation_batches": generate.batcher.stats if generate else None,
+        "generation_profile": generate.model_profile if generate else None,
         "ffmpeg": os.path.exists(os.path.join(ffmpeg_local_path, "ffmpeg.exe")) or shutil.which("ffmpeg") is not None
     }
 
-tasks = {}
+def loaded_models():
+    generate = sys.modules.get("generate")
+    separator = sys.modules.get("separator")
+    return {
+        "musicgen": generate is not None and generate.model is not None,
+        "htdemucs": separator is not None and separator.model is not None,
+    }
+
+metrics.Gauge("remix_jobs_running", "Jobs running on a worker", ["type"],
+              collect=lambda: {name: lane["running"] for name, lane in scheduler.stats().items()})
+metrics.Gauge("remix_jobs_queued", "Jobs waiting for a worker", ["type"],
+              collect=lambda: {name: lane["queued"] for name, lane in scheduler.stats().items()})
+metrics.Gauge("remix_model_loaded", "1 if the model is loaded in this process", ["model"], collect=loaded_models)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics_endpoint():
+    """Prometheus scrape endpoint"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+# Queue workers report progress into the same store, so queue mode needs the shared SQLite one
+tasks = create_task_store(PROCESSED_DIR, default="sqlite" if EXECUTION_MODE == "queue" else "memory")
+tasks.add_listener(task_events.notify)
 
 import uuid
+import zipfile
+
+async def receive_upload(file: UploadFile) -> dict:
+    try:
+        return await save_upload(file, UPLOAD_DIR)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
 
 @app.post("/api/remix")
-async def remix_audio(file: UploadFile = File(...), fast_mode: bool = False, turbo_mode: bool = False):
+async def remix_audio(file: UploadFile = File(...), fast_mode: bool = False, turbo_mode: bool = False, full_length: bool = False):
+    from remix import separate_audio
     task_id = str(uuid.uuid4())
-    file_location = f"{UPLOAD_DIR}/{file.filename}"
-    with open(file_location, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-    
-    tasks[task_id] = {"status": "processing", "progress": 0, "result": None}
+    upload = await receive_upload(file)
     
     # Run in background
     duration_limit = 60 if fast_mode else 360
-    asyncio.create_task(run_separation_task(task_id, file_location, duration_limit, False, turbo_mode))
+    if full_length and not (fast_mode or turbo_mode):
+        # Whole track, separated in streaming windows
+        duration_limit = None
+    try:
+        job = scheduler.submit(
+            "separate", separate_audio, upload["path"], PROCESSED_DIR, duration_limit, False, turbo_mode,
+            progress_reporter(tasks, task_id, "separating"), PartialStemsReporter(tasks, task_id), False, upload["sha256"],
+            priority=separation_priority(fast_mode, turbo_mode), task_id=task_id,
+        )
+    except QueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    
+    tasks.set(task_id, {"status": "processing", "progress": 0, "result": None})
+    asyncio.create_task(run_separation_task(task_id, job, analyze=not turbo_mode))
     
     return {"task_id": task_id, "status": "queued"}
 
-async def run_separation_task(task_id, file_location, duration_limit, vocals_only=False, turbo_mode=False):
+@app.post("/api/remix/batch")
+async def remix_batch(files: List[UploadFile] = File(...), fast_mode: bool = False, turbo_mode: bool = False,
+                      mood: str = None, genre: str = None, volumes: str = None):
+    """
+    Separates a catalog in one job: audio files and/or .zip archives of them. With mood, genre
+    or volumes (JSON, e.g. {"vocals": 0}) every track is also mixed. Per-track status is in the
+    task's "items"; the result reports tracks_per_hour.
+    """
+    try:
+        mix_volumes = json.loads(volumes) if volumes else {}
+    except ValueError:
+        mix_volumes = None
+    if not isinstance(mix_volumes, dict):
+        raise HTTPException(status_code=400, detail="volumes must be a JSON object of stem gains")
+    uploads = []
+    for file in files:
+        if (file.filename or "").lower().endswith(".zip"):
+            try:
+                archive = await save_upload(file, UPLOAD_DIR, MAX_BATCH_UPLOAD_BYTES)
+            except UploadTooLarge as e:
+                raise HTTPException(status_code=413, detail=str(e))
+            try:
+                uploads.extend(await asyncio.to_thread(extract_archive, archive["path"], UPLOAD_DIR))
+            except UploadTooLarge as e:
+                raise HTTPException(status_code=413, detail=str(e))
+            except zipfile.BadZipFile:
+                raise HTTPException(status_code=400, detail=f"{file.filename} is not a valid zip archive")
+            finally:
+                # Only the extracted tracks are kept
+                os.remove(archive["path"])
+        else:
+            uploads.append({**(await receive_upload(file)), "name": file.filename})
+    if not uploads:
+        raise HTTPException(status_code=400, detail="No audio files in the upload")
+    if len(uploads) > MAX_BATCH_ITEMS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_ITEMS} tracks per batch")
+
+    from jobs import run_remix_batch
+    task_id = str(uuid.uuid4())
+    mix = {"volumes": mix_volumes, "mood": mood, "genre": genre} if (mood or genre or mix_volumes) else None
     try:
-        loop = asyncio.get_event_loop()
-        result = await loop.run_in_executor(None, separate_audio, file_location, PROCESSED_DIR, duration_limit, vocals_only, turbo_mode)
-        tasks[task_id] = {"status": "completed", "progress": 100, "result": result}
+        job = scheduler.submit(
+            "separate", run_remix_batch, task_id, uploads, 60 if fast_mode else 360, turbo_mode, mix,
+            PROCESSED_DIR, TaskUpdater(tasks, task_id), priority=PRIORITY_FULL, task_id=task_id,
+        )
+    except QueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e))
+
+    items = [{"name": upload["name"], "status": "queued"} for upload in uploads]
+    tasks.set(task_id, {"status": "processing", "progress": 0, "result": None, "items": items})
+    asyncio.create_task(run_separation_task(task_id, job, analyze=not turbo_mode))
+    return {"task_id": task_id, "status": "queued", "tracks": len(uploads)}
+
+def separation_priority(fast_mode: bool, turbo_mode: bool) -> int:
+    if turbo_mode:
+        return PRIORITY_PREVIEW
+    return PRIORITY_NORMAL if fast_mode else PRIORITY_FULL
+
+def settle(task_id: str, record: dict):
+    """Stores a task's final record, unless the task was cancelled meanwhile"""
+    def replace(current):
+        if current.get("status") != "cancelled":
+            current.clear()
+            current.update(record)
+    tasks.modify(task_id, replace)
+
+async def run_separation_task(task_id, job, analyze: bool = False):
+    try:
+        result = await job
+        settle(task_id, {"status": "completed", "progress": 100, "result": result})
     except Exception as e:
-        tasks[task_id] = {"status": "error", "message": str(e)}
+        settle(task_id, {"status": "error", "message": str(e)})
+        return
+    if analyze:
+        items = result.get("items") or [result]
+        schedule_analysis([item["stems_dir"] for item in items if item and item.get("status") == "success"])
+
+def schedule_analysis(stems_dirs: list):
+    """Indexes tempo/key/loudness of freshly separated tracks in the background"""
+    from features import FEATURES_ENABLED, index_many
+    if not FEATURES_ENABLED or not stems_dirs:
+        return
+    try:
+        scheduler.submit("analyze", index_many, stems_dirs, PROCESSED_DIR, priority=PRIORITY_FULL)
+    except QueueFull:
+        # Smart-mix analyses tracks on demand when they are not indexed yet
+        pass
+
+@app.get("/api/features")
+async def get_features(stems_dir: str):
+    """Indexed features (bpm, beats, key, loudness per stem) of a separated track"""
+    from features import track_features
+    features = track_features(stems_dir, PROCESSED_DIR)
+    if features is None:
+        raise HTTPException(status_code=404, detail="Track has not been analysed yet")
+    return {"status": "success", "features": features}
+
+@app.get("/api/compatible")
+async def get_compatible(stems_dir: str, limit: int = 10):
+    """Indexed tracks whose tempo and key mix well with this one, best first"""
+    from features import get_index
+    track = os.path.basename(os.path.normpath(stems_dir))
+    index = get_index(PROCESSED_DIR)
+    if index.get(track) is None:
+        raise HTTPException(status_code=404, detail="Track has not been analysed yet")
+    return {"status": "success", "matches": index.compatible(track, max(1, min(limit, 100)))}
+
+@app.delete("/api/task/{task_id}")
+async def cancel_task(task_id: str):
+    """Cancels a task: its waiting jobs are withdrawn, running ones stop and their child processes are killed"""
+    task = tasks.get(task_id)
+    if task is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+    if task["status"] in TERMINAL_STATUSES:
+        return {"task_id": task_id, "status": task["status"]}
+    tasks.set(task_id, {**task, "status": "cancelled", "message": "Task was cancelled"})
+    job_task_id = task_id
+    shared = inflight_generations.get(generation_waiters.pop(task_id, None))
+    if shared is not None:
+        waiter = shared["waiters"].pop(task_id, None)
+        if waiter is not None:
+            waiter.cancel()
+        if shared["waiters"]:
+            # Other requests still wait on this generation; only this task lets go of it
+            return {"task_id": task_id, "status": "cancelled", "withdrawn_jobs": 0}
+        # The last waiter is gone: stop the shared job (queue workers watch its own task record)
+        job_task_id = shared["job_id"]
+        tasks.set(job_task_id, {"status": "cancelled", "message": "Task was cancelled"})
+    withdrawn = scheduler.cancel(job_task_id)
+    return {"task_id": task_id, "status": "cancelled", "withdrawn_jobs": withdrawn}
 
 @app.get("/api/task-status/{task_id}")
 async def get_task_status(task_id: str):
-    return tasks.get(task_id, {"status": "not_found"})
+    return with_queue_position(task_id, tasks.get(task_id, {"status": "not_found"}))
+
+def with_queue_position(task_id: str, task: dict) -> dict:
+    # Shared generations run under their own job id
+    job_task_id = task.get("job_id", task_id)
+    if task["status"] == "processing":
+        task = {**task, "queue_position": scheduler.position(job_task_id)}
+    # Seconds spent per stage (queue_wait, decode, separation, mix, ...) so far
+    spans = metrics.task_spans(job_task_id)
+    if spans:
+        task = {**task, "spans": spans}
+    return task
+
+@app.get("/api/task-events/{task_id}")
+async def task_events_stream(task_id: str):
+    """Server-sent events with the task-status payload, pushed whenever the task changes"""
+    return StreamingResponse(
+        stream_task_events(tasks, task_events, task_id, with_queue_position),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+# Generations currently running, by cache key - identical requests share one job. Each entry is
+# {"job", "job_id", "waiters": {task_id: waiting asyncio task}}; the job runs under its own id,
+# so it is only cancelled once every task waiting on it has been.
+inflight_generations = {}
+# task_id -> cache key of the generation it waits on
+generation_waiters = {}
 
 @app.post("/api/generate")
-async def generate_music(mood: str, genre: str, language: str):
+async def generate_music(mood: str, genre: str, language: str, duration: float = Query(5, gt=0, allow_inf_nan=False), seed: int = 0):
+    from generate import build_prompt, generate_cached, generation_key, generation_params, get_generation_store
     task_id = str(uuid.uuid4())
-    prompt = f"{mood} {genre}"
-    output_filename = f"generated_{mood}_{language}.wav"
-    output_path = os.path.join(PROCESSED_DIR, output_filename)
+    full_prompt = build_prompt(mood, genre, language)
+    params = generation_params(duration, seed)
+    key = generation_key(full_prompt, params)
+
+    cached = get_generation_store(PROCESSED_DIR).get(f"{key}.wav")
+    if cached:
+        result = {"status": "success", "file": f"generated/{key}.wav", "cached": True}
+        tasks.set(task_id, {"status": "completed", "progress": 100, "file": result["file"], "result": result})
+        return {"task_id": task_id, "status": "completed"}
+
+    shared = inflight_generations.get(key)
+    if shared is None:
+        job_id = str(uuid.uuid4())
+        try:
+            job = scheduler.submit(
+                "generate", generate_cached, full_prompt, PROCESSED_DIR, params,
+                progress_reporter(tasks, task_id, "generating"), task_id=job_id,
+            )
+        except QueueFull as e:
+            raise HTTPException(status_code=429, detail=str(e))
+        shared = inflight_generations[key] = {"job": job, "job_id": job_id, "waiters": {}}
+        job.add_done_callback(lambda _: inflight_generations.pop(key, None))
     
-    tasks[task_id] = {"status": "processing", "progress": 0, "result": None}
+    tasks.set(task_id, {"status": "processing", "progress": 0, "result": None, "job_id": shared["job_id"]})
     
     # Run in background
-    asyncio.create_task(run_generate_task(task_id, prompt, language, output_filename, output_path))
+    shared["waiters"][task_id] = asyncio.create_task(run_generate_task(task_id, shared["job"]))
+    generation_waiters[task_id] = key
     
     return {"task_id": task_id, "status": "queued"}
 
-async def run_generate_task(task_id, prompt, language, output_filename, output_path):
+async def run_generate_task(task_id, job):
     try:
-        loop = asyncio.get_event_loop()
-        result = await loop.run_in_executor(None, generate_track, prompt, language, 15, output_path)
-        tasks[task_id] = {"status": "completed", "file": output_filename, "result": result}
+        # shield: one waiter going away must not cancel a job other requests share
+        result = await asyncio.shield(job)
+        settle(task_id, {"status": "completed", "progress": 100, "file": result["file"], "result": result})
+    except asyncio.CancelledError:
+        if not job.cancelled():
+            raise
+        # The shared job itself was withdrawn (every task waiting on it was cancelled)
+        settle(task_id, {"status": "error", "message": "Generation was cancelled"})
     except Exception as e:
         print(f"Generation error: {e}")
-        tasks[task_id] = {"status": "error", "message": str(e)}
+        settle(task_id, {"status": "error", "message": str(e)})
+    finally:
+        generation_waiters.pop(task_id, None)
+
+@app.get("/api/generate/stream")
+async def generate_music_stream(mood: str, genre: str, language: str, duration: float = Query(5, gt=0, allow_inf_nan=False), seed: int = 0):
+    """Generates music and streams it as WAV while it is being generated, so playback starts early"""
+    from generate import build_prompt, generation_key, generation_params, get_generation_store, stream_cached, to_pcm16, wav_stream_header
+    full_prompt = build_prompt(mood, genre, language)
+    params = generation_params(duration, seed)
+    key = generation_key(full_prompt, params)
+
+    cached = get_generation_store(PROCESSED_DIR).get(f"{key}.wav")
+    if cached:
+        return FileResponse(cached, media_type="audio/wav")
+
+    if EXECUTION_MODE == "queue":
+        # Chunks can't be streamed back from a queue worker; the finished file is served instead
+        from generate import generate_cached
+        try:
+            job = scheduler.submit("generate", generate_cached, full_prompt, PROCESSED_DIR, params)
+        except QueueFull as e:
+            raise HTTPException(status_code=429, detail=str(e))
+        result = await job
+        if result.get("status") != "success":
+            raise HTTPException(status_code=500, detail=result.get("message", "Generation failed"))
+        return FileResponse(os.path.join(PROCESSED_DIR, result["file"]), media_type="audio/wav")
 
-from mixer import mix_stems_with_volumes, mix_two_tracks
-from fastapi.responses import FileResponse
-from pydantic import BaseModel
+    loop = asyncio.get_running_loop()
+    chunks = asyncio.Queue()
+
+    def on_audio(values, sampling_rate):
+        loop.call_soon_threadsafe(chunks.put_nowait, (sampling_rate, to_pcm16(values)))
+
+    try:
+        job = scheduler.submit("generate", stream_cached, full_prompt, PROCESSED_DIR, params, on_audio)
+    except QueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e))
+
+    def finished(job):
+        if not job.cancelled() and job.exception():
+            print(f"Streaming generation error: {job.exception()}")
+        chunks.put_nowait(None)
+    job.add_done_callback(finished)
+
+    async def body():
+        header_sent = False
+        while True:
+            item = await chunks.get()
+            if item is None:
+                break
+            sampling_rate, pcm = item
+            if not header_sent:
+                yield wav_stream_header(sampling_rate)
+                header_sent = True
+            yield pcm
+
+    return StreamingResponse(body(), media_type="audio/wav", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+from fastapi import Request
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from delivery import FORMATS as DELIVERY_FORMATS, encode_audio, file_etag, media_type, not_modified
+from pydantic import BaseModel, Field
+
+# Longest preview clip; the same setting mixer.mix_preview enforces (mixer itself is imported lazily)
+PREVIEW_MAX_SECONDS = float(os.environ.get("PREVIEW_MAX_SECONDS", "60"))
 
 class MixRequest(BaseModel):
     stems_dir: str
@@ -129,74 +448,130 @@ class MixRequest(BaseModel):
     mood: str = None
     genre: str = None
 
+class MixPreviewRequest(MixRequest):
+    start: float = Field(None, ge=0, allow_inf_nan=False)
+    duration: float = Field(20.0, gt=0, le=PREVIEW_MAX_SECONDS)
+
 @app.post("/api/mix")
 async def mix_stems(request: MixRequest):
     """Mix separated stems with volume levels and mood effects"""
+    from mixer import mix_stems_with_volumes
     output_filename = f"mixed_{request.mood or 'custom'}.wav"
     output_path = os.path.join(PROCESSED_DIR, output_filename)
     
-    loop = asyncio.get_event_loop()
-    result = await loop.run_in_executor(
-        None, 
-        mix_stems_with_volumes, 
-        request.stems_dir, 
-        request.volumes, 
-        output_path, 
-        request.mood,
-        request.genre
-    )
+    try:
+        job = scheduler.submit(
+            "mix",
+            mix_stems_with_volumes, 
+            request.stems_dir, 
+            request.volumes, 
+            output_path, 
+            request.mood,
+            request.genre,
+            priority=PRIORITY_PREVIEW,
+        )
+    except QueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    result = await job
     
     if result["status"] == "success":
         return {"status": "success", "file": output_filename}
     return result
 
+@app.post("/api/mix-preview")
+async def mix_stems_preview(request: MixPreviewRequest):
+    """Fast low-resolution clip of a stem mix for adjusting volumes/mood; export with /api/mix"""
+    from mixer import mix_stems_with_volumes
+    try:
+        job = scheduler.submit(
+            "mix",
+            mix_stems_with_volumes,
+            request.stems_dir,
+            request.volumes,
+            os.path.join(PROCESSED_DIR, "preview.ogg"),
+            request.mood,
+            request.genre,
+            None,
+            {"start": request.start, "duration": request.duration},
+            priority=PRIORITY_PREVIEW,
+        )
+    except QueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    return await job
+
 @app.post("/api/mix-two-files")
 async def mix_two_files(
     file1: UploadFile = File(...),
     file2: UploadFile = File(...),
     blend_ratio: float = 0.5,
-    mood: str = None
+    mood: str = None,
+    preview: bool = False,
+    start: float = Query(None, ge=0, allow_inf_nan=False),
+    duration: float = Query(20.0, gt=0, le=PREVIEW_MAX_SECONDS),
 ):
-    """Mix two audio files together with blend ratio and mood effects"""
+    """Mix two audio files together with blend ratio and mood effects (preview=true for a quick low-resolution clip)"""
+    from jobs import mix_uploads
     # Save uploaded files
-    file1_path = f"{UPLOAD_DIR}/{file1.filename}"
-    file2_path = f"{UPLOAD_DIR}/{file2.filename}"
-    
-    with open(file1_path, "wb") as buffer:
-        shutil.copyfileobj(file1.file, buffer)
-    with open(file2_path, "wb") as buffer:
-        shutil.copyfileobj(file2.file, buffer)
+    upload1 = await receive_upload(file1)
+    upload2 = await receive_upload(file2)
     
     output_filename = f"mixed_{mood or 'blend'}_{blend_ratio}.wav"
     output_path = os.path.join(PROCESSED_DIR, output_filename)
     
-    loop = asyncio.get_event_loop()
-    result = await loop.run_in_executor(
-        None,
-        mix_two_tracks,
-        file1_path,
-        file2_path,
-        blend_ratio,
-        output_path,
-        mood,
-        None # genre will be added as a separate param if needed
-    )
+    try:
+        job = scheduler.submit(
+            "mix", mix_uploads, upload1, upload2, blend_ratio, output_path, mood,
+            {"start": start, "duration": duration} if preview else None, PROCESSED_DIR,
+            priority=PRIORITY_PREVIEW if preview else PRIORITY_NORMAL,
+        )
+    except QueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    result = await job
     
     if result["status"] == "success":
-        return {"status": "success", "file": output_filename}
+        return {"status": "success", "file": result["file"] if preview else output_filename}
     return result
 
-@app.get("/api/download/{filename}")
-async def download_file(filename: str):
-    """Download a processed audio file"""
-    file_path = os.path.join(PROCESSED_DIR, filename)
-    if os.path.exists(file_path):
-        return FileResponse(
-            file_path, 
-            media_type="audio/wav",
-            filename=filename
-        )
-    return {"status": "error", "message": "File not found"}
+@app.api_route("/api/download/{filename:path}", methods=["GET", "HEAD"])
+async def download_file(filename: str, request: Request, format: str = None):
+    """
+    Download a processed audio file. format=opus|mp3|flac serves a cached compressed encode.
+    Supports Range requests (seeking before the download finishes) and If-None-Match revalidation.
+    """
+    from stems import export_wav, has_stem
+    root = os.path.abspath(PROCESSED_DIR)
+    file_path = os.path.abspath(os.path.join(root, filename))
+    if os.path.commonpath([root, file_path]) != root:
+        return {"status": "error", "message": "File not found"}
+    if not os.path.isfile(file_path):
+        # Separated stems are stored in stem packs; their WAV is written on first download
+        if not has_stem(file_path):
+            return {"status": "error", "message": "File not found"}
+        try:
+            job = scheduler.submit("mix", export_wav, file_path, priority=PRIORITY_PREVIEW)
+        except QueueFull as e:
+            raise HTTPException(status_code=429, detail=str(e))
+        await job
+
+    if format and format != "wav":
+        if format not in DELIVERY_FORMATS:
+            raise HTTPException(status_code=400, detail=f"Unsupported format '{format}', use one of: wav, {', '.join(DELIVERY_FORMATS)}")
+        try:
+            job = scheduler.submit("mix", encode_audio, file_path, PROCESSED_DIR, format, priority=PRIORITY_PREVIEW)
+        except QueueFull as e:
+            raise HTTPException(status_code=429, detail=str(e))
+        file_path = await job
+
+    etag = file_etag(file_path)
+    # Revalidate rather than cache blindly: mixes are re-rendered under the same name
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if not_modified(request.headers, etag):
+        return Response(status_code=304, headers=headers)
+
+    name = os.path.splitext(os.path.basename(filename))[0] + os.path.splitext(file_path)[1]
+    # FileResponse answers Range requests with 206 and hands the path to the server
+    # (ASGI pathsend, i.e. sendfile) where the server supports it
+    return FileResponse(file_path, media_type=media_type(file_path), filename=name, headers=headers)
 
 @app.post("/api/smart-mix")
 async def smart_mix(
@@ -205,81 +580,92 @@ async def smart_mix(
     mood: str = None,
     genre: str = None,
     fast_mode: bool = False,
-    turbo_mode: bool = False
+    turbo_mode: bool = False,
+    auto_align: bool = True
 ):
-    """Vocals from file1 + Instrumental from file2"""
+    """Vocals from file1 + Instrumental from file2 (auto_align matches vocal level, tempo and first beat)"""
     task_id = str(uuid.uuid4())
     
     # Save uploaded files
-    file1_path = f"{UPLOAD_DIR}/smart_{file1.filename}"
-    file2_path = f"{UPLOAD_DIR}/smart_{file2.filename}"
+    upload1 = await receive_upload(file1)
+    upload2 = await receive_upload(file2)
     
-    with open(file1_path, "wb") as buffer:
-        shutil.copyfileobj(file1.file, buffer)
-    with open(file2_path, "wb") as buffer:
-        shutil.copyfileobj(file2.file, buffer)
+    # Both separations and the final render each need a queue slot
+    try:
+        scheduler.ensure_capacity(3)
+    except QueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e))
     
-    tasks[task_id] = {"status": "processing", "progress": 0, "result": None}
+    tasks.set(task_id, {"status": "processing", "progress": 0, "result": None})
     
     # Run in background
     duration_limit = 60 if fast_mode else 360
-    asyncio.create_task(run_smart_mix_task(task_id, file1_path, file2_path, mood, genre, duration_limit, turbo_mode))
+    asyncio.create_task(run_smart_mix_task(task_id, upload1, upload2, mood, genre, duration_limit, turbo_mode, fast_mode, auto_align))
     
     return {"task_id": task_id, "status": "queued"}
 
-async def run_smart_mix_task(task_id, file1_path, file2_path, mood, genre, duration_limit, turbo_mode=False):
+async def run_smart_mix_task(task_id, upload1, upload2, mood, genre, duration_limit, turbo_mode=False, fast_mode=False, auto_align=True):
+    from remix import separate_audio
+    from jobs import render_smart_mix
     try:
-        loop = asyncio.get_event_loop()
-        # For Smart Mix, we usually need Vocals from track 1 and Instrumental from track 2
+        priority = separation_priority(fast_mode, turbo_mode)
+        # For Smart Mix we need Vocals from track 1 and Instrumental from track 2.
+        # The two separations are independent, so both are queued at once and the
+        # render starts as soon as both are ready.
+        progress1, progress2 = parallel_reporters(tasks, task_id, "separating", 2, 0, 90)
         # Track 1: Vocals Only (High priority optimization)
-        res1 = await loop.run_in_executor(None, separate_audio, file1_path, PROCESSED_DIR, duration_limit, True, turbo_mode)
-        # Track 2: All stems
-        res2 = await loop.run_in_executor(None, separate_audio, file2_path, PROCESSED_DIR, duration_limit, False, turbo_mode)
+        sep1 = scheduler.submit(
+            "separate", separate_audio, upload1["path"], PROCESSED_DIR, duration_limit, True, turbo_mode,
+            progress1, None, False, upload1["sha256"], priority=priority, task_id=task_id,
+        )
+        # Track 2: Instrumental only (its vocals would be thrown away)
+        sep2 = scheduler.submit(
+            "separate", separate_audio, upload2["path"], PROCESSED_DIR, duration_limit, False, turbo_mode,
+            progress2, None, True, upload2["sha256"], priority=priority, task_id=task_id,
+        )
+        res1, res2 = await asyncio.gather(sep1, sep2)
         
         if res1["status"] != "success" or res2["status"] != "success":
             m1 = res1.get('message', '')
             m2 = res2.get('message', '')
-            tasks[task_id] = {"status": "error", "message": f"Separation failed: {m1} {m2}"}
+            settle(task_id, {"status": "error", "message": f"Separation failed: {m1} {m2}"})
+            return
+        if tasks.get(task_id, {}).get("status") == "cancelled":
             return
         
-        # Vocals from 1
-        vocal1 = os.path.join(res1["stems_dir"], "vocals.wav")
-        # Instrumental from 2
-        drum2 = os.path.join(res2["stems_dir"], "drums.wav")
-        bass2 = os.path.join(res2["stems_dir"], "bass.wav")
-        other2 = os.path.join(res2["stems_dir"], "other.wav")
-        
+        # Vocals from 1 over the instrumental from 2
         output_filename = f"smart_mix_{mood or 'remix'}_{genre or 'style'}.wav"
         output_path = os.path.join(PROCESSED_DIR, output_filename)
-        
-        inputs_arg = ["-i", vocal1, "-i", drum2, "-i", bass2, "-i", other2]
-        filter_complex = "[0:a]volume=1.2[v];[1:a]volume=1.0[d];[2:a]volume=1.0[b];[3:a]volume=0.8[o];[v][d][b][o]amix=inputs=4:duration=longest"
-        
-        from mixer import get_mood_filter, get_genre_filter
-        mood_f = get_mood_filter(mood)
-        genre_f = get_genre_filter(genre)
-        
-        effects = ""
-        if mood_f: effects += f",{mood_f}"
-        if genre_f: effects += f",{genre_f}"
-        filter_complex += f"{effects}[out]"
-        
-        import subprocess
-        command = ["ffmpeg", "-y"]
-        command.extend(inputs_arg)
-        command.extend(["-filter_complex", filter_complex, "-map", "[out]", output_path])
-        
-        print(f"Running Smart Mix command: {' '.join(command)}")
-        await loop.run_in_executor(None, lambda: subprocess.run(command, check=True, capture_output=True))
-        tasks[task_id] = {"status": "completed", "file": output_filename}
+        progress = progress_reporter(tasks, task_id, "rendering", 90, 100)
+        result = await scheduler.submit(
+            "mix", render_smart_mix, res1["stems_dir"], res2["stems_dir"], output_path, mood, genre, auto_align,
+            PROCESSED_DIR, progress, task_id=task_id,
+        )
+        if result["status"] != "success":
+            settle(task_id, {"status": "error", "message": result["message"]})
+            return
+        settle(task_id, {"status": "completed", "file": output_filename, "alignment": result["alignment"]})
     except Exception as e:
-        tasks[task_id] = {"status": "error", "message": f"Smart mix failed: {str(e)}"}
+        settle(task_id, {"status": "error", "message": f"Smart mix failed: {str(e)}"})
+
+@app.middleware("http")
+async def limit_upload_size(request, call_next):
+    # Refuse oversized uploads from the declared length, before the body is parsed and spooled
+    # (endpoints take up to two files, batch remix a whole catalog); save_upload enforces the exact per-file limit
+    length = request.headers.get("content-length")
+    limit = MAX_BATCH_UPLOAD_BYTES if request.url.path == "/api/remix/batch" else MAX_UPLOAD_BYTES * 2
+    if request.method == "POST" and length and length.isdigit() and int(length) > limit + 1024 * 1024:
+        return JSONResponse({"detail": f"Upload exceeds the {limit // 1024 ** 2} MB limit"}, status_code=413)
+    return await call_next(request)
+
+request_log = metrics.get_logger("remix.http")
 
 @app.middleware("http")
 async def log_requests(request, call_next):
-    print(f"Incoming request: {request.method} {request.url}")
+    request_log.info(f"Incoming request: {request.method} {request.url}")
     response = await call_next(request)
-    print(f"Response status: {response.status_code}")
+    request_log.info(f"Response status: {response.status_code}")
+    metrics.HTTP_REQUESTS.inc(method=request.method, status=response.status_code)
     return response
 
 if __name__ == "__main__":
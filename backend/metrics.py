@@ -0,0 +1,217 @@
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# Seconds buckets shared by the duration histograms (sub-second mixes up to long separations)
+DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+# Per-task span timings kept for the task-status payload
+TASK_SPANS_MAX = int(os.environ.get("TASK_SPANS_MAX", "10000"))
+LOG_FILE = os.environ.get("LOG_FILE", "separation_debug.log")
+
+
+def _labels(names, values) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+        REGISTRY.append(self)
+
+    def _key(self, labels: dict):
+        return tuple(labels.get(n, "") for n in self.labelnames)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_labels(self.labelnames, k)} {v}" for k, v in items]
+
+
+class Gauge(_Metric):
+    """A gauge that is either set directly or read from `collect()` (label values -> value) at scrape time."""
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labels=(), collect=None):
+        super().__init__(name, help, labels)
+        self.collect = collect
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def render(self):
+        if self.collect:
+            try:
+                items = sorted(self.collect().items())
+            except Exception:
+                items = []
+        else:
+            with self._lock:
+                items = sorted(self._values.items())
+        return [f"{self.name}{_labels(self.labelnames, k if isinstance(k, tuple) else (k,))} {float(v)}" for k, v in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels=(), buckets=DURATION_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value)
+            self._values[key + ("__count",)] = self._values.get(key + ("__count",), 0) + 1
+
+    def render(self):
+        with self._lock:
+            items = sorted((k, v) for k, v in self._values.items() if k[-1:] != ("__count",))
+            counts_total = {k[:-1]: v for k, v in self._values.items() if k[-1:] == ("__count",)}
+        lines = []
+        names = self.labelnames + ("le",)
+        for key, (counts, total) in items:
+            for bound, count in zip(self.buckets, counts):
+                lines.append(f"{self.name}_bucket{_labels(names, key + (bound,))} {count}")
+            count = counts_total.get(key, 0)
+            lines.append(f"{self.name}_bucket{_labels(names, key + ('+Inf',))} {count}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+REGISTRY = []
+
+QUEUE_WAIT = Histogram("remix_job_queue_wait_seconds", "Time jobs spend waiting for a worker", ["type"])
+JOB_DURATION = Histogram("remix_job_duration_seconds", "Time jobs spend running on a worker", ["type"])
+STAGE_DURATION = Histogram("remix_stage_duration_seconds", "Duration of pipeline stages (decode, load_audio, separation, mix, preview, generation, transcode, features)", ["stage"])
+CACHE_REQUESTS = Counter("remix_cache_requests_total", "Cache lookups by cache and result", ["cache", "result"])
+CACHE_EVICTIONS = Counter("remix_cache_evictions_total", "Entries evicted from the on-disk caches", ["cache"])
+HTTP_REQUESTS = Counter("remix_http_requests_total", "HTTP requests by method and status", ["method", "status"])
+GENERATION_BATCH_SIZE = Histogram("remix_generation_batch_size", "Prompts per MusicGen generate call", [], buckets=(1, 2, 3, 4, 6, 8, 16))
+
+
+def render() -> str:
+    """Every registered metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.header())
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# --- Per-task spans. The scheduler tags each job's worker thread with its task id, so stages
+# timed deep inside the pipeline are attributed to the task without passing ids around.
+
+_current = threading.local()
+_spans = OrderedDict()  # task_id -> {stage: seconds}
+_spans_lock = threading.Lock()
+
+
+def run_traced(task_id: str, fn, *args):
+    """Runs fn(*args) with task_id as the current task of this thread."""
+    _current.task_id = task_id
+    try:
+        return fn(*args)
+    finally:
+        _current.task_id = None
+
+
+def record_span(task_id: str, stage: str, seconds: float):
+    if not task_id:
+        return
+    with _spans_lock:
+        spans = _spans.setdefault(task_id, {})
+        # Stages that run more than once for a task (smart-mix separates twice) add up
+        spans[stage] = round(spans.get(stage, 0.0) + seconds, 4)
+        _spans.move_to_end(task_id)
+        while len(_spans) > TASK_SPANS_MAX:
+            _spans.popitem(last=False)
+
+
+def task_spans(task_id: str) -> dict:
+    with _spans_lock:
+        return dict(_spans.get(task_id, {}))
+
+
+def pop_spans(task_id: str) -> dict:
+    with _spans_lock:
+        return _spans.pop(task_id, {})
+
+
+@contextmanager
+def span(stage: str):
+    """Times a pipeline stage into the stage histogram and the current task's spans."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        STAGE_DURATION.observe(seconds, stage=stage)
+        record_span(getattr(_current, "task_id", None), stage, seconds)
+
+
+# --- Logging: records go through a queue to a background listener, so callers never
+# block on file I/O.
+
+_listener = None
+_listener_lock = threading.Lock()
+
+
+def get_logger(name: str = "remix") -> logging.Logger:
+    """Logger whose records are written to stdout and LOG_FILE by a background thread."""
+    global _listener
+    logger = logging.getLogger(name)
+    with _listener_lock:
+        if _listener is None:
+            records = queue.SimpleQueue()
+            file_handler = logging.FileHandler(LOG_FILE)
+            file_handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+            stream_handler = logging.StreamHandler()
+            stream_handler.setFormatter(logging.Formatter("%(message)s"))
+            _listener = logging.handlers.QueueListener(records, file_handler, stream_handler)
+            _listener.start()
+            root = logging.getLogger("remix")
+            root.addHandler(logging.handlers.QueueHandler(records))
+            root.setLevel(logging.INFO)
+            root.propagate = False
+    return logger
+
+
+def stop_logging():
+    """Flushes queued log records (call on shutdown)."""
+    global _listener
+    with _listener_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
@@ -1,11 +1,217 @@
 import subprocess
 import os
 import json
+import hashlib
+import threading
+from collections import OrderedDict
 from typing import Dict, List
 
-def mix_stems_with_volumes(stems_dir: str, volumes: Dict[str, float], output_path: str, mood: str = None, genre: str = None):
+import numpy as np
+import soundfile as sf
+from scipy.signal import resample_poly
+
+import metrics
+import procs
+from cache import DirectoryCache
+from effects import apply_chain, preset_filters
+from stems import export_wav, has_stem, locate, read_stem, stem_names
+
+# "native" mixes decoded stems in-process with NumPy; "ffmpeg" always spawns an amix graph
+MIX_BACKEND = os.environ.get("MIX_BACKEND", "native").lower()
+# Decoded stems kept in memory so re-mixing the same stems_dir skips the decode
+DECODED_STEM_CACHE_BYTES = int(float(os.environ.get("DECODED_STEM_CACHE_MB", "1024")) * 1024 ** 2)
+
+# Interactive previews render from mono proxies at this rate (presets reach 12 kHz, so keep Nyquist above it)
+PREVIEW_SAMPLE_RATE = int(os.environ.get("PREVIEW_SAMPLE_RATE", "32000"))
+PREVIEW_DIR = "preview"  # proxies live in <stems_dir>/preview/<stem>.wav
+# Effects state (echo tails, compressor envelope) is warmed up on this much audio before a window
+PREVIEW_PREROLL_SECONDS = 2.0
+PREVIEW_CACHE_MAX_BYTES = int(float(os.environ.get("PREVIEW_CACHE_MAX_MB", "256")) * 1024 ** 2)
+# Longest clip a preview may render (previews are for tweaking, exports go through the full mix)
+PREVIEW_MAX_SECONDS = float(os.environ.get("PREVIEW_MAX_SECONDS", "60"))
+
+_decoded_stems = OrderedDict()  # (path, mtime, size) -> (float32 frames x channels, sample_rate)
+_decoded_lock = threading.Lock()
+_decoded_bytes = 0
+
+def stem_version(path: str):
+    """Identifies the current content of a stem (WAV or stem pack entry) for caching."""
+    source, name = locate(path)
+    st = os.stat(source)
+    return (os.path.abspath(source), name, st.st_mtime_ns, st.st_size)
+
+def load_stem(path: str):
+    """Decodes a stem to float32 (frames, channels), reusing the in-memory copy while the file is unchanged."""
+    key = stem_version(path)
+    with _decoded_lock:
+        if key in _decoded_stems:
+            _decoded_stems.move_to_end(key)
+            return _decoded_stems[key]
+
+    data, sample_rate = read_stem(path)
+    return _remember(key, data, sample_rate)
+
+def _remember(key, data, sample_rate):
+    global _decoded_bytes
+    data.setflags(write=False)
+    with _decoded_lock:
+        if key not in _decoded_stems:
+            _decoded_stems[key] = (data, sample_rate)
+            _decoded_bytes += data.nbytes
+            while _decoded_bytes > DECODED_STEM_CACHE_BYTES and len(_decoded_stems) > 1:
+                _, (old, _) = _decoded_stems.popitem(last=False)
+                _decoded_bytes -= old.nbytes
+    return data, sample_rate
+
+def downmix_proxy(data, sample_rate: int):
+    """Mono, PREVIEW_SAMPLE_RATE version of (frames, channels) audio."""
+    mono = data.mean(axis=1, dtype=np.float32)
+    if sample_rate != PREVIEW_SAMPLE_RATE:
+        g = np.gcd(sample_rate, PREVIEW_SAMPLE_RATE)
+        mono = resample_poly(mono, PREVIEW_SAMPLE_RATE // g, sample_rate // g).astype(np.float32)
+    return mono[:, None]
+
+def build_stem_proxies(stems_dir: str):
+    """Writes the preview proxy of every stem in stems_dir; run once when separation finishes."""
+    os.makedirs(os.path.join(stems_dir, PREVIEW_DIR), exist_ok=True)
+    for name in stem_names(stems_dir):
+        data, sample_rate = read_stem(os.path.join(stems_dir, f"{name}.wav"))
+        sf.write(os.path.join(stems_dir, PREVIEW_DIR, f"{name}.wav"), downmix_proxy(data, sample_rate), PREVIEW_SAMPLE_RATE, subtype='PCM_16')
+
+def load_proxy(path: str):
+    """
+    Preview proxy of a source: the on-disk proxy written after separation when there is one,
+    otherwise downmixed/resampled from the source and kept in the decoded-stem cache.
+    """
+    proxy = os.path.join(os.path.dirname(path), PREVIEW_DIR, os.path.basename(path))
+    if os.path.exists(proxy):
+        return load_stem(proxy)
+    key = ("proxy",) + stem_version(path)
+    with _decoded_lock:
+        if key in _decoded_stems:
+            _decoded_stems.move_to_end(key)
+            return _decoded_stems[key]
+    data, sample_rate = load_stem(path)
+    return _remember(key, downmix_proxy(data, sample_rate), PREVIEW_SAMPLE_RATE)
+
+@metrics.span("mix")
+def mix_native(sources, output_path: str, progress=None, filters=None):
+    """
+    Sums (path, gain) sources the way ffmpeg's `volume` + `amix=duration=longest` graph does:
+    each input is scaled by its gain and, with more than one input, by 1/N, shorter inputs
+    are padded with silence. Mood/genre `filters` (ffmpeg specs) run through the native
+    effect chain, and the result is written as 16-bit PCM WAV.
+    """
+    decoded = [(load_stem(path), gain) for path, gain in sources]
+    rates = {sample_rate for (_, sample_rate), _ in decoded}
+    if len(rates) != 1:
+        raise ValueError(f"Stems have different sample rates: {sorted(rates)}")
+    sample_rate = rates.pop()
+    frames = max(data.shape[0] for (data, _), _ in decoded)
+    channels = max(data.shape[1] for (data, _), _ in decoded)
+
+    norm = 1.0 / len(decoded) if len(decoded) > 1 else 1.0
+    mix = np.zeros((frames, channels), dtype=np.float32)
+    for (data, _), gain in decoded:
+        mix[:data.shape[0]] += data * np.float32(gain * norm)
+
+    mix = apply_chain(mix, sample_rate, filters or [])
+    np.clip(mix, -1.0, 1.0, out=mix)
+    sf.write(output_path, mix, sample_rate, subtype='PCM_16')
+    if progress:
+        duration = frames / sample_rate
+        progress(duration, duration)
+    return {"status": "success", "file": output_path}
+
+_preview_stores = {}
+
+def get_preview_store(output_dir: str) -> DirectoryCache:
+    root = os.path.abspath(os.path.join(output_dir, "previews"))
+    if root not in _preview_stores:
+        _preview_stores[root] = DirectoryCache(root, PREVIEW_CACHE_MAX_BYTES)
+    return _preview_stores[root]
+
+@metrics.span("preview")
+def mix_preview(sources, output_dir: str, mood: str = None, genre: str = None, start: float = None, duration: float = None):
+    """
+    Quick, small render of (path, gain) sources for interactive tweaking: mixes the mono
+    low-rate proxies, optionally only `duration` seconds from `start`, applies the same effect
+    chain as the full render and encodes an Ogg Vorbis clip into the preview cache (identical
+    settings reuse the clip). The result's "file" is relative to output_dir.
+    """
+    if not sources:
+        return {"status": "error", "message": "No stem files found"}
+    # Checked before the cache lookup so invalid windows are never rendered or cached
+    if start is not None and not 0 <= start < float("inf"):
+        return {"status": "error", "message": "Preview start must be a non-negative number of seconds"}
+    if duration is not None and not 0 < duration <= PREVIEW_MAX_SECONDS:
+        return {"status": "error", "message": f"Preview duration must be between 0 and {PREVIEW_MAX_SECONDS:g} seconds"}
+    filters = preset_filters(mood, genre)
+    versions = [(*stem_version(path), gain) for path, gain in sources]
+    blob = json.dumps({"sources": versions, "filters": filters, "start": start, "duration": duration, "rate": PREVIEW_SAMPLE_RATE})
+    store = get_preview_store(output_dir)
+    key = hashlib.sha256(blob.encode()).hexdigest()[:32] + ".ogg"
+    cached = store.get(key)
+    if cached:
+        return {"status": "success", "file": f"previews/{key}", "cached": True}
+
+    proxies = [(load_proxy(path)[0], gain) for path, gain in sources]
+    frames = max(len(data) for data, _ in proxies)
+    first = int((start or 0) * PREVIEW_SAMPLE_RATE)
+    last = frames if duration is None else min(frames, first + int(duration * PREVIEW_SAMPLE_RATE))
+    if first >= last:
+        return {"status": "error", "message": "Preview window is outside the track"}
+    lead = min(first, int(PREVIEW_PREROLL_SECONDS * PREVIEW_SAMPLE_RATE))
+
+    # Same 1/N normalisation as the full render, so preview and export sound alike
+    norm = 1.0 / len(proxies) if len(proxies) > 1 else 1.0
+    mix = np.zeros((last - first + lead, 1), dtype=np.float32)
+    for data, gain in proxies:
+        part = data[first - lead:last]
+        mix[:len(part)] += part * np.float32(gain * norm)
+
+    mix = apply_chain(mix, PREVIEW_SAMPLE_RATE, filters)[lead:]
+    np.clip(mix, -1.0, 1.0, out=mix)
+    tmp_path = store.reserve(key) + ".ogg"
+    try:
+        sf.write(tmp_path, mix, PREVIEW_SAMPLE_RATE, format='OGG', subtype='VORBIS')
+        store.publish(key, tmp_path)
+    except Exception:
+        store.discard(tmp_path)
+        raise
+    return {"status": "success", "file": f"previews/{key}", "cached": False}
+
+@metrics.span("mix")
+def run_ffmpeg(command: List[str], progress=None, duration: float = None):
+    """
+    Runs an ffmpeg command through procs.run (raises CalledProcessError, or TimeoutExpired after
+    the mix stage timeout). With a progress callback, ffmpeg's `-progress` output is parsed and
+    reported as progress(seconds_rendered, duration); duration may be None when it isn't known up front.
+    """
+    if progress is None:
+        return procs.run(command, "mix")
+
+    def on_stdout(line):
+        key, _, value = line.strip().partition("=")
+        if key == "out_time_us" and value.isdigit():
+            progress(int(value) / 1e6, duration)
+        elif key == "progress" and value == "end" and duration:
+            progress(duration, duration)
+
+    return procs.run(command[:1] + ["-progress", "pipe:1", "-nostats"] + command[1:], "mix", on_stdout=on_stdout)
+
+def audio_duration(*paths: str):
+    """Longest duration of the given files in seconds, or None if any of them can't be probed cheaply."""
+    try:
+        return max(sf.info(path).duration for path in paths)
+    except Exception:
+        return None
+
+def mix_stems_with_volumes(stems_dir: str, volumes: Dict[str, float], output_path: str, mood: str = None, genre: str = None, progress=None, preview: dict = None):
     """
     Mix separated stems with specified volume levels and optional mood/genre effects.
+    preview={"start":..., "duration":...} renders a low-resolution clip via mix_preview into
+    the directory of output_path instead of the full-quality mix.
     """
     stem_files = {
         'vocals': os.path.join(stems_dir, 'vocals.wav'),
@@ -14,22 +220,35 @@ def mix_stems_with_volumes(stems_dir: str, volumes: Dict[str, float], output_pat
         'other': os.path.join(stems_dir, 'other.wav')
     }
     
-    # Check which stems exist
+    existing = [(path, volumes.get(name, 1.0)) for name, path in stem_files.items() if has_stem(path)]
+    if preview is not None:
+        return mix_preview(existing, os.path.dirname(output_path), mood, genre, **preview)
+    return mix_sources(existing, output_path, mood, genre, progress)
+
+def mix_sources(sources, output_path: str, mood: str = None, genre: str = None, progress=None):
+    """
+    Mix (path, gain) sources with optional mood/genre effects, natively when possible and
+    otherwise through an ffmpeg volume + amix graph.
+    """
+    if MIX_BACKEND == "native" and sources:
+        try:
+            return mix_native(sources, output_path, progress, preset_filters(mood, genre))
+        except procs.Cancelled:
+            raise
+        except Exception as e:
+            print(f"Native mix failed, falling back to FFmpeg: {e}")
+
     inputs = []
     filter_parts = []
-    idx = 0
-    for name, path in stem_files.items():
-        if os.path.exists(path):
-            volume = volumes.get(name, 1.0)
-            inputs.extend(["-i", path])
-            filter_parts.append(f"[{idx}:a]volume={volume}[a{idx}]")
-            idx += 1
+    for idx, (path, volume) in enumerate(sources):
+        # ffmpeg needs real files, so packed stems get their WAV view written
+        inputs.extend(["-i", export_wav(path)])
+        filter_parts.append(f"[{idx}:a]volume={volume}[a{idx}]")
     
     if not inputs:
         return {"status": "error", "message": "No stem files found"}
     
     num_stems = len(inputs) // 2
-    
     # Build filter complex
     all_inputs = "".join([f"[a{i}]" for i in range(num_stems)])
     
@@ -58,7 +277,7 @@ def mix_stems_with_volumes(stems_dir: str, volumes: Dict[str, float], output_pat
     
     try:
         print(f"Running FFmpeg command: {' '.join(command)}")
-        result = subprocess.run(command, check=True, capture_output=True, text=True, encoding='utf-8')
+        result = run_ffmpeg(command, progress, audio_duration(*inputs[1::2]) if progress else None)
         return {"status": "success", "file": output_path}
     except subprocess.CalledProcessError as e:
         print(f"FFmpeg failed with exit code {e.returncode}")
@@ -67,13 +286,27 @@ def mix_stems_with_volumes(stems_dir: str, volumes: Dict[str, float], output_pat
         error_msg = "\n".join([line for line in err_lines if "Error" in line or "Invalid" in line or "failed" in line][-3:])
         if not error_msg: error_msg = err_lines[-1]
         return {"status": "error", "message": f"Mixing failed: {error_msg}"}
+    except subprocess.TimeoutExpired as e:
+        return {"status": "error", "message": f"Mixing timed out after {e.timeout:.0f}s"}
 
-def mix_two_tracks(file1_path: str, file2_path: str, blend_ratio: float, output_path: str, mood: str = None, genre: str = None):
+def mix_two_tracks(file1_path: str, file2_path: str, blend_ratio: float, output_path: str, mood: str = None, genre: str = None, progress=None, preview: dict = None):
     """
     Mix two complete audio tracks together with a blend ratio and effects.
+    preview works as in mix_stems_with_volumes.
     """
     volume1 = 1.0 - blend_ratio
     volume2 = blend_ratio
+
+    if preview is not None:
+        return mix_preview([(file1_path, volume1), (file2_path, volume2)], os.path.dirname(output_path), mood, genre, **preview)
+
+    if MIX_BACKEND == "native":
+        try:
+            return mix_native([(file1_path, volume1), (file2_path, volume2)], output_path, progress, preset_filters(mood, genre))
+        except procs.Cancelled:
+            raise
+        except Exception as e:
+            print(f"Native mix failed, falling back to FFmpeg: {e}")
     
     mood_filter = get_mood_filter(mood)
     genre_filter = get_genre_filter(genre)
@@ -99,42 +332,16 @@ def mix_two_tracks(file1_path: str, file2_path: str, blend_ratio: float, output_
     
     try:
         print(f"Running FFmpeg command: {' '.join(command)}")
-        result = subprocess.run(command, check=True, capture_output=True, text=True, encoding='utf-8')
+        result = run_ffmpeg(command, progress, audio_duration(file1_path, file2_path) if progress else None)
         return {"status": "success", "file": output_path}
     except subprocess.CalledProcessError as e:
         err = e.stderr if e.stderr else e.stdout
         return {"status": "error", "message": f"Mixing failed: {err}"}
+    except subprocess.TimeoutExpired as e:
+        return {"status": "error", "message": f"Mixing timed out after {e.timeout:.0f}s"}
 
 def get_mood_filter(mood: str) -> str:
-    if not mood: return ""
-    mood = mood.lower()
-    filters = {
-        'happy': 'equalizer=f=1000:width_type=h:width=200:g=2,equalizer=f=5000:width_type=h:width=500:g=3,aecho=0.8:0.88:60:0.4',
-        'sad': 'equalizer=f=3000:width_type=h:width=1000:g=-6,lowpass=f=2000,aecho=0.8:0.9:1000:0.3',
-        'energetic': 'compand=0.3 0.3:0.8 0.8:-70/-60 -20/-14:6:0:-90:0.2,equalizer=f=80:width_type=h:width=40:g=6,equalizer=f=12000:width_type=h:width=1000:g=3',
-        'relaxed': 'lowpass=f=5000,aecho=0.8:0.9:1000:0.2,basstreble=bass=-2',
-        'chill': 'lowpass=f=8000,aecho=0.8:0.88:60:0.2,equalizer=f=400:width_type=h:width=100:g=-3',
-        'romantic': 'aecho=0.8:0.9:1000:0.4,equalizer=f=2000:width_type=h:width=500:g=2,aphaser=in_gain=0.4',
-        'dark': 'lowpass=f=3000,equalizer=f=100:width_type=h:width=50:g=4,equalizer=f=2500:width_type=h:width=500:g=-5',
-        'mysterious': 'aecho=0.8:0.9:1000:0.6,equalizer=f=4000:width_type=h:width=1000:g=-4,vibrato=f=4:d=0.3',
-        'cinematic': 'aecho=0.8:0.9:1000:0.3,compand,equalizer=f=100:width_type=h:width=50:g=3,equalizer=f=10000:width_type=h:width=1000:g=2',
-        'epic': 'compand,equalizer=f=80:width_type=h:width=40:g=5,equalizer=f=5000:width_type=h:width=500:g=3,aecho=0.8:0.88:40:0.5'
-    }
-    return filters.get(mood, "")
+    return ",".join(preset_filters(mood=mood))
 
 def get_genre_filter(genre: str) -> str:
-    if not genre: return ""
-    genre = genre.lower()
-    filters = {
-        'pop': 'equalizer=f=1000:width_type=h:width=500:g=2,equalizer=f=8000:width_type=h:width=1000:g=3',
-        'rock': 'equalizer=f=400:width_type=h:width=200:g=3,equalizer=f=3000:width_type=h:width=500:g=4',
-        'hip hop': 'equalizer=f=60:width_type=h:width=30:g=8,compand=0.3 0.3:0.8 0.8:-70/-60 -20/-14:6:0:-90:0.2',
-        'jazz': 'equalizer=f=1000:width_type=h:width=500:g=-2,aecho=0.8:0.9:1000:0.2',
-        'classical': 'compand,equalizer=f=5000:width_type=h:width=1000:g=2',
-        'electronic': 'equalizer=f=60:width_type=h:width=30:g=5,equalizer=f=12000:width_type=h:width=1000:g=5,aphaser=in_gain=0.5',
-        'lo-fi': 'lowpass=f=4000,highpass=f=200,aecho=0.8:0.9:1000:0.1',
-        'ambient': 'lowpass=f=3000,aecho=0.8:0.9:2000:0.6',
-        'folk': 'equalizer=f=3000:width_type=h:width=500:g=2,equalizer=f=100:width_type=h:width=50:g=-2',
-        'reggae': 'equalizer=f=80:width_type=h:width=40:g=6,aecho=0.8:0.9:300:0.4'
-    }
-    return filters.get(genre, "")
+    return ",".join(preset_filters(genre=genre))
@@ -0,0 +1,175 @@
+"""
+Shared runner for the ffmpeg/ffprobe child processes of jobs, built on asyncio subprocesses.
+
+Every child gets a per-stage timeout, runs in its own process group (so a timeout or a
+cancelled task kills the whole tree), has stderr streamed line by line instead of buffered,
+and is started with the nice level and thread count of its job class (the scheduler lane
+whose worker thread spawned it).
+"""
+import asyncio
+import os
+import signal
+import subprocess
+import threading
+from collections import OrderedDict, deque
+
+# Seconds a child process of each stage may run before it is killed
+STAGE_TIMEOUTS = {
+    stage: float(os.environ.get(f"PROCS_TIMEOUT_{stage.upper()}", default))
+    for stage, default in {"probe": "30", "decode": "600", "transcode": "900", "mix": "1800"}.items()
+}
+# Per job class (scheduler lane): nice level of its child processes and their thread count (0 = tool default).
+# Interactive mixes keep normal priority; background analysis yields to everything else.
+JOB_CLASS_LIMITS = {
+    lane: {
+        "nice": int(os.environ.get(f"PROCS_NICE_{lane.upper()}", nice)),
+        "threads": int(os.environ.get(f"PROCS_THREADS_{lane.upper()}", "0")),
+    }
+    for lane, nice in {"separate": "10", "generate": "5", "mix": "0", "analyze": "15"}.items()
+}
+STDERR_TAIL_LINES = 200
+CANCELLED_MAX = 10000
+
+_current = threading.local()
+_lock = threading.Lock()
+_cancelled = OrderedDict()  # task_id -> None, most recent last
+_processes = {}  # task_id -> set of running asyncio processes
+
+
+class Cancelled(Exception):
+    pass
+
+
+def run_for_task(task_id: str, fn, *args):
+    """Runs fn(*args) with task_id as the task whose cancellation stops this thread's work."""
+    _current.task_id = task_id
+    try:
+        check_cancelled()
+        return fn(*args)
+    finally:
+        _current.task_id = None
+
+
+def current_task():
+    return getattr(_current, "task_id", None)
+
+
+def is_cancelled(task_id: str) -> bool:
+    with _lock:
+        return task_id in _cancelled
+
+
+def check_cancelled():
+    """Raises Cancelled when the current thread's task was cancelled (call between units of work)."""
+    task_id = current_task()
+    if task_id and is_cancelled(task_id):
+        raise Cancelled(f"Task {task_id} was cancelled")
+
+
+def cancel(task_id: str) -> int:
+    """Marks the task cancelled and kills its running child processes; returns how many were killed."""
+    with _lock:
+        _cancelled[task_id] = None
+        _cancelled.move_to_end(task_id)
+        while len(_cancelled) > CANCELLED_MAX:
+            _cancelled.popitem(last=False)
+        processes = list(_processes.get(task_id, ()))
+    for process in processes:
+        _kill(process)
+    return len(processes)
+
+
+def _kill(process):
+    try:
+        if hasattr(os, "killpg"):
+            os.killpg(process.pid, signal.SIGKILL)
+        else:
+            process.kill()
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+def _job_class():
+    # Scheduler and queue-worker threads are named job-<lane>_<n>
+    name = threading.current_thread().name
+    return name[4:].split("_")[0] if name.startswith("job-") else None
+
+
+def _environment(limits: dict) -> dict:
+    env = dict(os.environ)
+    if limits.get("threads"):
+        for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+            env[var] = str(limits["threads"])
+    return env
+
+
+def _command(command: list, limits: dict) -> list:
+    if limits.get("threads") and os.path.basename(command[0]).startswith("ffmpeg"):
+        threads = str(limits["threads"])
+        return command[:1] + ["-threads", threads, "-filter_threads", threads] + command[1:]
+    return command
+
+
+async def run_async(command: list, stage: str, timeout: float = None, on_stdout=None, on_stderr=None,
+                    check: bool = True, job_class: str = None, task_id: str = None) -> subprocess.CompletedProcess:
+    """
+    Runs command to completion. stdout lines go to on_stdout (or are collected), stderr lines to
+    on_stderr while the last STDERR_TAIL_LINES are kept for errors. Raises TimeoutExpired after
+    the stage's timeout, Cancelled when the task is cancelled, CalledProcessError on failure (check).
+    """
+    timeout = timeout if timeout is not None else STAGE_TIMEOUTS.get(stage)
+    limits = JOB_CLASS_LIMITS.get(job_class, {})
+    if task_id and is_cancelled(task_id):
+        raise Cancelled(f"Task {task_id} was cancelled")
+    process = await asyncio.create_subprocess_exec(
+        *_command(command, limits), stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=_environment(limits),
+        start_new_session=True,
+    )
+    if limits.get("nice") and hasattr(os, "setpriority"):
+        try:
+            os.setpriority(os.PRIO_PROCESS, process.pid, limits["nice"])
+        except OSError:
+            pass
+    with _lock:
+        _processes.setdefault(task_id, set()).add(process)
+    stdout, stderr_tail = [], deque(maxlen=STDERR_TAIL_LINES)
+
+    async def pump(stream, callback, sink):
+        async for raw in stream:
+            line = raw.decode("utf-8", "replace").rstrip("\r\n")
+            sink.append(line)
+            if callback:
+                callback(line)
+
+    try:
+        await asyncio.wait_for(
+            asyncio.gather(pump(process.stdout, on_stdout, deque(maxlen=0) if on_stdout else stdout),
+                           pump(process.stderr, on_stderr, stderr_tail), process.wait()),
+            timeout,
+        )
+    except asyncio.TimeoutError:
+        _kill(process)
+        await process.wait()
+        raise subprocess.TimeoutExpired(command, timeout, stderr="\n".join(stderr_tail))
+    except BaseException:
+        # A callback failed (e.g. Cancelled from a progress report) or the caller gave up
+        _kill(process)
+        await process.wait()
+        raise
+    finally:
+        with _lock:
+            running = _processes.get(task_id)
+            running.discard(process)
+            if not running:
+                _processes.pop(task_id, None)
+    if task_id and is_cancelled(task_id):
+        raise Cancelled(f"Task {task_id} was cancelled")
+    result = subprocess.CompletedProcess(command, process.returncode, "\n".join(stdout), "\n".join(stderr_tail))
+    if check and process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, command, output=result.stdout, stderr=result.stderr)
+    return result
+
+
+def run(command: list, stage: str, timeout: float = None, on_stdout=None, on_stderr=None, check: bool = True):
+    """run_async for job threads: the child belongs to the thread's task and job class."""
+    return asyncio.run(run_async(command, stage, timeout, on_stdout, on_stderr, check, _job_class(), current_task()))
@@ -0,0 +1,186 @@
+import asyncio
+import json
+import time
+
+import procs
+
+# Re-read the store at least this often even without a local notification
+# (records written by other worker processes through a shared SQLite store don't notify us)
+EVENT_REFRESH_SECONDS = 2.0
+# Minimum time between progress writes for one stage, so per-chunk callbacks don't flood the store
+REPORT_INTERVAL_SECONDS = 0.5
+
+TERMINAL_STATUSES = ("completed", "error", "cancelled", "not_found")
+
+
+class TaskEvents:
+    """
+    Wakes up event-stream handlers when a task record changes.
+    `notify` is registered as a task store listener and may be called from executor threads.
+    """
+
+    def __init__(self):
+        self.loop = None
+        self._events = {}
+
+    def attach(self, loop):
+        self.loop = loop
+
+    def notify(self, task_id: str):
+        if self.loop is not None and task_id in self._events:
+            self.loop.call_soon_threadsafe(self._wake, task_id)
+
+    def _wake(self, task_id: str):
+        event = self._events.get(task_id)
+        if event is not None:
+            event.set()
+
+    async def wait(self, task_id: str, timeout: float):
+        event = self._events.setdefault(task_id, asyncio.Event())
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        event.clear()
+
+    def release(self, task_id: str):
+        self._events.pop(task_id, None)
+
+
+async def stream_task_events(tasks, events: TaskEvents, task_id: str, decorate=None):
+    """Server-sent events: yields the task record whenever it changes, until it reaches a terminal status."""
+    last = None
+    try:
+        while True:
+            record = tasks.get(task_id, {"status": "not_found"})
+            if decorate:
+                record = decorate(task_id, record)
+            payload = json.dumps(record)
+            if payload != last:
+                last = payload
+                yield f"data: {payload}\n\n"
+            else:
+                # Keeps proxies from closing an idle connection
+                yield ": keep-alive\n\n"
+            if record.get("status") in TERMINAL_STATUSES:
+                return
+            await events.wait(task_id, EVENT_REFRESH_SECONDS)
+    finally:
+        events.release(task_id)
+
+
+class ProgressReporter:
+    """
+    callback(done, total) that maps a stage's own progress (segments, tokens, seconds
+    rendered) onto the [start, end] slice of the task's overall progress and records a
+    per-stage ETA. Reporters are rebuilt from `spec()` on queue workers (see job_queue).
+    Every report is also a cancellation point: it raises procs.Cancelled once the task is cancelled.
+    """
+    kind = "progress"
+
+    def __init__(self, tasks, task_id: str, stage: str, start: float = 0, end: float = 100):
+        self.tasks = tasks
+        self.task_id = task_id
+        self.stage = stage
+        self.start = start
+        self.end = end
+        self.started = time.time()
+        self.last_write = 0.0
+
+    def spec(self) -> dict:
+        return {"kind": self.kind, "task_id": self.task_id, "stage": self.stage, "start": self.start, "end": self.end}
+
+    def _due(self, done, total) -> bool:
+        procs.check_cancelled()
+        now = time.time()
+        if done < total and now - self.last_write < REPORT_INTERVAL_SECONDS:
+            return False
+        self.last_write = now
+        return True
+
+    def fields(self, fraction: float, done, total) -> dict:
+        fields = {
+            "progress": round(self.start + (self.end - self.start) * fraction, 1),
+            "stage": self.stage,
+            "stage_progress": [done, total],
+            "eta_seconds": None,
+        }
+        if 0 < fraction < 1:
+            fields["eta_seconds"] = round((time.time() - self.started) * (1 - fraction) / fraction, 1)
+        return fields
+
+    def __call__(self, done, total):
+        if self._due(done, total):
+            fraction = min(done / total, 1.0) if total else 0.0
+            self.tasks.update(self.task_id, **self.fields(fraction, done, total))
+
+
+class ParallelPart(ProgressReporter):
+    """
+    One of `count` jobs running side by side; the task's progress is their average. Each
+    part's fraction lives in the task record, so parts may run in different processes.
+    """
+    kind = "part"
+
+    def __init__(self, tasks, task_id: str, stage: str, index: int, count: int, start: float = 0, end: float = 100):
+        super().__init__(tasks, task_id, stage, start, end)
+        self.index = index
+        self.count = count
+
+    def spec(self) -> dict:
+        return {**super().spec(), "index": self.index, "count": self.count}
+
+    def __call__(self, done, total):
+        if not self._due(done, total):
+            return
+
+        def merge(record):
+            parts = record.get("stage_parts") or [0.0] * self.count
+            parts[self.index] = min(done / total, 1.0) if total else 0.0
+            record["stage_parts"] = parts
+            record.update(self.fields(sum(parts) / self.count, round(sum(parts), 3), self.count))
+
+        self.tasks.modify(self.task_id, merge)
+
+
+class TaskUpdater:
+    """callback(**fields) that merges fields into the task record."""
+    kind = "fields"
+
+    def __init__(self, tasks, task_id: str):
+        self.tasks = tasks
+        self.task_id = task_id
+
+    def spec(self) -> dict:
+        return {"kind": self.kind, "task_id": self.task_id}
+
+    def __call__(self, **fields):
+        procs.check_cancelled()
+        self.tasks.update(self.task_id, **fields)
+
+
+class PartialStemsReporter(TaskUpdater):
+    """callback(partial_stems_dir, seconds_ready): where the stems written so far live, for clients that start on them early."""
+    kind = "partial_stems"
+
+    def __call__(self, partial_stems_dir, seconds_ready):
+        procs.check_cancelled()
+        self.tasks.update(self.task_id, partial_stems_dir=partial_stems_dir, ready_seconds=round(seconds_ready, 1))
+
+
+CALLBACKS = {cls.kind: cls for cls in (ProgressReporter, ParallelPart, TaskUpdater, PartialStemsReporter)}
+
+
+def callback_from_spec(tasks, spec: dict):
+    """Rebuilds a reporter from its spec() against the given task store."""
+    spec = dict(spec)
+    return CALLBACKS[spec.pop("kind")](tasks, **spec)
+
+
+def progress_reporter(tasks, task_id: str, stage: str, start: float = 0, end: float = 100) -> ProgressReporter:
+    return ProgressReporter(tasks, task_id, stage, start, end)
+
+
+def parallel_reporters(tasks, task_id: str, stage: str, count: int, start: float = 0, end: float = 100) -> list:
+    """Callbacks for `count` jobs running side by side; the task's progress is their average."""
+    return [ParallelPart(tasks, task_id, stage, i, count, start, end) for i in range(count)]
@@ -1,90 +1,245 @@
-import sys
 import os
-import subprocess
+import hashlib
+import json
+import time
+import uuid
 
-def separate_audio(input_file: str, output_dir: str, duration_limit: int = 360, vocals_only: bool = False, turbo_preview: bool = False):
+import soundfile as sf
+
+import metrics
+from cache import DirectoryCache
+from ingest import canonical_audio
+from mixer import build_stem_proxies
+from stems import has_stem
+from separator import (
+    MODEL_NAME, SEPARATION_BATCH_TRACKS, decode_to_wav, is_model_wav, load_audio, scan_wav,
+    separate_stream, separate_waveform, separate_waveforms,
+)
+
+# Upper bound for the processed/htdemucs stem store (least recently used stems are evicted)
+STEM_CACHE_MAX_BYTES = int(float(os.environ.get("STEM_CACHE_MAX_GB", "10")) * 1024 ** 3)
+
+_stores = {}
+logger = metrics.get_logger("remix.separation")
+
+
+def get_stem_store(output_dir: str) -> DirectoryCache:
+    root = os.path.abspath(os.path.join(output_dir, "htdemucs"))
+    if root not in _stores:
+        _stores[root] = DirectoryCache(root, STEM_CACHE_MAX_BYTES)
+    return _stores[root]
+
+
+def stem_cache_key(audio_hash: str, **params) -> str:
+    """Cache key for a separation: decoded audio content + every parameter that changes the stems."""
+    blob = json.dumps({"audio": audio_hash, "model": MODEL_NAME, **params}, sort_keys=True)
+    return hashlib.sha256(blob.encode()).hexdigest()[:32]
+
+
+# Stems written for an "instrumental only" separation (smart-mix backing tracks)
+INSTRUMENTAL_STEMS = ["drums", "bass", "other"]
+
+BATCH_TRACKS = metrics.Counter("remix_batch_tracks_total", "Tracks finished by batch remix jobs", ["result"])
+
+
+def separation_params(duration_limit, vocals_only: bool = False, turbo_preview: bool = False, instrumental_only: bool = False) -> dict:
+    """Every parameter that changes the stems (part of the stem cache key)."""
+    return {
+        "duration_limit": duration_limit,
+        "segment": 6,
+        "shifts": 0 if turbo_preview else 1,
+        "overlap": 0.0 if turbo_preview else 0.1,
+        "two_stems": "vocals" if vocals_only else None,
+        "only": INSTRUMENTAL_STEMS if instrumental_only else None,
+    }
+
+
+def separate_audio(input_file: str, output_dir: str, duration_limit: int = 360, vocals_only: bool = False, turbo_preview: bool = False, progress=None, on_chunk=None, instrumental_only: bool = False, content_hash: str = None):
     """
     Separates audio into stems using Demucs.
     If turbo_preview is True, it only processes the first 15 seconds for instant feedback.
+    A duration_limit of None separates the whole track in streaming windows with bounded memory;
+    on_chunk(partial_stems_dir, seconds_ready) then reports stems as they are written.
+    instrumental_only writes just drums/bass/other (no vocals stem).
+    progress(done, total) receives separation segment counts.
+    The input is decoded once into the canonical PCM cache (content_hash, if known, saves re-hashing the upload).
     """
     if turbo_preview:
         duration_limit = 15
-    # Create logs directory if it doesn't exist
-    log_file = os.path.abspath(os.path.join(output_dir, "..", "separation_debug.log"))
-    
-    def log(msg):
-        with open(log_file, "a") as f:
-            f.write(f"{msg}\n")
-        print(msg)
+    log = logger.info
 
     os.makedirs(output_dir, exist_ok=True)
-    
-    # Truncate audio if it's over the requested limit
-    trimmed_input = input_file
-    try:
-        # Get duration
-        duration_cmd = ["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "default=noprint_wrappers=1:nokey=1", input_file]
-        duration = float(subprocess.check_output(duration_cmd).decode().strip())
-        
-        if duration > duration_limit:
-            log(f"--- Trimming audio from {duration:.1f}s to {duration_limit}s ---")
-            trimmed_input = os.path.join(os.path.dirname(input_file), f"trimmed_{duration_limit}_" + os.path.basename(input_file))
-            if not os.path.exists(trimmed_input):
-                trim_cmd = ["ffmpeg", "-y", "-i", input_file, "-t", str(duration_limit), "-c", "copy", trimmed_input]
-                subprocess.run(trim_cmd, check=True, capture_output=True)
-    except Exception as e:
-        log(f"Warning: Could not trim audio: {e}")
-
-    # Demucs creates a subdirectory with the track name
-    track_name = os.path.splitext(os.path.basename(trimmed_input))[0]
-    stems_dir = os.path.join(output_dir, "htdemucs", track_name)
-    
-    # Check if stems already exist (Caching)
-    target_file = "vocals.wav" if vocals_only else "drums.wav"
-    if os.path.exists(os.path.join(stems_dir, target_file)):
-        log(f"--- Using cached stems for: {track_name} ---")
-        return {"status": "success", "stems_dir": stems_dir}
+    store = get_stem_store(output_dir)
+    track_name = os.path.splitext(os.path.basename(input_file))[0]
+
+    params = separation_params(duration_limit, vocals_only, turbo_preview, instrumental_only)
 
-    # Path to the patch script
-    patch_script = os.path.abspath(os.path.join(os.path.dirname(__file__), "patch_demucs.py"))
-    
-    # Command to run our patched Demucs
-    command = [
-        sys.executable, patch_script,
-        "-n", "htdemucs", 
-        "-o", output_dir,
-        "--segment", "6",
-        "--shifts", "0" if turbo_preview else "1", 
-        "--overlap", "0.0" if turbo_preview else "0.1", 
-        "--jobs", "1",
-    ]
-    
-    if vocals_only:
-        command.extend(["--two-stems", "vocals"])
-        
-    command.append(trimmed_input)
-    
+    decoded_path = None
     try:
-        log(f"--- Starting AI Separation (VocalsOnly={vocals_only}) for: {track_name} ---")
-        log(f"Command: {' '.join(command)}")
-        
-        # Set environment for the subprocess to force soundfile backend
-        env = os.environ.copy()
-        env["TORCHAUDIO_BACKEND"] = "soundfile"
-        
-        # Run and capture output to a file instead of memory to prevent buffer issues
-        with open(log_file, "a") as f:
-            process = subprocess.run(command, stdout=f, stderr=f, text=True, env=env)
-        
-        # Check if the primary output file actually exists
-        vocals_path = os.path.join(stems_dir, "vocals.wav")
-        if os.path.exists(vocals_path):
-            log(f"--- AI Audio Separation Complete for: {track_name} ---")
+        input_file = canonical_audio(input_file, output_dir, content_hash)
+        with metrics.span("load_audio"):
+            if duration_limit:
+                # Decoding is cheap next to separation, and decoding only up to the limit replaces the old trim step
+                wav = load_audio(input_file, duration=duration_limit)
+                audio_hash = hashlib.sha256(wav.numpy().tobytes()).hexdigest()
+            else:
+                # Full-length tracks are never held in memory: decode to disk, then hash/scan in blocks
+                if is_model_wav(input_file):
+                    wav_path = input_file
+                else:
+                    decoded_dir = os.path.join(output_dir, "decoded")
+                    os.makedirs(decoded_dir, exist_ok=True)
+                    wav_path = decoded_path = decode_to_wav(input_file, os.path.join(decoded_dir, f"{uuid.uuid4().hex}.wav"))
+                audio_hash, ref_stats = scan_wav(wav_path)
+        key = stem_cache_key(audio_hash, **params)
+
+        # Check if stems already exist (Caching); a full 4-stem separation also covers an instrumental-only request
+        stems_dir = store.get(key)
+        if not stems_dir and instrumental_only:
+            stems_dir = store.get(stem_cache_key(audio_hash, **{**params, "only": None}))
+        if stems_dir:
+            log(f"--- Using cached stems for: {track_name} ({key}) ---")
             return {"status": "success", "stems_dir": stems_dir}
-        else:
-            log(f"--- AI Audio Separation Failed: Output not found in {stems_dir} ---")
-            return {"status": "error", "message": f"Demucs failed to produce output. Check logs."}
-            
+
+        log(f"--- Starting AI Separation (VocalsOnly={vocals_only}) for: {track_name} ({key}) ---")
+        tmp_dir = store.reserve(key)
+        try:
+            separation = dict(
+                segment=params["segment"],
+                shifts=params["shifts"],
+                overlap=params["overlap"],
+                two_stems=params["two_stems"],
+                progress=progress,
+                only=params["only"],
+            )
+            with metrics.span("separation"):
+                if duration_limit:
+                    separate_waveform(wav, tmp_dir, **separation)
+                else:
+                    separate_stream(wav_path, tmp_dir, ref_stats, on_chunk=on_chunk, **separation)
+            # Check if the primary stem actually exists
+            primary = "drums.wav" if instrumental_only else "vocals.wav"
+            if not has_stem(os.path.join(tmp_dir, primary)):
+                log(f"--- AI Audio Separation Failed: Output not found in {tmp_dir} ---")
+                store.discard(tmp_dir)
+                return {"status": "error", "message": f"Demucs failed to produce output. Check logs."}
+            try:
+                # Low-rate mono copies for interactive preview mixes, published with the stems
+                with metrics.span("preview"):
+                    build_stem_proxies(tmp_dir)
+            except Exception as e:
+                log(f"--- Preview proxies skipped: {e} ---")
+            stems_dir = store.publish(key, tmp_dir)
+        except Exception:
+            store.discard(tmp_dir)
+            raise
+
+        log(f"--- AI Audio Separation Complete for: {track_name} ---")
+        return {"status": "success", "stems_dir": stems_dir}
+
     except Exception as e:
         log(f"Unexpected error: {str(e)}")
         return {"status": "error", "message": f"Unexpected error: {str(e)}"}
+    finally:
+        if decoded_path and os.path.exists(decoded_path):
+            os.remove(decoded_path)
+
+
+def separate_batch(uploads, output_dir: str, duration_limit: int = 360, turbo_preview: bool = False, on_item=None):
+    """
+    Separates many uploads ({"path", "sha256"}) through the warm model. Tracks are decoded
+    once, ordered by length and stacked SEPARATION_BATCH_TRACKS at a time, so each model
+    segment runs as one forward pass for the whole group. Stems are shared with separate_audio's
+    cache in both directions. on_item(index, result) fires as each track finishes (cache hits
+    first); returns the per-upload results in order plus tracks/hour throughput.
+    A duration_limit of None separates each track on its own in streaming windows.
+    """
+    if turbo_preview:
+        duration_limit = 15
+    started = time.time()
+    results = [None] * len(uploads)
+
+    def finish(index, result, outcome):
+        results[index] = result
+        BATCH_TRACKS.inc(result=outcome)
+        if on_item:
+            on_item(index, result)
+
+    if duration_limit is None:
+        for index, upload in enumerate(uploads):
+            result = separate_audio(upload["path"], output_dir, None, content_hash=upload.get("sha256"))
+            finish(index, result, "separated" if result["status"] == "success" else "error")
+        return batch_summary(results, started)
+
+    os.makedirs(output_dir, exist_ok=True)
+    store = get_stem_store(output_dir)
+    params = separation_params(duration_limit, turbo_preview=turbo_preview)
+
+    # Decode everything first (to disk), so tracks can be grouped by length without holding them in memory
+    lengths = {}
+    for index, upload in enumerate(uploads):
+        try:
+            canonical = canonical_audio(upload["path"], output_dir, upload.get("sha256"))
+            info = sf.info(canonical)
+            lengths[index] = (min(info.frames, int(duration_limit * info.samplerate)), canonical)
+        except Exception as e:
+            finish(index, {"status": "error", "message": f"Could not decode: {e}"}, "error")
+
+    group = []
+
+    def flush():
+        if not group:
+            return
+        logger.info(f"--- Batch separation of {len(group)} track(s) ---")
+        tmp_dirs = [store.reserve(key) for _, _, key in group]
+        try:
+            with metrics.span("separation"):
+                separate_waveforms(
+                    [wav for _, wav, _ in group], tmp_dirs,
+                    segment=params["segment"], shifts=params["shifts"], overlap=params["overlap"],
+                )
+        except Exception as e:
+            for (index, _, _), tmp_dir in zip(group, tmp_dirs):
+                store.discard(tmp_dir)
+                finish(index, {"status": "error", "message": f"Separation failed: {e}"}, "error")
+            group.clear()
+            return
+        for (index, _, key), tmp_dir in zip(group, tmp_dirs):
+            try:
+                with metrics.span("preview"):
+                    build_stem_proxies(tmp_dir)
+            except Exception as e:
+                logger.info(f"--- Preview proxies skipped: {e} ---")
+            finish(index, {"status": "success", "stems_dir": store.publish(key, tmp_dir), "cached": False}, "separated")
+        group.clear()
+
+    for index, (_, canonical) in sorted(lengths.items(), key=lambda item: item[1][0]):
+        try:
+            with metrics.span("load_audio"):
+                wav = load_audio(canonical, duration=duration_limit)
+            key = stem_cache_key(hashlib.sha256(wav.numpy().tobytes()).hexdigest(), **params)
+        except Exception as e:
+            finish(index, {"status": "error", "message": f"Could not load audio: {e}"}, "error")
+            continue
+        stems_dir = store.get(key)
+        if stems_dir:
+            finish(index, {"status": "success", "stems_dir": stems_dir, "cached": True}, "cached")
+            continue
+        group.append((index, wav, key))
+        if len(group) >= SEPARATION_BATCH_TRACKS:
+            flush()
+    flush()
+    return batch_summary(results, started)
+
+
+def batch_summary(results, started: float) -> dict:
+    elapsed = max(time.time() - started, 1e-6)
+    done = sum(1 for result in results if result and result["status"] == "success")
+    return {
+        "status": "success",
+        "items": results,
+        "tracks": len(results),
+        "succeeded": done,
+        "seconds": round(elapsed, 1),
+        "tracks_per_hour": round(done / elapsed * 3600, 1),
+    }
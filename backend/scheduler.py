@@ -0,0 +1,135 @@
+import asyncio
+import heapq
+import itertools
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+import procs
+
+# Priority lanes (lower runs first)
+PRIORITY_PREVIEW = 0   # turbo previews, interactive mixes
+PRIORITY_NORMAL = 1
+PRIORITY_FULL = 2      # full-length separations
+
+# Concurrency per job type; each type gets its own worker pool
+DEFAULT_LIMITS = {
+    "separate": int(os.environ.get("SCHEDULER_SEPARATE_WORKERS", "2")),
+    # generate jobs (streams included) queue prompts on the MusicGen batcher, whose single thread
+    # runs every model.generate call, so several may wait together
+    "generate": int(os.environ.get("SCHEDULER_GENERATE_WORKERS", "4")),
+    "mix": int(os.environ.get("SCHEDULER_MIX_WORKERS", "2")),
+    # background feature extraction for the smart-mix index
+    "analyze": int(os.environ.get("SCHEDULER_ANALYZE_WORKERS", "1")),
+}
+MAX_QUEUE = int(os.environ.get("SCHEDULER_MAX_QUEUE", "32"))
+
+
+class QueueFull(Exception):
+    pass
+
+
+class _Lane:
+    def __init__(self, name: str, concurrency: int):
+        self.name = name
+        self.concurrency = max(1, concurrency)
+        self.running = 0
+        self.pending = []  # heap of [priority, seq, task_id, future]
+        self.executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix=f"job-{name}")
+
+
+class JobScheduler:
+    """
+    Admits CPU-heavy jobs into bounded per-type worker pools.
+    `submit` either reserves a queue slot or raises QueueFull immediately, so endpoints can
+    reject with 429 instead of piling work onto the machine. Waiting jobs are started in
+    priority order as workers of their type free up.
+    """
+
+    def __init__(self, limits: dict = None, max_queue: int = MAX_QUEUE):
+        self.lanes = {name: _Lane(name, n) for name, n in (limits or DEFAULT_LIMITS).items()}
+        self.max_queue = max_queue
+        self._seq = itertools.count()
+
+    def queued(self) -> int:
+        return sum(len(lane.pending) for lane in self.lanes.values())
+
+    def ensure_capacity(self, slots: int = 1):
+        if self.queued() + slots > self.max_queue:
+            raise QueueFull(f"Job queue is full ({self.max_queue} waiting), try again shortly")
+
+    def submit(self, job_type: str, fn, *args, priority: int = PRIORITY_NORMAL, task_id: str = None):
+        """
+        Reserves a slot for fn(*args) and returns an asyncio.Task that yields its result.
+        The job runs whether or not the caller awaits it, so a reserved slot is never leaked.
+        """
+        lane = self.lanes[job_type]
+        self.ensure_capacity()
+        entry = [priority, next(self._seq), task_id, asyncio.get_running_loop().create_future()]
+        heapq.heappush(lane.pending, entry)
+        self._dispatch(lane)
+        job = asyncio.ensure_future(self._run(lane, entry, fn, args))
+        # Runs however the job ends, including a cancel that lands before _run resumes after dispatch
+        job.add_done_callback(lambda _: self._release(lane, entry))
+        return job
+
+    async def _run(self, lane: _Lane, entry, fn, args):
+        queued_at = time.perf_counter()
+        await entry[3]
+        started = time.perf_counter()
+        metrics.QUEUE_WAIT.observe(started - queued_at, type=lane.name)
+        metrics.record_span(entry[2], "queue_wait", started - queued_at)
+        try:
+            loop = asyncio.get_running_loop()
+            # Stages timed inside the job are attributed to its task through the worker thread,
+            # which also ties the job's child processes to the task for cancellation
+            return await loop.run_in_executor(
+                lane.executor, metrics.run_traced, entry[2], procs.run_for_task, entry[2], fn, *args
+            )
+        finally:
+            metrics.JOB_DURATION.observe(time.perf_counter() - started, type=lane.name)
+
+    def _release(self, lane: _Lane, entry):
+        if entry in lane.pending:
+            # Withdrawn while waiting
+            lane.pending.remove(entry)
+            heapq.heapify(lane.pending)
+        elif entry[3].done() and not entry[3].cancelled():
+            # The job held a worker slot, whether it ran or was cancelled right after dispatch
+            lane.running -= 1
+            self._dispatch(lane)
+
+    def _dispatch(self, lane: _Lane):
+        while lane.pending and lane.running < lane.concurrency:
+            entry = heapq.heappop(lane.pending)
+            if entry[3].cancelled():
+                continue
+            lane.running += 1
+            entry[3].set_result(None)
+
+    def cancel(self, task_id: str) -> int:
+        """Withdraws the task's waiting jobs and stops its running ones; returns how many jobs were withdrawn."""
+        withdrawn = 0
+        for lane in self.lanes.values():
+            for entry in list(lane.pending):
+                if entry[2] == task_id and not entry[3].done():
+                    entry[3].cancel()
+                    withdrawn += 1
+        # Running jobs stop at their next progress report or child process
+        procs.cancel(task_id)
+        return withdrawn
+
+    def position(self, task_id: str):
+        """1-based position of the task's waiting job within its lane, 0 if running/not queued."""
+        for lane in self.lanes.values():
+            for i, entry in enumerate(sorted(lane.pending)):
+                if entry[2] == task_id:
+                    return i + 1
+        return 0
+
+    def stats(self) -> dict:
+        return {
+            name: {"running": lane.running, "queued": len(lane.pending), "workers": lane.concurrency}
+            for name, lane in self.lanes.items()
+        }
@@ -0,0 +1,390 @@
+import hashlib
+import math
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+os.environ.setdefault("TORCHAUDIO_BACKEND", "soundfile")
+
+import numpy as np
+import soundfile as sf
+import torch
+import demucs.apply
+from demucs.apply import apply_model
+from demucs.audio import AudioFile
+from demucs.pretrained import get_model
+
+import procs
+from stems import STEM_FORMAT, pack_wavs, save_stems
+
+# Initialize model (loaded once on startup and kept warm)
+MODEL_NAME = "htdemucs"
+model = None
+
+# Streaming separation: seconds of audio per window, and seconds of context shared with each neighbour
+STREAM_WINDOW_SECONDS = float(os.environ.get("STREAM_WINDOW_SECONDS", "60"))
+STREAM_CONTEXT_SECONDS = float(os.environ.get("STREAM_CONTEXT_SECONDS", "2.5"))
+
+# Parallel separation: a pool of processes that each keep their own warm model.
+# 0 or 1 worker keeps separation in-process; tracks shorter than the minimum aren't worth splitting.
+SEPARATION_WORKERS = int(os.environ.get("SEPARATION_WORKERS", "0"))
+SEPARATION_THREADS_PER_WORKER = int(os.environ.get("SEPARATION_THREADS_PER_WORKER", "1"))
+PARALLEL_MIN_SECONDS = float(os.environ.get("PARALLEL_MIN_SECONDS", "30"))
+
+# Batch separation: tracks stacked into one tensor so each model segment is a single forward pass for all of them
+SEPARATION_BATCH_TRACKS = int(os.environ.get("SEPARATION_BATCH_TRACKS", "4"))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+class _ChunkProgress:
+    """
+    Stands in for the `tqdm` module inside demucs.apply. apply_model wraps its list of
+    segment futures in tqdm.tqdm when progress=True; we report each segment to the
+    callback registered by the calling thread instead of drawing a progress bar.
+    """
+    local = threading.local()
+
+    @classmethod
+    def tqdm(cls, iterable, **kwargs):
+        callback = getattr(cls.local, "callback", None)
+        items = list(iterable)
+        for i, item in enumerate(items):
+            if callback:
+                callback(i, len(items))
+            yield item
+        if callback:
+            callback(len(items), len(items))
+
+
+def load_separator():
+    global model
+    if model is None:
+        demucs.apply.tqdm = _ChunkProgress
+        model = get_model(MODEL_NAME)
+        model.eval()
+        # Move to GPU if available
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+        model.to(device)
+    return model
+
+
+def is_model_wav(path: str) -> bool:
+    """True if path is a float WAV already at the model's rate/channels (nothing left to decode)."""
+    load_separator()
+    try:
+        info = sf.info(path)
+    except Exception:
+        return False
+    return (info.format == "WAV" and info.subtype == "FLOAT"
+            and info.samplerate == model.samplerate and info.channels == model.audio_channels)
+
+
+def load_audio(input_file: str, duration: float = None):
+    """Decodes input_file at the model's sample rate/channels, optionally keeping only the first `duration` seconds."""
+    load_separator()
+    if is_model_wav(input_file):
+        # Canonical PCM from ingestion: read the samples directly instead of going through ffprobe/ffmpeg
+        frames = int(duration * model.samplerate) if duration else -1
+        data, _ = sf.read(input_file, frames=frames, dtype="float32", always_2d=True)
+        return torch.from_numpy(np.ascontiguousarray(data.T))
+    return AudioFile(input_file).read(
+        streams=0,
+        samplerate=model.samplerate,
+        channels=model.audio_channels,
+        duration=duration,
+    )
+
+
+def run_model(wav, segment: float = 6, shifts: int = 1, overlap: float = 0.1, progress=None):
+    """
+    Applies the model to an already normalized (channels, samples) waveform and returns
+    (sources, channels, samples). progress(done, total) is called as segments finish,
+    counted across all shift passes.
+    """
+    return run_model_batch([wav], segment, shifts, overlap, progress)[0]
+
+
+def run_model_batch(wavs, segment: float = 6, shifts: int = 1, overlap: float = 0.1, progress=None):
+    """
+    run_model for several normalized waveforms at once: they are zero-padded to the longest and
+    stacked, so every segment position runs through the model as one batched forward pass.
+    Returns one (sources, channels, samples) tensor per input.
+    """
+    load_separator()
+    device = next(model.parameters()).device
+
+    passes = max(1, shifts)
+    finished_passes = [0]
+
+    def on_chunk(done, total):
+        progress(finished_passes[0] * total + done, passes * total)
+        if done == total:
+            finished_passes[0] += 1
+
+    frames = max(wav.shape[-1] for wav in wavs)
+    batch = torch.stack([torch.nn.functional.pad(wav, (0, frames - wav.shape[-1])) for wav in wavs])
+    _ChunkProgress.local.callback = on_chunk if progress else None
+    try:
+        with torch.no_grad():
+            sources = apply_model(
+                model, batch, device=device, shifts=shifts, split=True,
+                overlap=overlap, progress=progress is not None, num_workers=0, segment=segment,
+            )
+    finally:
+        _ChunkProgress.local.callback = None
+    return [sources[i, ..., :wav.shape[-1]] for i, wav in enumerate(wavs)]
+
+
+def pick_stems(sources, two_stems: str = None, only=None) -> dict:
+    """
+    Names the model outputs; in two-stems mode everything but `two_stems` is summed into
+    no_{two_stems}. `only` restricts the result to the listed stem names (the rest is never written).
+    """
+    stems = dict(zip(model.sources, sources))
+    if two_stems:
+        other = sum(src for name, src in stems.items() if name != two_stems)
+        stems = {two_stems: stems[two_stems], f"no_{two_stems}": other}
+    if only:
+        stems = {name: src for name, src in stems.items() if name in only}
+    return stems
+
+
+def separate_waveform(wav, stems_dir: str, segment: float = 6, shifts: int = 1,
+                      overlap: float = 0.1, two_stems: str = None, progress=None, only=None):
+    """
+    Runs the warm htdemucs model on a decoded (channels, samples) waveform and stores the stems
+    in stems_dir (STEM_FORMAT). Mirrors what `demucs.separate` does for a single track.
+    """
+    ref = wav.mean(0)
+    wav = (wav - ref.mean()) / ref.std()
+    if parallel_enabled() and wav.shape[-1] >= PARALLEL_MIN_SECONDS * model.samplerate:
+        sources = run_model_parallel(wav, segment, shifts, overlap, progress)
+    else:
+        sources = run_model(wav, segment, shifts, overlap, progress)
+    sources = sources * ref.std() + ref.mean()
+
+    stems = {name: rescale_stem(src) for name, src in pick_stems(sources, two_stems, only).items()}
+    save_stems(stems_dir, stems, model.samplerate)
+    return {"status": "success", "stems_dir": stems_dir}
+
+
+def separate_waveforms(wavs, stems_dirs, segment: float = 6, shifts: int = 1,
+                       overlap: float = 0.1, two_stems: str = None, progress=None, only=None):
+    """
+    separate_waveform for several tracks in one batched model run; the stems of wavs[i] are
+    written into stems_dirs[i]. Tracks of similar length waste the least work on padding.
+    """
+    refs = [wav.mean(0) for wav in wavs]
+    normalized = [(wav - ref.mean()) / ref.std() for wav, ref in zip(wavs, refs)]
+    outputs = run_model_batch(normalized, segment, shifts, overlap, progress)
+    for sources, ref, stems_dir in zip(outputs, refs, stems_dirs):
+        sources = sources * ref.std() + ref.mean()
+        stems = {name: rescale_stem(src) for name, src in pick_stems(sources, two_stems, only).items()}
+        save_stems(stems_dir, stems, model.samplerate)
+    return [{"status": "success", "stems_dir": stems_dir} for stems_dir in stems_dirs]
+
+
+def parallel_enabled() -> bool:
+    return SEPARATION_WORKERS > 1
+
+
+def _init_worker(threads: int):
+    torch.set_num_threads(threads)
+    load_separator()
+
+
+def _run_window(chunk, segment, shifts, overlap):
+    return run_model(torch.from_numpy(chunk), segment, shifts, overlap).cpu().numpy()
+
+
+def get_pool() -> ProcessPoolExecutor:
+    """Starts the separation worker pool on first use (spawned, so no torch state is forked)."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=SEPARATION_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(SEPARATION_THREADS_PER_WORKER,),
+            )
+        return _pool
+
+
+def warm_pool():
+    """Makes every worker load its model now rather than on the first job."""
+    pool = get_pool()
+    for future in [pool.submit(math.sqrt, i) for i in range(SEPARATION_WORKERS)]:
+        future.result()
+
+
+def parallel_windows(frames: int, workers: int, context: int) -> list:
+    """
+    One window per worker for run_model_parallel, but never shorter than the 2 * context the
+    crossfades span (short tracks or many workers get fewer, longer windows).
+    """
+    workers = max(1, min(workers, frames // max(2 * context, 1)))
+    return list(stream_windows(frames, math.ceil(frames / workers), context))
+
+
+def stitch_windows(pieces, windows, frames: int):
+    """
+    Overlap-adds per-window outputs (..., read_end - read_start) back into (..., frames), with
+    linear crossfades wherever a window's context overlaps its neighbour.
+    """
+    out = None
+    weight = np.zeros(frames, dtype=np.float32)
+    for piece, (read_start, read_end, keep_start, keep_end) in zip(pieces, windows):
+        w = np.ones(read_end - read_start, dtype=np.float32)
+        rise = min((keep_start - read_start) * 2, len(w))
+        fall = min((read_end - keep_end) * 2, len(w))
+        if rise:
+            w[:rise] = np.linspace(0, 1, rise, endpoint=False, dtype=np.float32)
+        if fall:
+            w[len(w) - fall:] = np.minimum(w[len(w) - fall:], np.linspace(1, 0, fall, endpoint=False, dtype=np.float32))
+        if out is None:
+            out = np.zeros(piece.shape[:-1] + (frames,), dtype=np.float32)
+        out[..., read_start:read_end] += piece * w
+        weight[read_start:read_end] += w
+    return out / np.maximum(weight, 1e-8)
+
+
+def run_model_parallel(wav, segment: float = 6, shifts: int = 1, overlap: float = 0.1, progress=None):
+    """
+    Splits a normalized waveform into one overlapping window per worker, separates the windows
+    concurrently in the process pool and stitches the results with crossfades.
+    """
+    frames = wav.shape[-1]
+    windows = parallel_windows(frames, SEPARATION_WORKERS, int(STREAM_CONTEXT_SECONDS * model.samplerate))
+    chunks = wav.cpu().numpy()
+
+    pool = get_pool()
+    futures = {
+        pool.submit(_run_window, chunks[:, read_start:read_end], segment, shifts, overlap): i
+        for i, (read_start, read_end, _, _) in enumerate(windows)
+    }
+    pieces = [None] * len(windows)
+    for done, future in enumerate(as_completed(futures), 1):
+        pieces[futures[future]] = future.result()
+        if progress:
+            progress(done, len(windows))
+    return torch.from_numpy(stitch_windows(pieces, windows, frames))
+
+
+def decode_to_wav(input_file: str, output_path: str):
+    """Streams input_file through ffmpeg into a float WAV at the model's rate/channels (constant memory)."""
+    load_separator()
+    command = [
+        "ffmpeg", "-y", "-v", "error", "-i", input_file, "-map", "0:a:0",
+        "-ar", str(model.samplerate), "-ac", str(model.audio_channels),
+        "-c:a", "pcm_f32le", output_path,
+    ]
+    procs.run(command, "decode")
+    return output_path
+
+
+def scan_wav(path: str, block_seconds: float = 30):
+    """
+    One streaming pass over a decoded WAV: content hash of the samples plus the mean/std of the
+    mono mix, which demucs uses to normalize the whole track.
+    """
+    digest = hashlib.sha256()
+    total = 0.0
+    total_sq = 0.0
+    count = 0
+    with sf.SoundFile(path) as f:
+        for block in f.blocks(blocksize=int(block_seconds * f.samplerate), dtype="float32", always_2d=True):
+            # Hash channel-major like the in-memory (channels, samples) tensors
+            digest.update(np.ascontiguousarray(block.T).tobytes())
+            mono = block.mean(axis=1, dtype=np.float64)
+            total += mono.sum()
+            total_sq += np.square(mono).sum()
+            count += len(mono)
+    mean = total / max(count, 1)
+    std = max(np.sqrt(max(total_sq / max(count, 1) - mean ** 2, 0.0)), 1e-8)
+    return digest.hexdigest(), {"mean": mean, "std": std, "frames": count}
+
+
+def stream_windows(frames: int, window: int, context: int):
+    """(read_start, read_end, keep_start, keep_end) for overlapping windows covering [0, frames)."""
+    for start in range(0, frames, window):
+        end = min(start + window, frames)
+        yield max(0, start - context), min(frames, end + context), start, end
+
+
+def separate_stream(wav_path: str, stems_dir: str, ref_stats: dict, segment: float = 6, shifts: int = 1,
+                    overlap: float = 0.1, two_stems: str = None, progress=None, on_chunk=None, only=None,
+                    window_seconds: float = STREAM_WINDOW_SECONDS, context_seconds: float = STREAM_CONTEXT_SECONDS):
+    """
+    Separates a decoded WAV of any length in overlapping windows, so peak memory depends on the
+    window size rather than the track length. Neighbouring windows are blended with a linear
+    crossfade across their shared context, and every stem file is appended to (and flushed) as
+    each window finishes, so the start of the stems is readable while the rest is still running.
+    on_chunk(stems_dir, seconds_ready) is called after each flush.
+    """
+    load_separator()
+    sample_rate = model.samplerate
+    window = int(window_seconds * sample_rate)
+    context = int(context_seconds * sample_rate)
+    mean, std = ref_stats["mean"], ref_stats["std"]
+    os.makedirs(stems_dir, exist_ok=True)
+
+    writers = {}
+    tail = None  # previous window's stems over the region shared with the next window
+    written = 0
+    try:
+        with sf.SoundFile(wav_path) as f:
+            windows = list(stream_windows(f.frames, window, context))
+            for index, (read_start, read_end, keep_start, keep_end) in enumerate(windows):
+                f.seek(read_start)
+                chunk = torch.from_numpy(f.read(read_end - read_start, dtype="float32", always_2d=True).T.copy())
+                window_progress = (lambda d, t, i=index: progress(i * t + d, len(windows) * t)) if progress else None
+                sources = run_model((chunk - mean) / std, segment, shifts, overlap, window_progress)
+                stems = {name: (src * std + mean).cpu().numpy().T for name, src in pick_stems(sources, two_stems, only).items()}
+
+                # This window owns [keep_start, keep_end) plus its context; the part before keep_start
+                # overlaps the previous window's tail and gets crossfaded with it
+                head = written - read_start
+                out_end = keep_end if index == len(windows) - 1 else min(keep_end + context, read_end)
+                for name, data in stems.items():
+                    block = data[head:out_end - read_start]
+                    if tail is not None:
+                        fade = np.linspace(0.0, 1.0, len(tail[name]), endpoint=False, dtype=np.float32)[:, None]
+                        block = block.copy()
+                        block[:len(fade)] = tail[name] * (1 - fade) + block[:len(fade)] * fade
+                    if name not in writers:
+                        writers[name] = sf.SoundFile(os.path.join(stems_dir, f"{name}.wav"), "w", sample_rate,
+                                                     block.shape[1], subtype="PCM_16")
+                    # Hold back the trailing context so the next window can fade into it
+                    hold = 0 if index == len(windows) - 1 else out_end - windows[index + 1][0]
+                    writers[name].write(np.clip(block[:len(block) - hold], -1, 1))
+                    writers[name].flush()
+                    stems[name] = block[len(block) - hold:] if hold else None
+                advanced = out_end - written - hold
+                written += advanced
+                tail = stems if hold else None
+                if on_chunk:
+                    on_chunk(stems_dir, written / sample_rate)
+    except Exception:
+        # Cancelled or failed part way: don't leave truncated stems behind
+        for writer in writers.values():
+            writer.close()
+            os.remove(writer.name)
+        raise
+    finally:
+        for writer in writers.values():
+            writer.close()
+
+    if STEM_FORMAT == "pack":
+        # The WAVs were only needed while the stems were growing
+        pack_wavs(stems_dir)
+    return {"status": "success", "stems_dir": stems_dir}
+
+
+def rescale_stem(src):
+    """(channels, frames) numpy copy of a stem, clipped the way demucs does by default (--clip-mode rescale)."""
+    peak = src.abs().max().item()
+    return (src / max(1.01 * peak, 1)).cpu().numpy()
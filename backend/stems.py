@@ -0,0 +1,237 @@
+"""
+Stem packs: every stem of a track in one file, readable with zero-copy memory maps.
+
+Layout: MAGIC, a little-endian uint32 header length and a JSON header (sample rate, frames,
+channels, sample dtype and per-stem peak/RMS), then - from the next ALIGN boundary - the
+samples stored planar, (stems, channels, frames). One stem, channel or time range is a slice
+of the map, so reading a few seconds of one stem touches only those pages.
+
+Stems keep their usual addresses: <stems_dir>/<name>.wav resolves to the pack when no WAV
+file exists, and export_wav writes the WAV on demand for consumers that need a real file.
+"""
+import json
+import os
+import struct
+import uuid
+
+import numpy as np
+import soundfile as sf
+
+# "pack" stores new separations as one stem pack, "wav" as one 16-bit WAV per stem
+STEM_FORMAT = os.environ.get("STEM_FORMAT", "pack")
+# Sample storage inside packs: int16 (same size/quality as the WAVs), float16 or float32
+STEM_DTYPE = os.environ.get("STEM_DTYPE", "int16")
+PACK_NAME = "stems.pack"
+MAGIC = b"STEMPACK"
+ALIGN = 4096
+DTYPES = {"int16": np.int16, "float16": np.float16, "float32": np.float32}
+INT16_SCALE = 32768.0  # same scaling soundfile uses for PCM_16
+
+
+def _to_stored(samples, dtype: str):
+    if dtype == "int16":
+        return np.clip(np.round(samples * INT16_SCALE), -32768, 32767).astype(np.int16)
+    return samples.astype(DTYPES[dtype])
+
+
+def _to_float(stored):
+    if stored.dtype == np.int16:
+        return stored.astype(np.float32) / np.float32(INT16_SCALE)
+    return stored.astype(np.float32)
+
+
+class StemPack:
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not a stem pack")
+            (length,) = struct.unpack("<I", f.read(4))
+            header = json.loads(f.read(length))
+        self.sample_rate = header["sample_rate"]
+        self.frames = header["frames"]
+        self.channels = header["channels"]
+        self.dtype = header["dtype"]
+        self.stems = {stem["name"]: stem for stem in header["stems"]}
+        self.names = [stem["name"] for stem in header["stems"]]
+        self._data = np.memmap(path, dtype=DTYPES[self.dtype], mode="r", offset=len(MAGIC) + 4 + length,
+                               shape=(len(self.names), self.channels, self.frames))
+
+    def raw(self, name: str, start: int = 0, end: int = None):
+        """Zero-copy (channels, frames) view of the stored samples of one stem."""
+        return self._data[self.names.index(name), :, start:end]
+
+    def read(self, name: str, start: int = 0, end: int = None):
+        """float32 (frames, channels) samples of one stem, decoded for the requested range only."""
+        return np.ascontiguousarray(_to_float(self.raw(name, start, end)).T)
+
+
+def _header(meta: dict, entries: list, length: int = None) -> bytes:
+    """
+    MAGIC + length + JSON, space-padded so the samples start on an ALIGN boundary (or to an
+    existing header's length, so stats can be rewritten in place).
+    """
+    blob = json.dumps({"version": 1, **meta, "layout": "planar", "stems": entries}).encode()
+    if length is None:
+        length = -(-(len(MAGIC) + 4 + len(blob)) // ALIGN) * ALIGN - len(MAGIC) - 4
+    if len(blob) > length:
+        raise ValueError("stem pack header does not fit its reserved space")
+    return MAGIC + struct.pack("<I", length) + blob.ljust(length)
+
+
+def _stats(peak: float, energy: float, count: int) -> dict:
+    return {"peak": round(peak, 6), "rms": round((energy / max(count, 1)) ** 0.5, 6)}
+
+
+def _write(path: str, meta: dict, entries: list, fill):
+    """Writes header + zeroed planar samples to a temporary file, lets fill(memmap) store the samples, then publishes it."""
+    header = _header(meta, entries)
+    shape = (len(entries), meta["channels"], meta["frames"])
+    tmp_path = f"{path}.tmp-{uuid.uuid4().hex[:8]}"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(header)
+            f.truncate(len(header) + int(np.prod(shape)) * np.dtype(DTYPES[meta["dtype"]]).itemsize)
+        if meta["frames"]:
+            data = np.memmap(tmp_path, dtype=DTYPES[meta["dtype"]], mode="r+", offset=len(header), shape=shape)
+            fill(data)
+            data.flush()
+            del data
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def write_pack(path: str, stems: dict, sample_rate: int, dtype: str = STEM_DTYPE):
+    """Writes {name: (channels, frames) float array} as a stem pack (atomically replacing path)."""
+    stems = {name: np.asarray(samples, dtype=np.float32) for name, samples in stems.items()}
+    channels, frames = next(iter(stems.values())).shape
+    meta = {"sample_rate": sample_rate, "frames": frames, "channels": channels, "dtype": dtype}
+    entries = [
+        {"name": name, **_stats(float(np.abs(samples).max()) if samples.size else 0.0,
+                                float(np.square(samples, dtype=np.float64).sum()), samples.size)}
+        for name, samples in stems.items()
+    ]
+
+    def fill(data):
+        for i, samples in enumerate(stems.values()):
+            data[i] = _to_stored(samples, dtype)
+
+    _write(path, meta, entries, fill)
+
+
+def pack_wavs(stems_dir: str, dtype: str = STEM_DTYPE, block_frames: int = 1 << 20):
+    """
+    Converts the per-stem WAVs in stems_dir into a stem pack, block by block so long tracks
+    never sit in memory, then removes the WAVs. 16-bit WAVs go into an int16 pack losslessly.
+    """
+    paths = sorted(os.path.join(stems_dir, name) for name in os.listdir(stems_dir) if name.endswith(".wav"))
+    if not paths:
+        return None
+    infos = [sf.info(path) for path in paths]
+    meta = {"sample_rate": infos[0].samplerate, "frames": max(info.frames for info in infos),
+            "channels": infos[0].channels, "dtype": dtype}
+    # Peak/RMS are only known after the copy; they are rewritten into the header's ALIGN padding
+    entries = [{"name": os.path.splitext(os.path.basename(path))[0], "peak": 0.0, "rms": 0.0} for path in paths]
+    read_dtype = "int16" if dtype == "int16" else "float32"
+
+    def fill(data):
+        for i, path in enumerate(paths):
+            peak, energy, start = 0.0, 0.0, 0
+            with sf.SoundFile(path) as f:
+                for block in f.blocks(blocksize=block_frames, dtype=read_dtype, always_2d=True):
+                    samples = _to_float(block) if read_dtype == "int16" else block
+                    data[i, :, start:start + len(block)] = block.T if read_dtype == dtype else _to_stored(block.T, dtype)
+                    peak = max(peak, float(np.abs(samples).max()) if samples.size else 0.0)
+                    energy += float(np.square(samples, dtype=np.float64).sum())
+                    start += len(block)
+            entries[i] = {"name": entries[i]["name"], **_stats(peak, energy, meta["frames"] * meta["channels"])}
+
+    path = os.path.join(stems_dir, PACK_NAME)
+    _write(path, meta, entries, fill)
+    with open(path, "r+b") as f:
+        f.seek(len(MAGIC))
+        (length,) = struct.unpack("<I", f.read(4))
+        f.seek(0)
+        f.write(_header(meta, entries, length))
+    for wav in paths:
+        os.remove(wav)
+    return path
+
+
+def save_stems(stems_dir: str, stems: dict, sample_rate: int):
+    """Stores {name: (channels, frames) float array} in STEM_FORMAT."""
+    os.makedirs(stems_dir, exist_ok=True)
+    if STEM_FORMAT == "pack":
+        write_pack(os.path.join(stems_dir, PACK_NAME), stems, sample_rate)
+        return
+    for name, samples in stems.items():
+        sf.write(os.path.join(stems_dir, f"{name}.wav"), np.asarray(samples).T, sample_rate, subtype="PCM_16")
+
+
+def open_pack(stems_dir: str):
+    path = os.path.join(stems_dir, PACK_NAME)
+    return StemPack(path) if os.path.exists(path) else None
+
+
+def locate(path: str):
+    """
+    (file, stem) holding the stem addressed by <stems_dir>/<name>.wav: the WAV itself (stem None)
+    when it exists, otherwise the directory's stem pack. Raises FileNotFoundError.
+    """
+    if os.path.exists(path):
+        return path, None
+    pack = os.path.join(os.path.dirname(path), PACK_NAME)
+    name = os.path.splitext(os.path.basename(path))[0]
+    if path.endswith(".wav") and os.path.exists(pack) and name in StemPack(pack).names:
+        return pack, name
+    raise FileNotFoundError(path)
+
+
+def has_stem(path: str) -> bool:
+    try:
+        locate(path)
+        return True
+    except (FileNotFoundError, ValueError):
+        return False
+
+
+def stem_names(stems_dir: str) -> list:
+    """Names of the stems in stems_dir, whether packed or stored as WAVs."""
+    pack = open_pack(stems_dir)
+    names = list(pack.names) if pack else []
+    names += [name[:-4] for name in sorted(os.listdir(stems_dir)) if name.endswith(".wav") and name[:-4] not in names]
+    return names
+
+
+def read_stem(path: str, start: int = 0, end: int = None):
+    """float32 (frames, channels) and sample rate of a stem addressed like locate()."""
+    source, name = locate(path)
+    if name is None:
+        data, sample_rate = sf.read(source, start=start, stop=end, dtype="float32", always_2d=True)
+        return data, sample_rate
+    pack = StemPack(source)
+    return pack.read(name, start, end), pack.sample_rate
+
+
+def export_wav(path: str) -> str:
+    """Makes <stems_dir>/<name>.wav a real 16-bit WAV file (written from the pack if needed) and returns it."""
+    source, name = locate(path)
+    if name is None:
+        return path
+    pack = StemPack(source)
+    tmp_path = f"{path}.tmp-{uuid.uuid4().hex[:8]}.wav"
+    try:
+        raw = pack.raw(name)
+        if raw.dtype == np.int16:
+            sf.write(tmp_path, np.ascontiguousarray(raw.T), pack.sample_rate, subtype="PCM_16")
+        else:
+            sf.write(tmp_path, pack.read(name), pack.sample_rate, subtype="PCM_16")
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return path
@@ -0,0 +1,188 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# How long a task is kept after its last update
+TASK_TTL_SECONDS = float(os.environ.get("TASK_TTL_SECONDS", str(6 * 3600)))
+# Upper bound for the in-memory backend
+TASK_MAX_ENTRIES = int(os.environ.get("TASK_MAX_ENTRIES", "10000"))
+
+
+class TaskStore:
+    """
+    Task status records keyed by task_id. Records are plain JSON-serializable dicts,
+    expire TASK_TTL_SECONDS after their last write, and listeners are called with the
+    task_id after every write (used to push progress to clients).
+    """
+
+    def __init__(self, ttl: float = TASK_TTL_SECONDS):
+        self.ttl = ttl
+        self._listeners = []
+
+    def get(self, task_id: str, default=None):
+        raise NotImplementedError
+
+    def set(self, task_id: str, record: dict):
+        raise NotImplementedError
+
+    def delete(self, task_id: str):
+        raise NotImplementedError
+
+    def update(self, task_id: str, **fields):
+        """Merges fields into an existing record (no-op if the task is gone)."""
+        self.modify(task_id, lambda record: record.update(fields))
+
+    def modify(self, task_id: str, fn):
+        """Lets fn change an existing record in place, then stores it (no-op if the task is gone)."""
+        record = self.get(task_id)
+        if record is None:
+            return
+        fn(record)
+        self.set(task_id, record)
+
+    def add_listener(self, fn):
+        self._listeners.append(fn)
+
+    def _notify(self, task_id: str):
+        for fn in self._listeners:
+            try:
+                fn(task_id)
+            except Exception as e:
+                print(f"Task listener error: {e}")
+
+
+class MemoryTaskStore(TaskStore):
+    def __init__(self, ttl: float = TASK_TTL_SECONDS, max_entries: int = TASK_MAX_ENTRIES):
+        super().__init__(ttl)
+        self.max_entries = max_entries
+        self._data = OrderedDict()  # task_id -> (expires_at, record), oldest write first
+        self._lock = threading.Lock()
+
+    def get(self, task_id: str, default=None):
+        with self._lock:
+            record = self._read(task_id)
+        return default if record is None else record
+
+    def set(self, task_id: str, record: dict):
+        with self._lock:
+            self._write(task_id, record)
+        self._notify(task_id)
+
+    def modify(self, task_id: str, fn):
+        # One lock across read, change and write, so concurrent updates can't drop each other's fields
+        with self._lock:
+            record = self._read(task_id)
+            if record is None:
+                return
+            fn(record)
+            self._write(task_id, record)
+        self._notify(task_id)
+
+    def _read(self, task_id: str):
+        item = self._data.get(task_id)
+        if item is None:
+            return None
+        if item[0] < time.time():
+            del self._data[task_id]
+            return None
+        return dict(item[1])
+
+    def _write(self, task_id: str, record: dict):
+        self._data.pop(task_id, None)
+        self._data[task_id] = (time.time() + self.ttl, dict(record))
+        self._prune()
+
+    def delete(self, task_id: str):
+        with self._lock:
+            self._data.pop(task_id, None)
+
+    def _prune(self):
+        now = time.time()
+        while self._data:
+            task_id, (expires_at, _) = next(iter(self._data.items()))
+            if expires_at >= now and len(self._data) <= self.max_entries:
+                break
+            del self._data[task_id]
+
+
+class SQLiteTaskStore(TaskStore):
+    """Shared by every worker process pointing at the same database file."""
+
+    PURGE_EVERY = 100
+
+    def __init__(self, path: str, ttl: float = TASK_TTL_SECONDS):
+        super().__init__(ttl)
+        self.path = path
+        self._local = threading.local()
+        self._writes = 0
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS tasks ("
+            "task_id TEXT PRIMARY KEY, data TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS tasks_expires ON tasks (expires_at)")
+        conn.commit()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            self._local.conn = conn
+        return conn
+
+    def get(self, task_id: str, default=None):
+        row = self._conn().execute(
+            "SELECT data FROM tasks WHERE task_id = ? AND expires_at >= ?", (task_id, time.time())
+        ).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set(self, task_id: str, record: dict):
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO tasks (task_id, data, expires_at) VALUES (?, ?, ?)",
+            (task_id, json.dumps(record), time.time() + self.ttl),
+        )
+        self._writes += 1
+        if self._writes % self.PURGE_EVERY == 0:
+            conn.execute("DELETE FROM tasks WHERE expires_at < ?", (time.time(),))
+        conn.commit()
+        self._notify(task_id)
+
+    def modify(self, task_id: str, fn):
+        # Read-modify-write inside one transaction so concurrent writers don't drop fields
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT data FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+            if row is None:
+                conn.rollback()
+                return
+            record = json.loads(row[0])
+            fn(record)
+            conn.execute(
+                "UPDATE tasks SET data = ?, expires_at = ? WHERE task_id = ?",
+                (json.dumps(record), time.time() + self.ttl, task_id),
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        self._notify(task_id)
+
+    def delete(self, task_id: str):
+        conn = self._conn()
+        conn.execute("DELETE FROM tasks WHERE task_id = ?", (task_id,))
+        conn.commit()
+
+
+def create_task_store(processed_dir: str, default: str = "memory") -> TaskStore:
+    """Picks the backend from TASK_STORE ("memory" or "sqlite"; sqlite is needed for multiple workers)."""
+    backend = os.environ.get("TASK_STORE", default).lower()
+    if backend == "sqlite":
+        path = os.environ.get("TASK_DB_PATH", os.path.join(processed_dir, "tasks.db"))
+        return SQLiteTaskStore(path)
+    return MemoryTaskStore()
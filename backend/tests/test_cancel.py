@@ -0,0 +1,98 @@
+import os
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("transformers")
+os.environ["WARMUP_STEPS"] = ""  # no model loading for the API under test
+
+from fastapi.testclient import TestClient
+
+import generate
+import main
+import procs
+
+
+class SlowGeneration:
+    """Stands in for generate_cached: runs until released, stopping at cancellation points like the real one."""
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.calls = 0
+        self.outcome = None
+
+    def __call__(self, full_prompt, output_dir, params, progress=None):
+        self.calls += 1
+        try:
+            while not self.release.wait(0.01):
+                procs.check_cancelled()
+        except procs.Cancelled:
+            self.outcome = "cancelled"
+            raise
+        self.outcome = "finished"
+        return {"status": "success", "file": "generated/shared.wav", "cached": False}
+
+
+class EmptyStore:
+    def get(self, name):
+        return None
+
+
+@pytest.fixture
+def client(monkeypatch):
+    generation = SlowGeneration()
+    monkeypatch.setattr(generate, "generate_cached", generation)
+    monkeypatch.setattr(generate, "get_generation_store", lambda output_dir: EmptyStore())
+    with TestClient(main.app) as client:
+        client.generation = generation
+        yield client
+    generation.release.set()
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def start_generation(client):
+    response = client.post("/api/generate", params={"mood": "calm", "genre": "Jazz", "language": "English", "seed": 5})
+    assert response.status_code == 200
+    return response.json()["task_id"]
+
+
+def status(client, task_id):
+    return client.get(f"/api/task-status/{task_id}").json()["status"]
+
+
+def test_cancelling_one_waiter_keeps_the_shared_generation(client):
+    first, second = start_generation(client), start_generation(client)
+    assert wait_for(lambda: client.generation.calls == 1)
+
+    response = client.delete(f"/api/task/{first}")
+    assert response.json()["status"] == "cancelled"
+    assert status(client, first) == "cancelled"
+    assert status(client, second) == "processing"
+
+    client.generation.release.set()
+    assert wait_for(lambda: status(client, second) == "completed")
+    assert client.generation.outcome == "finished"
+    assert status(client, first) == "cancelled"
+
+
+def test_last_waiter_cancelling_stops_the_shared_generation(client):
+    first, second = start_generation(client), start_generation(client)
+    assert wait_for(lambda: client.generation.calls == 1)
+
+    client.delete(f"/api/task/{second}")
+    time.sleep(0.1)
+    assert client.generation.outcome is None
+    client.delete(f"/api/task/{first}")
+
+    assert wait_for(lambda: client.generation.outcome == "cancelled")
+    assert status(client, first) == "cancelled" and status(client, second) == "cancelled"
+    assert wait_for(lambda: not main.inflight_generations and not main.generation_waiters)
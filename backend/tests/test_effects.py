@@ -0,0 +1,72 @@
+import shutil
+import subprocess
+
+import numpy as np
+import pytest
+import soundfile as sf
+
+import effects
+from effects import GENRE_PRESETS, MOOD_PRESETS, apply_chain, parse_filter, preset_filters
+from benchmarks.fixtures import SAMPLE_RATE, STEMS, synth_stem
+
+PRESETS = {f"mood:{k}": v for k, v in MOOD_PRESETS.items()}
+PRESETS.update({f"genre:{k}": v for k, v in GENRE_PRESETS.items()})
+# Same bar as the effects_parity benchmark
+MIN_SNR_DB = 20
+
+
+@pytest.fixture(scope="module")
+def audio():
+    return (sum(synth_stem(name, 4) for name in STEMS) / 2).astype(np.float32)
+
+
+@pytest.mark.parametrize("name", sorted(PRESETS))
+def test_chain_keeps_length_and_stays_finite(audio, name):
+    out = apply_chain(audio, SAMPLE_RATE, PRESETS[name])
+    assert out.shape == audio.shape
+    assert out.dtype == np.float32
+    assert np.all(np.isfinite(out))
+
+
+@pytest.mark.parametrize("name", sorted(PRESETS))
+def test_chain_does_not_depend_on_block_size(audio, name):
+    whole = apply_chain(audio, SAMPLE_RATE, PRESETS[name], block_frames=len(audio))
+    for block_frames in (effects.BLOCK_FRAMES, 4096, 1000, 257):
+        blocked = apply_chain(audio, SAMPLE_RATE, PRESETS[name], block_frames=block_frames)
+        np.testing.assert_allclose(blocked, whole, atol=1e-5, err_msg=f"block_frames={block_frames}")
+
+
+def test_relaxed_bass_cut_is_a_gain_not_a_frequency():
+    # 'bass=-2' would be read positionally as f=-2; the preset means a -2 dB low shelf
+    assert 'bass=g=-2' in MOOD_PRESETS['relaxed']
+    assert 'bass=-2' not in MOOD_PRESETS['relaxed']
+    name, options = parse_filter('bass=g=-2')
+    assert name == 'bass' and options == {'g': '-2'}
+    assert preset_filters('Relaxed') == MOOD_PRESETS['relaxed']
+
+
+def test_relaxed_bass_shelf_cuts_low_end_only():
+    t = np.arange(SAMPLE_RATE) / SAMPLE_RATE
+    tones = {freq: np.stack([np.sin(2 * np.pi * freq * t)] * 2, axis=1).astype(np.float32) for freq in (40, 5000)}
+    gains = {}
+    for freq, tone in tones.items():
+        out = apply_chain(tone, SAMPLE_RATE, ['bass=g=-2'])
+        gains[freq] = 20 * np.log10(np.sqrt(np.mean(out[SAMPLE_RATE // 2:] ** 2)) / np.sqrt(np.mean(tone[SAMPLE_RATE // 2:] ** 2)))
+    assert gains[40] == pytest.approx(-2, abs=0.3)
+    assert gains[5000] == pytest.approx(0, abs=0.1)
+
+
+@pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="ffmpeg not installed")
+@pytest.mark.parametrize("name", sorted(PRESETS))
+def test_chain_matches_ffmpeg(tmp_path, audio, name):
+    source = tmp_path / "parity.wav"
+    sf.write(source, audio, SAMPLE_RATE, subtype="FLOAT")
+    command = ["ffmpeg", "-v", "error", "-i", str(source), "-af", ",".join(PRESETS[name]),
+               "-f", "f32le", "-ac", "2", "-ar", str(SAMPLE_RATE), "-"]
+    result = subprocess.run(command, capture_output=True, check=True)
+    reference = np.frombuffer(result.stdout, dtype=np.float32).reshape(-1, 2)
+    native = apply_chain(audio, SAMPLE_RATE, PRESETS[name])
+    assert len(native) == len(reference)
+    noise = np.sum((reference - native) ** 2)
+    snr = 10 * np.log10(np.sum(reference ** 2) / noise) if noise > 0 else np.inf
+    assert snr >= MIN_SNR_DB
@@ -0,0 +1,129 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+os.environ["WARMUP_STEPS"] = ""  # no model loading for the API under test
+
+from fastapi.testclient import TestClient
+
+import generate
+import main
+from benchmarks.standins import tiny_musicgen
+
+
+@pytest.fixture
+def tiny_model(monkeypatch, tmp_path):
+    torch.manual_seed(0)
+    processor, model = tiny_musicgen()
+    monkeypatch.setattr(generate, "processor", processor)
+    monkeypatch.setattr(generate, "model", model)
+    return model
+
+
+def test_seeded_generation_repeats_and_leaves_global_rng_alone(tiny_model):
+    params = generate.generation_params(1, seed=7)
+    state = torch.get_rng_state()
+    first = generate.batcher.submit("calm piano", **params)
+    assert torch.equal(torch.get_rng_state(), state)
+    torch.rand(100)  # other work drawing from the global generator in between
+    second = generate.batcher.submit("calm piano", **params)
+    np.testing.assert_array_equal(first, second)
+
+
+def test_streams_run_on_the_batcher_one_generate_at_a_time(tiny_model, monkeypatch, tmp_path):
+    active, calls = [0], []
+    lock = threading.Lock()
+    real_generate = tiny_model.generate
+
+    def tracked_generate(*args, **kwargs):
+        with lock:
+            active[0] += 1
+            calls.append((threading.current_thread().name, active[0]))
+        try:
+            return real_generate(*args, **kwargs)
+        finally:
+            with lock:
+                active[0] -= 1
+
+    monkeypatch.setattr(tiny_model, "generate", tracked_generate)
+    params = generate.generation_params(1, seed=3)
+    chunks = []
+    with ThreadPoolExecutor(4) as pool:
+        streams = [pool.submit(generate.stream_cached, f"stream {i}", str(tmp_path), params,
+                               lambda values, rate: chunks.append(values)) for i in range(2)]
+        batched = [pool.submit(generate.batcher.submit, f"batch {i}", **params) for i in range(2)]
+        results = [f.result() for f in streams + batched]
+    assert all(name == "musicgen-batcher" and concurrent == 1 for name, concurrent in calls)
+    assert all((tmp_path / r["file"]).exists() for r in results[:2])
+    assert chunks
+
+
+def test_stream_is_reproducible_for_a_seed(tiny_model, tmp_path):
+    params = generate.generation_params(1, seed=11)
+    runs = []
+    for _ in range(2):
+        chunks = []
+        generate.stream_cached("lofi beat", str(tmp_path), params, lambda values, rate: chunks.append(values))
+        runs.append(np.concatenate(chunks))
+        torch.rand(100)
+    np.testing.assert_array_equal(runs[0], runs[1])
+
+
+@pytest.mark.parametrize("path", ["/api/generate", "/api/generate/stream"])
+@pytest.mark.parametrize("duration", ["nan", "inf", "-inf", "0", "-2"])
+def test_generate_endpoints_reject_invalid_duration(path, duration):
+    client = TestClient(main.app)
+    params = {"mood": "calm", "genre": "Jazz", "language": "English", "duration": duration}
+    response = client.post(path, params=params) if path == "/api/generate" else client.get(path, params=params)
+    assert response.status_code == 422
+
+
+@pytest.mark.parametrize("duration", [float("nan"), float("inf")])
+def test_generation_params_rejects_non_finite_duration(duration):
+    with pytest.raises(ValueError):
+        generate.generation_params(duration)
+
+
+def submit_together(batcher, requests):
+    with ThreadPoolExecutor(len(requests)) as pool:
+        futures = [pool.submit(batcher.submit, prompt, **params) for prompt, params in requests]
+        return [f.result() for f in futures]
+
+
+def test_seeded_audio_does_not_depend_on_batch_mates(tiny_model):
+    batcher = generate.GenerationBatcher(max_batch=4, window_ms=300)
+    params = generate.generation_params(1, seed=7)
+    alone = batcher.submit("calm piano", **params)
+    together = submit_together(batcher, [("calm piano", params), ("loud drums", params), ("soft strings", params)])
+    np.testing.assert_array_equal(together[0], alone)
+    assert batcher.stats["batch_sizes"] == {1: 4}
+
+
+def test_unseeded_requests_share_a_batch(tiny_model):
+    batcher = generate.GenerationBatcher(max_batch=4, window_ms=300)
+    params = generate.generation_params(1, seed=None)
+    results = submit_together(batcher, [(prompt, params) for prompt in ("a", "b", "c")])
+    assert len(results) == 3
+    assert batcher.stats["batch_sizes"] == {3: 1}
+
+
+def test_held_requests_batch_together_without_another_window():
+    batcher = generate.GenerationBatcher(max_batch=4, window_ms=300)
+    other = (250, 3.0, None)
+    requests = [generate._Request("a", (50, 3.0, None), None)] + [generate._Request(p, other, None) for p in "bcd"]
+    for request in requests:
+        batcher.queue.put(request)
+    assert batcher._collect() == requests[:1]
+    assert len(batcher.held) == 3
+
+    started = time.monotonic()
+    assert batcher._collect() == requests[1:]
+    assert time.monotonic() - started < 0.1
+    assert batcher.held == []
@@ -0,0 +1,69 @@
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+import soundfile as sf
+
+os.environ["WARMUP_STEPS"] = ""  # no model loading for the API under test
+
+from fastapi.testclient import TestClient
+
+import main
+import mixer
+
+
+@pytest.fixture
+def sources(tmp_path):
+    rng = np.random.default_rng(0)
+    paths = []
+    for name in ("vocals", "drums"):
+        path = tmp_path / "stems" / f"{name}.wav"
+        path.parent.mkdir(exist_ok=True)
+        sf.write(path, rng.uniform(-0.3, 0.3, (5 * 44100, 2)).astype(np.float32), 44100)
+        paths.append((str(path), 1.0))
+    return paths
+
+
+def preview_files(output_dir):
+    root = os.path.join(output_dir, "previews")
+    return [name for name in os.listdir(root) if name.endswith(".ogg")] if os.path.isdir(root) else []
+
+
+@pytest.mark.parametrize("window", [
+    {"start": -1.0, "duration": 2.0},
+    {"start": float("nan"), "duration": 2.0},
+    {"start": 0.0, "duration": 0.0},
+    {"start": 0.0, "duration": -3.0},
+    {"start": 0.0, "duration": mixer.PREVIEW_MAX_SECONDS + 1},
+])
+def test_invalid_preview_window_is_rejected_before_rendering(tmp_path, sources, window):
+    result = mixer.mix_preview(sources, str(tmp_path / "out"), "happy", None, **window)
+    assert result["status"] == "error"
+    assert preview_files(tmp_path / "out") == []
+
+
+def test_preview_renders_and_reuses_the_clip(tmp_path, sources):
+    first = mixer.mix_preview(sources, str(tmp_path / "out"), "happy", None, start=1.0, duration=2.0)
+    again = mixer.mix_preview(sources, str(tmp_path / "out"), "happy", None, start=1.0, duration=2.0)
+    assert first["status"] == "success" and not first["cached"]
+    assert again == {**first, "cached": True}
+    assert len(preview_files(tmp_path / "out")) == 1
+
+
+@pytest.mark.parametrize("window", [{"start": -1}, {"duration": 0}, {"duration": -5}, {"duration": mixer.PREVIEW_MAX_SECONDS + 1}])
+def test_mix_preview_endpoint_validates_window(window):
+    response = TestClient(main.app).post("/api/mix-preview", json={"stems_dir": "missing", "volumes": {}, **window})
+    assert response.status_code == 422
+
+
+def test_preview_limit_matches_mixer():
+    assert main.PREVIEW_MAX_SECONDS == mixer.PREVIEW_MAX_SECONDS
+
+
+def test_importing_main_leaves_mixer_for_later():
+    # The API module stays light; mixer (numpy, scipy, soundfile) loads with the first mix
+    code = "import sys, main; sys.exit(int('mixer' in sys.modules or 'numpy' in sys.modules))"
+    backend = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    assert subprocess.run([sys.executable, "-c", code], cwd=backend, env={**os.environ, "WARMUP_STEPS": ""}).returncode == 0
@@ -0,0 +1,68 @@
+import asyncio
+import threading
+
+import pytest
+
+from scheduler import JobScheduler
+
+
+def run(coro):
+    return asyncio.run(asyncio.wait_for(coro, 10))
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_cancel_right_after_dispatch_returns_the_worker_slot():
+    async def scenario():
+        scheduler = JobScheduler({"mix": 1})
+        lane = scheduler.lanes["mix"]
+        release = threading.Event()
+        first = scheduler.submit("mix", release.wait)
+        second = scheduler.submit("mix", lambda: "second")
+        assert lane.running == 1 and len(lane.pending) == 1
+        # Cancel `second` the moment it is dispatched (its start gate resolves), before it resumes
+        gate = lane.pending[0][3]
+        gate.add_done_callback(lambda _: second.cancel())
+        release.set()
+        await first
+        with pytest.raises(asyncio.CancelledError):
+            await second
+        await settle()
+        assert lane.running == 0
+        assert await scheduler.submit("mix", lambda: "third") == "third"
+
+    run(scenario())
+
+
+def test_cancel_before_the_job_starts_returns_the_worker_slot():
+    async def scenario():
+        scheduler = JobScheduler({"mix": 1})
+        job = scheduler.submit("mix", lambda: "never")
+        job.cancel()
+        await settle()
+        assert scheduler.lanes["mix"].running == 0
+        assert await scheduler.submit("mix", lambda: "next") == "next"
+
+    run(scenario())
+
+
+def test_withdrawn_job_leaves_the_queue():
+    async def scenario():
+        scheduler = JobScheduler({"mix": 1})
+        release = threading.Event()
+        running = scheduler.submit("mix", release.wait)
+        waiting = scheduler.submit("mix", lambda: "waiting", task_id="t")
+        assert scheduler.cancel("t") == 1
+        await settle()
+        assert scheduler.queued() == 0
+        release.set()
+        await running
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+        await settle()
+        assert scheduler.lanes["mix"].running == 0
+
+    run(scenario())
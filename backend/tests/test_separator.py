@@ -0,0 +1,114 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("demucs")
+
+import procs
+import separator
+from benchmarks.standins import TinySeparator
+
+WORKER_COUNTS = [2, 3, 4, 7, 16, 32, 64]
+
+
+@pytest.mark.parametrize("workers", WORKER_COUNTS)
+@pytest.mark.parametrize("frames", [1000, 30 * 44100, 30 * 44100 + 17])
+def test_parallel_windows_cover_track_with_room_for_crossfades(frames, workers):
+    context = int(separator.STREAM_CONTEXT_SECONDS * 44100)
+    windows = separator.parallel_windows(frames, workers, context)
+    assert windows[0][2] == 0 and windows[-1][3] == frames
+    assert all(a[3] == b[2] for a, b in zip(windows, windows[1:]))
+    if len(windows) > 1:
+        assert all(keep_end - keep_start >= 2 * context for _, _, keep_start, keep_end in windows[:-1])
+
+
+@pytest.mark.parametrize("workers", WORKER_COUNTS)
+def test_stitch_reassembles_pointwise_output_exactly(workers):
+    # Short windows (many workers, long context) used to break the crossfade shapes
+    frames, context = 30 * 441, 2 * 441
+    signal = np.random.default_rng(0).standard_normal((4, 2, frames)).astype(np.float32)
+    for windows in (separator.parallel_windows(frames, workers, context),
+                    list(separator.stream_windows(frames, max(1, frames // workers), context))):
+        pieces = [signal[..., read_start:read_end] for read_start, read_end, _, _ in windows]
+        np.testing.assert_allclose(separator.stitch_windows(pieces, windows, frames), signal, atol=1e-5)
+
+
+@pytest.fixture
+def tiny_model(monkeypatch):
+    torch.manual_seed(0)
+    monkeypatch.setattr(separator, "model", TinySeparator().eval())
+    # Windows run in threads against the in-process model instead of spawned workers loading htdemucs
+    pool = ThreadPoolExecutor(max_workers=4)
+    monkeypatch.setattr(separator, "get_pool", lambda: pool)
+    yield separator.model
+    pool.shutdown()
+
+
+@pytest.mark.parametrize("workers", [2, 4, 16, 32])
+def test_parallel_separation_matches_single_pass(tiny_model, monkeypatch, workers):
+    monkeypatch.setattr(separator, "SEPARATION_WORKERS", workers)
+    wav = torch.from_numpy(np.random.default_rng(1).standard_normal((2, 30 * 44100)).astype(np.float32))
+    with torch.no_grad():
+        full = separator.run_model(wav).numpy()
+        parallel = separator.run_model_parallel(wav).numpy()
+    assert parallel.shape == full.shape
+    np.testing.assert_allclose(parallel, full, atol=1e-3 * np.abs(full).max())
+
+
+@pytest.fixture
+def long_wav(tmp_path):
+    import soundfile as sf
+    path = tmp_path / "track.wav"
+    sf.write(path, np.random.default_rng(2).uniform(-0.5, 0.5, (12 * 44100, 2)).astype(np.float32), 44100)
+    return str(path)
+
+
+def stream(wav_path, stems_dir, **kwargs):
+    return separator.separate_stream(wav_path, str(stems_dir), {"mean": 0.0, "std": 1.0}, window_seconds=4,
+                                     context_seconds=0.5, **kwargs)
+
+
+def test_stream_writes_every_stem(tiny_model, tmp_path, long_wav, monkeypatch):
+    monkeypatch.setattr(separator, "STEM_FORMAT", "wav")
+    with torch.no_grad():
+        result = stream(long_wav, tmp_path / "stems")
+    assert result["status"] == "success"
+    assert sorted(os.listdir(tmp_path / "stems")) == sorted(f"{name}.wav" for name in tiny_model.sources)
+
+
+def test_cancelled_stream_leaves_no_partial_stems(tiny_model, tmp_path, long_wav, monkeypatch):
+    opened = []
+    real_soundfile = separator.sf.SoundFile
+
+    def tracked(*args, **kwargs):
+        handle = real_soundfile(*args, **kwargs)
+        opened.append(handle)
+        return handle
+
+    def on_chunk(stems_dir, seconds_ready):
+        raise procs.Cancelled("cancelled after the first window")
+
+    monkeypatch.setattr(separator.sf, "SoundFile", tracked)
+    with torch.no_grad(), pytest.raises(procs.Cancelled):
+        stream(long_wav, tmp_path / "stems", on_chunk=on_chunk)
+    assert len(opened) > 1 and all(handle.closed for handle in opened)
+    assert os.listdir(tmp_path / "stems") == []
+
+
+def test_failed_window_leaves_no_partial_stems(tiny_model, tmp_path, long_wav, monkeypatch):
+    real_run_model = separator.run_model
+    calls = []
+
+    def failing_run_model(*args, **kwargs):
+        calls.append(1)
+        if len(calls) > 1:
+            raise RuntimeError("model failed")
+        return real_run_model(*args, **kwargs)
+
+    monkeypatch.setattr(separator, "run_model", failing_run_model)
+    with torch.no_grad(), pytest.raises(RuntimeError):
+        stream(long_wav, tmp_path / "stems")
+    assert os.listdir(tmp_path / "stems") == []
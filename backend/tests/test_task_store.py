@@ -0,0 +1,75 @@
+import threading
+import time
+
+import pytest
+
+from task_store import MemoryTaskStore, SQLiteTaskStore
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return MemoryTaskStore()
+    return SQLiteTaskStore(str(tmp_path / "tasks.db"))
+
+
+def run_threads(count, target):
+    threads = [threading.Thread(target=target, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def test_concurrent_modify_keeps_every_change(store):
+    store.set("t", {"status": "processing", "count": 0})
+
+    def increment(record):
+        count = record["count"]
+        time.sleep(0.0005)  # widen the window between reading and writing
+        record["count"] = count + 1
+
+    run_threads(8, lambda i: [store.modify("t", increment) for _ in range(20)])
+    assert store.get("t")["count"] == 160
+
+
+def test_concurrent_updates_merge_all_fields(store):
+    store.set("t", {"status": "processing"})
+    run_threads(16, lambda i: store.update("t", **{f"part_{i}": i}))
+    record = store.get("t")
+    assert all(record[f"part_{i}"] == i for i in range(16))
+
+
+def test_late_write_does_not_overwrite_cancellation(store):
+    # The API's settle(): store a final record unless the task was cancelled meanwhile
+    store.set("t", {"status": "processing"})
+    cancelled = threading.Event()
+
+    def settle(record):
+        cancelled.wait(0.5)
+        if record.get("status") != "cancelled":
+            record.update(status="completed")
+
+    def cancel(record):
+        record.update(status="cancelled")
+
+    settler = threading.Thread(target=store.modify, args=("t", settle))
+    settler.start()
+    time.sleep(0.05)
+    canceller = threading.Thread(target=store.modify, args=("t", cancel))
+    canceller.start()
+    cancelled.set()
+    settler.join()
+    canceller.join()
+    # The cancel waited for the settle that was already running, then won
+    assert store.get("t")["status"] == "cancelled"
+
+
+def test_modify_notifies_listeners_outside_the_lock():
+    store = MemoryTaskStore()
+    seen = []
+    # A listener that reads the store would deadlock if notified while the lock is held
+    store.add_listener(lambda task_id: seen.append(store.get(task_id)["n"]))
+    store.set("t", {"n": 0})
+    store.update("t", n=1)
+    assert seen == [0, 1]
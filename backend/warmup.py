@@ -0,0 +1,87 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import procs
+
+# Steps to run at startup; readiness waits for every one of them
+WARMUP_STEPS = [s.strip() for s in os.environ.get("WARMUP_STEPS", "ffmpeg,demucs,musicgen").split(",") if s.strip()]
+
+
+class Warmup:
+    """
+    Runs the startup steps (model loads, tool probes) in the background and records each
+    one's state - pending, running, ready or failed - with its timing and error. The API
+    is live as soon as it serves requests; it is ready once every step has succeeded.
+    """
+
+    def __init__(self):
+        self.steps = OrderedDict()
+        self._fns = {}
+        self._lock = threading.Lock()
+        self.started = time.time()
+
+    def add(self, name: str, fn):
+        self._fns[name] = fn
+        self.steps[name] = {"state": "pending", "seconds": None, "error": None}
+
+    def run_step(self, name: str):
+        with self._lock:
+            self.steps[name] = {"state": "running", "seconds": None, "error": None}
+        print(f"Warmup: {name} starting...")
+        start = time.perf_counter()
+        try:
+            detail = self._fns[name]()
+            state = {"state": "ready", "seconds": round(time.perf_counter() - start, 2), "error": None}
+            if detail:
+                state["detail"] = detail
+            print(f"Warmup: {name} ready in {state['seconds']}s")
+        except Exception as e:
+            state = {"state": "failed", "seconds": round(time.perf_counter() - start, 2), "error": str(e)}
+            print(f"Warmup: {name} failed: {e}")
+        with self._lock:
+            self.steps[name] = state
+
+    def start(self, loop):
+        """Schedules every step on the loop's default executor; steps run concurrently."""
+        for name in self.steps:
+            loop.run_in_executor(None, self.run_step, name)
+
+    def ready(self) -> bool:
+        return all(step["state"] == "ready" for step in self.steps.values())
+
+    def report(self) -> dict:
+        with self._lock:
+            steps = {name: dict(step) for name, step in self.steps.items()}
+        return {"ready": self.ready(), "uptime_seconds": round(time.time() - self.started, 1), "steps": steps}
+
+
+def probe_ffmpeg():
+    """Checks that ffmpeg and ffprobe run and returns the ffmpeg version line."""
+    versions = {}
+    for tool in ("ffmpeg", "ffprobe"):
+        result = procs.run([tool, "-version"], "probe", check=False)
+        if result.returncode != 0:
+            raise RuntimeError(f"{tool} -version exited with {result.returncode}")
+        versions[tool] = result.stdout.splitlines()[0] if result.stdout else ""
+    return versions
+
+
+def warm_musicgen():
+    import generate
+    generate.load_model()
+    return generate.model_profile
+
+
+def warm_demucs():
+    import torchaudio
+    try:
+        torchaudio.set_audio_backend("soundfile")
+    except Exception:
+        pass
+    from separator import load_separator, parallel_enabled, warm_pool
+    import remix, mixer
+    load_separator()
+    if parallel_enabled():
+        warm_pool()
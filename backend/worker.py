@@ -0,0 +1,174 @@
+"""
+Compute worker for EXECUTION_MODE=queue: pulls separation/generation/mix/analysis jobs from
+the shared job queue, runs them and stores their results, while API nodes only enqueue and
+serve. Start as many as the hardware allows, on this machine or others that share the
+backend directory (processed/, uploads/ and the SQLite databases):
+
+    python worker.py                    # every lane, with the scheduler's concurrency limits
+    python worker.py --lanes separate   # e.g. GPU nodes that only separate
+"""
+import argparse
+import json
+import os
+import signal
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+os.environ["TORCHAUDIO_BACKEND"] = "soundfile"
+
+import metrics
+import procs
+from job_queue import WORKER_STALE_SECONDS, decode_args, get_job_queue, resolve_job
+from scheduler import DEFAULT_LIMITS
+from task_store import create_task_store
+from warmup import WARMUP_STEPS, Warmup, probe_ffmpeg, warm_demucs, warm_musicgen
+
+PROCESSED_DIR = "processed"
+WORKER_POLL_SECONDS = float(os.environ.get("WORKER_POLL_SECONDS", "0.5"))
+WORKER_HEARTBEAT_SECONDS = float(os.environ.get("WORKER_HEARTBEAT_SECONDS", "5"))
+# Serves this worker's Prometheus metrics (stage timings, cache hits) when set
+WORKER_METRICS_PORT = int(os.environ.get("WORKER_METRICS_PORT", "0"))
+
+logger = metrics.get_logger("remix.worker")
+
+
+class Worker:
+    """Claims jobs for its lanes while it has free slots; each lane runs on its own thread pool."""
+
+    def __init__(self, queue, tasks, lanes: dict):
+        self.queue = queue
+        self.tasks = tasks
+        self.lanes = lanes
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.started = time.time()
+        self.executors = {lane: ThreadPoolExecutor(max_workers=n, thread_name_prefix=f"job-{lane}") for lane, n in lanes.items()}
+        self.running = {}  # job_id -> job
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def free_lanes(self) -> list:
+        with self._lock:
+            busy = [job["type"] for job in self.running.values()]
+        return [lane for lane, n in self.lanes.items() if busy.count(lane) < n]
+
+    def run(self):
+        logger.info(f"Worker {self.worker_id} serving {self.lanes}")
+        self.heartbeat()
+        threading.Thread(target=self.heartbeat_loop, daemon=True).start()
+        while not self._stop.is_set():
+            job = self.queue.claim(self.worker_id, self.free_lanes())
+            if job is None:
+                self._stop.wait(WORKER_POLL_SECONDS)
+                continue
+            with self._lock:
+                self.running[job["job_id"]] = job
+            self.executors[job["type"]].submit(self.execute, job)
+        # Let running jobs finish; unclaimed ones stay queued for other workers
+        for executor in self.executors.values():
+            executor.shutdown(wait=True)
+        self.queue.unregister(self.worker_id)
+        logger.info(f"Worker {self.worker_id} stopped")
+
+    def execute(self, job: dict):
+        job_id = job["job_id"]
+        metrics.QUEUE_WAIT.observe(job["started_at"] - job["enqueued_at"], type=job["type"])
+        started = time.perf_counter()
+        try:
+            fn = resolve_job(job["fn"])
+            args = decode_args(job["args"], self.tasks)
+            self.sync_cancellations([job])
+            # Spans are collected under the job id and handed back to the API with the result
+            result = metrics.run_traced(job_id, procs.run_for_task, job["task_id"], fn, *args)
+            json.dumps(result)
+            self.queue.finish(job_id, self.worker_id, result=result, spans=metrics.pop_spans(job_id))
+        except Exception as e:
+            logger.info(f"Job {job_id} ({job['fn']}) failed: {e}")
+            self.queue.finish(job_id, self.worker_id, error=str(e), spans=metrics.pop_spans(job_id))
+        finally:
+            metrics.JOB_DURATION.observe(time.perf_counter() - started, type=job["type"])
+            with self._lock:
+                self.running.pop(job_id, None)
+
+    def heartbeat(self):
+        with self._lock:
+            jobs = list(self.running.values())
+        self.queue.heartbeat(self.worker_id, self.lanes, [job["job_id"] for job in jobs], self.started)
+        self.sync_cancellations(jobs)
+
+    def sync_cancellations(self, jobs: list):
+        # DELETE /api/task marks the shared task record; the job's own processes are stopped here
+        for task_id in {job["task_id"] for job in jobs if job["task_id"]}:
+            if (self.tasks.get(task_id) or {}).get("status") == "cancelled":
+                procs.cancel(task_id)
+
+    def heartbeat_loop(self):
+        while not self._stop.wait(WORKER_HEARTBEAT_SECONDS):
+            try:
+                self.heartbeat()
+                # Any live worker takes over the jobs of workers that died
+                requeued = self.queue.recover(WORKER_STALE_SECONDS)
+                if requeued:
+                    logger.info(f"Requeued {requeued} job(s) from unresponsive workers")
+            except Exception as e:
+                logger.info(f"Heartbeat failed: {e}")
+
+    def stop(self, *_):
+        self._stop.set()
+
+
+def serve_metrics(port: int):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = metrics.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("0.0.0.0", port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run queued remix jobs")
+    parser.add_argument("--lanes", default=os.environ.get("WORKER_LANES", ",".join(DEFAULT_LIMITS)),
+                        help="comma-separated job types to serve (separate, generate, mix, analyze)")
+    args = parser.parse_args()
+    lanes = {lane.strip(): DEFAULT_LIMITS[lane.strip()] for lane in args.lanes.split(",") if lane.strip()}
+
+    os.makedirs(PROCESSED_DIR, exist_ok=True)
+    # Progress has to reach the API nodes, so the task store defaults to the shared SQLite one
+    worker = Worker(get_job_queue(PROCESSED_DIR), create_task_store(PROCESSED_DIR, default="sqlite"), lanes)
+    signal.signal(signal.SIGTERM, worker.stop)
+    signal.signal(signal.SIGINT, worker.stop)
+    if WORKER_METRICS_PORT:
+        serve_metrics(WORKER_METRICS_PORT)
+
+    # Load the models this worker's lanes need before taking jobs
+    warmup = Warmup()
+    steps = {"ffmpeg": probe_ffmpeg}
+    if "separate" in lanes:
+        steps["demucs"] = warm_demucs
+    if "generate" in lanes:
+        steps["musicgen"] = warm_musicgen
+    for step, fn in steps.items():
+        if step in WARMUP_STEPS:
+            warmup.add(step, fn)
+            warmup.run_step(step)
+
+    try:
+        worker.run()
+    finally:
+        metrics.stop_logging()
+
+
+if __name__ == "__main__":
+    main()
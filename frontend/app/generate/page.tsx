@@ -4,9 +4,10 @@ import { Navbar } from "@/components/Navbar";
 import { MoodSelector } from "@/components/MoodSelector";
 import { LanguageSelector } from "@/components/LanguageSelector";
 import { MusicPlayer } from "@/components/MusicPlayer";
-import { useState, useEffect } from "react";
+import { useState, useEffect, useRef } from "react";
 import { Wand2, Sparkles, Music, Zap, Palette, Sun, Waves } from "lucide-react";
 import { cn } from "@/lib/utils";
+import { watchTask, cancelTask } from "@/lib/tasks";
 
 export default function GeneratePage() {
     const [mood, setMood] = useState("");
@@ -41,31 +42,41 @@ export default function GeneratePage() {
         checkBackendStatus();
     }, []);
 
+    // The task being watched; it is cancelled on the backend when the user stops it or leaves the page
+    const activeTask = useRef<{ id: string; stop: () => void } | null>(null);
+
+    const abortActiveTask = () => {
+        const task = activeTask.current;
+        if (!task) return;
+        activeTask.current = null;
+        task.stop();
+        cancelTask(BACKEND_URL, task.id);
+    };
+
+    useEffect(() => {
+        return () => abortActiveTask();
+    }, []);
+
     const pollTaskStatus = async (taskId: string, onComplete: (result: any) => void) => {
-        const checkStatus = async () => {
-            try {
-                const response = await fetch(`${BACKEND_URL}/api/task-status/${taskId}`);
-                const data = await response.json();
-
-                if (data.status === 'completed') {
-                    onComplete(data);
-                    return true;
-                } else if (data.status === 'error') {
-                    alert("Generation failed: " + data.message);
-                    setIsGenerating(false);
-                    return true;
-                }
-                return false;
-            } catch (error) {
-                console.error("Polling error:", error);
-                return false;
+        const stop = watchTask(BACKEND_URL, taskId, (data) => {
+            if (data.status === 'completed') {
+                activeTask.current = null;
+                onComplete(data);
+                return true;
+            } else if (data.status === 'error' || data.status === 'cancelled') {
+                activeTask.current = null;
+                alert("Generation failed: " + data.message);
+                setIsGenerating(false);
+                return true;
             }
-        };
+            return false;
+        });
+        activeTask.current = { id: taskId, stop };
+    };
 
-        const interval = setInterval(async () => {
-            const isDone = await checkStatus();
-            if (isDone) clearInterval(interval);
-        }, 2000);
+    const handleCancel = () => {
+        abortActiveTask();
+        setIsGenerating(false);
     };
 
     const handleGenerate = async () => {
@@ -195,6 +206,15 @@ export default function GeneratePage() {
                                 </div>
                             )}
                         </button>
+
+                        {isGenerating && (
+                            <button
+                                onClick={handleCancel}
+                                className="w-full py-3 rounded-2xl font-bold text-sm text-gray-400 hover:text-white bg-white/5 hover:bg-white/10 border border-white/10 transition-all"
+                            >
+                                Cancel
+                            </button>
+                        )}
                     </div>
 
                     <div className="glass-panel p-10 rounded-[2.5rem] min-h-[500px] flex flex-col items-center justify-center text-center relative overflow-hidden group">
@@ -4,9 +4,10 @@ import { Navbar } from "@/components/Navbar";
 import { FileUpload } from "@/components/FileUpload";
 import { MoodSelector } from "@/components/MoodSelector";
 import { MusicPlayer } from "@/components/MusicPlayer";
-import { useState, useEffect } from "react";
+import { useState, useEffect, useRef } from "react";
 import { Sliders, Music, Shuffle, Sparkles, Sun, Waves, Zap, Palette, Download } from "lucide-react";
 import { cn } from "@/lib/utils";
+import { watchTask, cancelTask, describeProgress } from "@/lib/tasks";
 
 export default function RemixPage() {
     // Mode toggle: 'single' (stem separation) or 'blend' (mix two tracks)
@@ -29,6 +30,7 @@ export default function RemixPage() {
     const [genre, setGenre] = useState("Pop");
     const [isExporting, setIsExporting] = useState(false);
     const [finalMixUrl, setFinalMixUrl] = useState<string | null>(null);
+    const [previewUrl, setPreviewUrl] = useState<string | null>(null);
     const [backendStatus, setBackendStatus] = useState<'checking' | 'connected' | 'disconnected'>('checking');
     const [theme, setTheme] = useState<'space' | 'sunset' | 'ocean' | 'cyberpunk'>('space');
 
@@ -56,45 +58,69 @@ export default function RemixPage() {
         checkBackendStatus();
     }, []);
 
+    // Live low-resolution preview while volumes/mood are adjusted; Export Master renders full quality
+    useEffect(() => {
+        if (mode !== 'single' || !stemsData?.stems_dir) return;
+        const timer = setTimeout(async () => {
+            try {
+                const response = await fetch(`${BACKEND_URL}/api/mix-preview`, {
+                    method: "POST",
+                    headers: { "Content-Type": "application/json" },
+                    body: JSON.stringify({ stems_dir: stemsData.stems_dir, volumes, mood, genre, duration: 20 }),
+                });
+                const data = await response.json();
+                if (data.status === "success") setPreviewUrl(`${BACKEND_URL}/api/download/${data.file}`);
+            } catch (error) {
+                console.error("Preview error:", error);
+            }
+        }, 400);
+        return () => clearTimeout(timer);
+    }, [mode, stemsData, volumes, mood, genre]);
+
     const [fastMode, setFastMode] = useState(false);
     const [turboMode, setTurboMode] = useState(true); // User wants speed, so Turbo is default now
     const [processingStep, setProcessingStep] = useState<string>("");
 
-    const pollTaskStatus = async (taskId: string, onComplete: (result: any) => void) => {
-        let attempts = 0;
-        const checkStatus = async () => {
-            attempts++;
-            try {
-                const response = await fetch(`${BACKEND_URL}/api/task-status/${taskId}`);
-                const data = await response.json();
+    // The task being watched; it is cancelled on the backend when the user stops it, starts another or leaves the page
+    const activeTask = useRef<{ id: string; stop: () => void } | null>(null);
 
-                if (data.status === 'completed') {
-                    onComplete(data.result || data);
-                    return true;
-                } else if (data.status === 'error') {
-                    alert("Processing failed: " + data.message);
-                    setIsProcessing(false);
-                    setIsExporting(false);
-                    return true;
-                }
+    const abortActiveTask = () => {
+        const task = activeTask.current;
+        if (!task) return;
+        activeTask.current = null;
+        task.stop();
+        cancelTask(BACKEND_URL, task.id);
+    };
+
+    useEffect(() => {
+        return () => abortActiveTask();
+    }, []);
 
-                // Update processing step based on time
-                if (attempts < 3) setProcessingStep("Turbo Extracting first 15s...");
-                else if (attempts < 8) setProcessingStep("Loading Turbo AI Model...");
-                else if (attempts < 15) setProcessingStep("Splitting Turbo Stems...");
-                else setProcessingStep("Finishing Turbo Preview...");
+    const handleCancel = () => {
+        abortActiveTask();
+        setIsProcessing(false);
+        setIsExporting(false);
+    };
 
-                return false;
-            } catch (error) {
-                console.error("Polling error:", error);
-                return false;
+    const pollTaskStatus = async (taskId: string, onComplete: (result: any) => void) => {
+        abortActiveTask();
+        const stop = watchTask(BACKEND_URL, taskId, (data) => {
+            if (data.status === 'completed') {
+                activeTask.current = null;
+                onComplete(data.result || data);
+                return true;
+            } else if (data.status === 'error' || data.status === 'cancelled') {
+                activeTask.current = null;
+                alert("Processing failed: " + data.message);
+                setIsProcessing(false);
+                setIsExporting(false);
+                return true;
             }
-        };
 
-        const interval = setInterval(async () => {
-            const isDone = await checkStatus();
-            if (isDone) clearInterval(interval);
-        }, 1500); // Poll faster for Turbo
+            setProcessingStep(describeProgress(data, "Loading Turbo AI Model..."));
+            return false;
+        });
+        activeTask.current = { id: taskId, stop };
     };
 
     const handleSingleFileUpload = async (selectedFile: File) => {
@@ -354,6 +380,12 @@ export default function RemixPage() {
                                             <div className="mt-6 max-w-xs mx-auto bg-white/5 h-2 rounded-full overflow-hidden border border-white/5 p-0.5">
                                                 <div className="h-full bg-primary rounded-full shimmer w-full shadow-[0_0_15px_rgba(139,92,246,0.5)]"></div>
                                             </div>
+                                            <button
+                                                onClick={handleCancel}
+                                                className="mt-4 px-6 py-2 rounded-xl font-bold text-sm text-gray-400 hover:text-white bg-white/5 hover:bg-white/10 border border-white/10 transition-all"
+                                            >
+                                                Cancel
+                                            </button>
                                         </div>
                                     </div>
                                 )}
@@ -498,6 +530,10 @@ export default function RemixPage() {
                                         </div>
                                     )}
 
+                                    {mode === 'single' && previewUrl && (
+                                        <audio controls src={previewUrl} className="w-full" />
+                                    )}
+
                                     <div className="p-6 rounded-3xl bg-black/20 border border-white/5 space-y-2">
                                         <MoodSelector
                                             selectedMood={mood} onSelectMood={setMood}
@@ -560,6 +596,15 @@ export default function RemixPage() {
                                             </div>
                                         </button>
 
+                                        {isExporting && mode === 'blend' && smartRemix && (
+                                            <button
+                                                onClick={handleCancel}
+                                                className="w-full py-3 rounded-2xl font-bold text-sm text-gray-400 hover:text-white bg-white/5 hover:bg-white/10 border border-white/10 transition-all"
+                                            >
+                                                Cancel
+                                            </button>
+                                        )}
+
                                         {isProcessing && (
                                             <div className="flex items-center gap-2 justify-center py-2 animate-pulse">
                                                 <div className="w-1 h-1 bg-primary rounded-full" />
@@ -14,6 +14,8 @@ export function MusicPlayer({ src, title = "Generated Track", autoPlay = false }
     const [isPlaying, setIsPlaying] = useState(false);
     const [progress, setProgress] = useState(0);
     const audioRef = useRef<HTMLAudioElement>(null);
+    // Stream a compressed encode for playback; the download button keeps the full-quality WAV
+    const playbackSrc = src && src.includes("/api/download/") ? `${src}${src.includes("?") ? "&" : "?"}format=mp3` : src;
 
     useEffect(() => {
         if (src && autoPlay && audioRef.current) {
@@ -105,7 +107,7 @@ export function MusicPlayer({ src, title = "Generated Track", autoPlay = false }
 
             <audio
                 ref={audioRef}
-                src={src || undefined}
+                src={playbackSrc || undefined}
                 onTimeUpdate={handleTimeUpdate}
                 onEnded={() => setIsPlaying(false)}
             />
@@ -0,0 +1,76 @@
+export type TaskUpdate = {
+  status: string;
+  progress?: number;
+  stage?: string;
+  eta_seconds?: number | null;
+  queue_position?: number;
+  message?: string;
+  [key: string]: any;
+};
+
+/**
+ * Follows a background task through the server-sent events stream at /api/task-events.
+ * Falls back to polling /api/task-status if the browser or a proxy can't keep the stream open.
+ * `onUpdate` gets every change; returning true (or reaching a terminal status) stops watching.
+ * Returns an unsubscribe function that closes the stream or stops the polling.
+ */
+export function watchTask(backendUrl: string, taskId: string, onUpdate: (data: TaskUpdate) => boolean): () => void {
+  const isTerminal = (data: TaskUpdate) => ["completed", "error", "cancelled", "not_found"].includes(data.status);
+  let stopped = false;
+  let interval: ReturnType<typeof setInterval> | undefined;
+  let source: EventSource | undefined;
+
+  const stop = () => {
+    stopped = true;
+    if (interval !== undefined) clearInterval(interval);
+    source?.close();
+  };
+
+  const poll = () => {
+    interval = setInterval(async () => {
+      try {
+        const response = await fetch(`${backendUrl}/api/task-status/${taskId}`);
+        const data = await response.json();
+        if (!stopped && (onUpdate(data) || isTerminal(data))) stop();
+      } catch (error) {
+        console.error("Polling error:", error);
+      }
+    }, 2000);
+  };
+
+  if (typeof EventSource === "undefined") {
+    poll();
+    return stop;
+  }
+
+  source = new EventSource(`${backendUrl}/api/task-events/${taskId}`);
+  source.onmessage = (event) => {
+    const data: TaskUpdate = JSON.parse(event.data);
+    if (!stopped && (onUpdate(data) || isTerminal(data))) stop();
+  };
+  source.onerror = () => {
+    source?.close();
+    if (!stopped) poll();
+  };
+  return stop;
+}
+
+/**
+ * Asks the backend to cancel a task (DELETE /api/task/{id}): queued jobs are withdrawn and
+ * running ones stopped. keepalive lets the request finish while the page is being left.
+ */
+export async function cancelTask(backendUrl: string, taskId: string) {
+  try {
+    await fetch(`${backendUrl}/api/task/${taskId}`, { method: "DELETE", keepalive: true });
+  } catch (error) {
+    console.error("Cancel error:", error);
+  }
+}
+
+export function describeProgress(data: TaskUpdate, fallback: string) {
+  if (data.queue_position && data.queue_position > 0) return `Waiting in queue (#${data.queue_position})...`;
+  if (!data.stage) return fallback;
+  const stage = data.stage.charAt(0).toUpperCase() + data.stage.slice(1);
+  const eta = data.eta_seconds ? ` - about ${Math.ceil(data.eta_seconds)}s left` : "";
+  return `${stage} ${Math.round(data.progress || 0)}%${eta}`;
+}